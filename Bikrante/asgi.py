@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Bikrante.settings')
+##! serve the catalog from the async views (shopapp.async_views), see ASGI in settings.py
+os.environ.setdefault('BIKRANTE_ASGI', '1')
 
 application = get_asgi_application()
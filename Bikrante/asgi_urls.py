@@ -0,0 +1,12 @@
+"""
+URL configuration of the ASGI entry point (Bikrante/asgi.py): Bikrante.urls
+with the shop routes of shopapp.async_urls, which serve the async views.
+"""
+from django.urls import include, path
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('', include('shopapp.async_urls')),
+    *wsgi_urlpatterns,
+]
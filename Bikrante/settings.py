@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shopapp.metrics.MetricsMiddleware',  ##! per-view timings, served at /metrics
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,11 +57,13 @@ MIDDLEWARE = [
 
 ]
 
-ROOT_URLCONF = 'Bikrante.urls'
+##! set by Bikrante/asgi.py: serve the catalog from the async views (shopapp.async_views)
+ASGI = os.environ.get('BIKRANTE_ASGI') == '1'
+ROOT_URLCONF = 'Bikrante.asgi_urls' if ASGI else 'Bikrante.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'shopapp.metrics.TimedDjangoTemplates',  # DjangoTemplates timing renders for /metrics
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -69,6 +72,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'shopapp.context_processors.catalog_cache',
+                'shopapp.context_processors.cart',
             ],
         },
     },
@@ -84,9 +89,63 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # reuse connections instead of opening one per request; under ASGI every
+        # request runs its queries in a thread of its own, so nothing could be reused
+        'CONN_MAX_AGE': 0 if ASGI else 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+##! applied to every new SQLite connection by shopapp.db.apply_sqlite_pragmas
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',  # safe with WAL, fsync only at checkpoints
+    'busy_timeout': 5000,  # ms to wait for the write lock instead of failing
+    'mmap_size': 268435456,  # 256 MiB memory mapped reads
+    'cache_size': -65536,  # 64 MiB page cache (negative = KiB)
+    'temp_store': 'MEMORY',
+}
+##! WAL lets readers run while a write is in progress. The journal mode is stored in the
+##! database file: switch it once with `manage.py sqlite_journal_mode wal`, or set
+##! BIKRANTE_SQLITE_WAL=1 to have every connection of the writer enforce it
+SQLITE_JOURNAL_MODE = 'WAL' if os.environ.get('BIKRANTE_SQLITE_WAL') == '1' else None
+
+##! production SQLite: GET/HEAD requests read through a separate read-only
+##! connection (set BIKRANTE_SQLITE_READ_ALIAS=1 to enable)
+DATABASE_READ_ALIAS = 'readonly'
+if os.environ.get('BIKRANTE_SQLITE_READ_ALIAS') == '1':
+    DATABASES[DATABASE_READ_ALIAS] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'CONN_MAX_AGE': 0 if ASGI else 60,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['shopapp.db.ReadOnlyRequestRouter']
+    MIDDLEWARE.insert(0, 'shopapp.db.ReadOnlyRequestMiddleware')
+
+
+# Cache
+# Local memory is per process: with several worker processes switch to
+# shopapp.cache.CountingFileBasedCache (LOCATION = a shared directory) so a
+# catalog change invalidates the pages of every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'shopapp.cache.CountingLocMemCache',
+        'LOCATION': 'bikrante',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+}
+CATALOG_PAGE_CACHE_TIMEOUT = 300  # seconds an anonymous catalog page stays cached
+SEARCH_RESULT_CACHE_TIMEOUT = 300  # seconds a query's ranked product ids stay cached
+SEARCH_RESULT_CACHE_MAX_IDS = 5000  # longer result lists are recomputed every time
+SEARCH_MAX_RESULTS = 1000  # best matches ranked per query, shown as "1000+"
+##! HTTP caching of anonymous catalog pages, revalidated with ETag/Last-Modified (shopapp.cache.conditional_catalog_page)
+CATALOG_BROWSER_MAX_AGE = 60  # seconds browsers and CDNs reuse a page without asking
+CATALOG_STALE_WHILE_REVALIDATE = 300  # seconds a stale page may be served while it is revalidated
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -136,6 +195,50 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+##! resized JPEG/WebP copies of product and category images (shopapp.images)
+IMAGE_DERIVATIVE_WIDTHS = (300, 600)  # srcset widths, card grids use the 300w copy
+IMAGE_DERIVATIVE_WORKERS = 2  # processes resizing uploads in the background
+
+##! Product view counter: views are buffered in memory and written in batches
+VIEW_COUNTER_FLUSH_INTERVAL = 30  # seconds between background flushes
+VIEW_COUNTER_MAX_PENDING = 500  # flush early once this many products have pending views
+
+##! Trending products (refreshed with `manage.py refresh_trending`)
+TRENDING_WINDOWS = (7,)  # windows (in days) with a precomputed ranking
+TRENDING_TOP_K = 50  # products stored per window
+TRENDING_HALF_LIFE_HOURS = 24  # a view loses half its weight after this long
+TRENDING_BUCKET_RETENTION_DAYS = 30  # hourly view buckets older than this (or the longest window) are pruned
+TRENDING_MAX_AGE_MINUTES = 120  # twice an hourly refresh; older rankings are ignored and scored live
+
+##! Carts (shopapp.cart)
+CART_MAX_QUANTITY = 99  # units of one product per cart line
+LOGIN_URL = 'login'  # checkout sends visitors here and back via ?next=
+
+##! "Frequently bought together" (refreshed with `manage.py refresh_recommendations`)
+RECOMMENDER_TOP_K = 20  # neighbours stored per product
+RECOMMENDER_LIKE_WEIGHT = 0.5  # weight of shared likes relative to shared orders
+
+##! Navbar typeahead (shopapp.typeahead), an in-memory prefix index per process
+TYPEAHEAD_LIMIT = 8  # product suggestions per keystroke
+TYPEAHEAD_MIN_REBUILD_INTERVAL = 30  # seconds between rebuilds after catalog changes
+
+##! Request metrics (shopapp.metrics), scraped by Prometheus from /metrics
+METRICS_ENABLED = True
+METRICS_SAMPLE_RATE = 1.0  # share of requests timed in detail, lower it on busy sites
+METRICS_SLOW_QUERY_MS = 200  # log SQL statements slower than this, None disables
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')  # addresses that may scrape /metrics (staff always can)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'shopapp': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -1,9 +1,9 @@
 from django.contrib import admin
-from .models import Category, Product, Review, Order, OrderItem, UserProfile
+from .models import Category, Product, Promotion, Review, Order, OrderItem, UserProfile, TrendingProduct, Cart, CartItem, ProductNeighbor
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'image', 'slug', 'discount_percentage']
+    list_display = ['name', 'image', 'slug', 'discount_percentage', 'active_discount_percentage']
     list_display_links = ['name']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
@@ -11,6 +11,13 @@ class CategoryAdmin(admin.ModelAdmin):
     list_editable = ['discount_percentage']
     ordering = ['name']
 
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'category', 'discount_percentage', 'starts_at', 'ends_at']
+    list_filter = ['category', 'starts_at']
+    search_fields = ['name', 'category__name']
+    ordering = ['-starts_at']
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = [
@@ -18,6 +25,7 @@ class ProductAdmin(admin.ModelAdmin):
         'category',
         'description',
         'price',
+        'effective_price',
         'brand_name',
         'sku',
         'tags',
@@ -28,6 +36,7 @@ class ProductAdmin(admin.ModelAdmin):
         'is_hot',
         'sales_count',
         'views_count',
+        'like_count',
         'created_at',
         'last_viewed',
         'slug'
@@ -37,7 +46,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ['category', 'availability', 'is_hot', 'created_at','brand_name']
     search_fields = ['name', 'description', 'sku', 'tags']
     list_editable = ['price', 'stock', 'availability', 'is_hot', 'colors', 'sizes']
-    readonly_fields = ['views_count', 'sales_count', 'last_viewed', 'created_at']
+    readonly_fields = ['effective_price', 'views_count', 'sales_count', 'like_count', *Product.RATING_FIELDS, 'neighbor_count', 'last_viewed', 'created_at']
     list_per_page = 20
     ordering = ['-created_at']
 
@@ -45,4 +54,8 @@ class ProductAdmin(admin.ModelAdmin):
 admin.site.register(Review)
 admin.site.register(Order)
 admin.site.register(OrderItem)
-admin.site.register(UserProfile)
\ No newline at end of file
+admin.site.register(UserProfile)
+admin.site.register(TrendingProduct)
+admin.site.register(Cart)
+admin.site.register(CartItem)
+admin.site.register(ProductNeighbor)
@@ -0,0 +1,16 @@
+"""shopapp.urls with the async catalog views swapped in, for the ASGI entry point"""
+from django.urls import path
+
+from . import async_views, urls
+
+ASYNC_VIEWS = {
+    'home': async_views.home,
+    'search': async_views.search,
+    'category-detail': async_views.category_detail,
+    'product-detail': async_views.product_detail,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS.get(pattern.name, pattern.callback), name=pattern.name)
+    for pattern in urls.urlpatterns
+]
@@ -0,0 +1,130 @@
+"""
+Async versions of the busiest catalog views, served by the ASGI entry point
+(Bikrante/asgi.py routes to them through Bikrante.asgi_urls; the WSGI entry
+point keeps the sync views of shopapp.views).
+
+The queries a page needs independently of each other are started together
+with asyncio.gather on the async ORM. Django runs async ORM calls in the
+request's own sync thread, so within one request they still execute one after
+the other; what the ASGI path buys is that a request waiting on the database
+or on a slow client no longer holds a worker thread of its own.
+
+Templates read the user, the session and the cart (navbar, context
+processors), so rendering goes through sync_to_async as well. The page and
+HTTP caching decorators of shopapp.cache accept async views, and the view
+counter only buffers in memory (shopapp.viewcounter flushes in the background).
+"""
+import asyncio
+import logging
+import random
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render
+
+from . import facets, views
+from . import search as search_index
+from .cache import cache_catalog_page, conditional_catalog_page
+from .models import Category, Product
+from .pagination import CursorPage, DEFAULT_SORT, aid_list_page, akeyset_page, get_ordering
+from .viewcounter import record_view
+
+logger = logging.getLogger(__name__)
+
+arender = sync_to_async(render)
+arender_product_listing = sync_to_async(views.render_product_listing)
+aadd_facets = sync_to_async(views.add_facets)
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+@cache_catalog_page()
+async def home(request):
+    products = Product.card_queryset().order_by('-created_at')
+    hot_products, normal_products, categories = await asyncio.gather(
+        _alist(products.filter(is_hot=True)[:views.HOME_SECTION_LIMIT]),
+        _alist(products.filter(is_hot=False)[:views.HOME_SECTION_LIMIT]),
+        _alist(Category.objects.only('name', 'slug', 'image')),
+    )
+    for product in hot_products:
+        product.class_color = random.choice(views.HOT_PRODUCT_COLORS)
+
+    context = {
+        'is_home': True,
+        'categories': categories,
+        'normal_products': normal_products,
+        'hot_products': hot_products,
+        'lazy_sections': list(views.HOME_SECTIONS),
+    }
+    return await arender(request, 'shopapp/index.html', context)
+
+
+async def search(request):
+    """views.search: the ranked ids are cached per query, the page and the facet counts load together"""
+    search_text = request.GET.get("search_text", "").strip()
+    cursor = request.GET.get('cursor')
+    filters = facets.parse_filters(request.GET)
+    context = {
+        'is_home': False,
+        'search_text': search_text,
+    }
+
+    if search_text:
+        try:
+            product_ids = await sync_to_async(search_index.cached_product_ids)(search_text, filters)
+            matches = Product.objects.filter(search_index.match_q(search_text))
+            products, _ = await asyncio.gather(
+                aid_list_page(product_ids, search_index.aload_products, cursor, cap=search_index.MAX_RESULTS),
+                aadd_facets(request, context, matches, filters, search_index.split_terms(search_text)),
+            )
+            context['has_results'] = True
+        except Exception as e:
+            logger.exception("search failed for %r", search_text)
+            products = CursorPage([])
+            context.update({
+                'has_results': False,
+                'error': str(e)
+            })
+    else:
+        ordering = get_ordering(request.GET.get('sort', DEFAULT_SORT))
+        products, _ = await asyncio.gather(
+            akeyset_page(facets.apply_filters(Product.card_queryset(), filters), ordering, cursor),
+            aadd_facets(request, context, Product.objects.all(), filters, 'all'),
+        )
+        context['has_results'] = True
+
+    template = 'shopapp/includes/_search_results.html' if request.htmx else 'shopapp/shop.html'
+    return await arender_product_listing(request, template, context, products)
+
+
+@conditional_catalog_page(views.category_last_modified)
+@cache_catalog_page()
+async def category_detail(request, slug):
+    ordering = get_ordering(request.GET.get('sort', DEFAULT_SORT))
+    # the page is selected by slug, so it doesn't wait for the category row
+    category, products = await asyncio.gather(
+        aget_object_or_404(Category, slug=slug),
+        akeyset_page(Product.card_queryset().filter(category__slug=slug), ordering, request.GET.get('cursor')),
+    )
+    return await arender_product_listing(request, 'shopapp/shop.html', {'category': category}, products)
+
+
+@conditional_catalog_page(views.product_last_modified)
+@cache_catalog_page()
+async def product_detail(request, slug):
+    product = await aget_object_or_404(Product.objects.select_related('category'), slug=slug)
+    record_view(product.pk)  # in memory only, written by the view counter's flush
+    cross_sell_products, upsell_products = await asyncio.gather(
+        _alist(product.get_cross_sell_products()),
+        sync_to_async(product.get_upsell_products)(),  # a list, from up to two queries
+    )
+    context = {
+        'product': product,
+        'cross_sell_products': cross_sell_products,
+        'upsell_products': upsell_products,
+        'breadcrumb_items': views.product_breadcrumb(product),
+    }
+    response = await arender(request, 'shopapp/details.html', context)
+    response.viewed_product_id = product.pk  # still counted when served from the page cache
+    return response
@@ -0,0 +1,394 @@
+"""
+Reproducible latency benchmark of the catalog views.
+
+`seed_catalog` fills an (empty) database with a synthetic catalog: categories,
+products with tags, colors and sizes, users, likes, reviews and orders, all
+drawn from a seeded random generator so two runs with the same arguments
+build the same data. The counters the views read (like_count, sales_count,
+review aggregates), the tag/color/size rows and the search index are brought
+up to date as the signals would have done.
+
+`run_benchmark` then drives the views in process through the Django test
+client and reports, per scenario, the latency percentiles, the queries per
+request and the peak memory allocated while handling a request (measured in a
+separate tracemalloc pass so it doesn't slow the timed requests down).
+`compare` checks a report against a stored baseline.
+
+`run_server_benchmark` compares the two serving paths under concurrent load:
+the sync views through Django's WSGI handler on a pool of threads (as a
+threaded WSGI server runs them) against the async views (Bikrante.asgi_urls)
+through the ASGI handler on one event loop (as uvicorn runs them). It reports
+throughput and latency percentiles per path and scenario.
+
+`manage.py bench_views` runs all of this on a throwaway database.
+"""
+import asyncio
+import io
+import random
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import search
+from .models import Category, Order, OrderItem, Product, ProductAttribute, Review, discounted_price
+
+WORDS = (
+    'camera', 'lens', 'wireless', 'leather', 'cotton', 'smart', 'portable', 'classic', 'sport',
+    'travel', 'kitchen', 'studio', 'gaming', 'organic', 'vintage', 'digital', 'compact', 'pro',
+    'mini', 'ultra', 'home', 'office', 'outdoor', 'kids', 'premium', 'eco', 'silk', 'steel',
+)
+TAGS = ('tech', 'home', 'fashion', 'beauty', 'sport', 'kids', 'office', 'outdoor', 'gift', 'sale')
+COLORS = ('black', 'white', 'red', 'blue', 'green', 'grey', 'pink', 'brown')
+SIZES = ('xs', 's', 'm', 'l', 'xl', 'xxl')
+# an image that ships with the repo's media, only the URL is rendered
+IMAGE = 'product_images/sony_cam.jpg'
+
+SCENARIOS = (
+    'home', 'shop', 'search', 'search-htmx', 'category-detail', 'product-detail', 'wishlist',
+)
+# scenarios with an async view (shopapp.async_views), for run_server_benchmark
+SERVER_SCENARIOS = ('home', 'search', 'category-detail', 'product-detail')
+SERVERS = {'wsgi': 'Bikrante.urls', 'asgi': 'Bikrante.asgi_urls'}  # path -> ROOT_URLCONF
+# no page or result cache: every request runs its view
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def seed_catalog(products=1000, categories=20, users=100, likes_per_user=20, reviews=2000,
+                 orders=500, seed=0, batch_size=5000):
+    """Create the synthetic catalog; returns the number of rows per model"""
+    rng = random.Random(seed)
+    with transaction.atomic():
+        discounts = [rng.choice((0, 0, 5, 10, 20)) for _ in range(categories)]
+        category_rows = Category.objects.bulk_create([
+            Category(name=f"Category {c}", slug=f"bench-category-{c}", discount_percentage=discount,
+                     active_discount_percentage=discount)
+            for c, discount in enumerate(discounts)
+        ])
+        User.objects.bulk_create([
+            User(username=f"bench-user-{u}", email=f"bench-user-{u}@example.com", password='!')
+            for u in range(users)
+        ], batch_size=batch_size)
+        user_ids = list(User.objects.filter(username__startswith='bench-user-').values_list('pk', flat=True))
+
+        for start in range(0, products, batch_size):
+            ProductAttribute.sync(Product.objects.bulk_create([
+                _product(rng, index, category_rows) for index in range(start, min(start + batch_size, products))
+            ], batch_size=batch_size))
+        product_ids = list(Product.objects.filter(sku__startswith='BENCH-').values_list('pk', flat=True))
+
+        Like = Product.likes.through
+        like_rows = {
+            (rng.choice(product_ids), user_id)
+            for user_id in user_ids
+            for _ in range(min(likes_per_user, len(product_ids)))
+        }
+        Like.objects.bulk_create([Like(product_id=p, user_id=u) for p, u in like_rows], batch_size=batch_size)
+
+        Review.objects.bulk_create([
+            Review(product_id=rng.choice(product_ids), user_id=rng.choice(user_ids),
+                   rating=rng.choice((None, 1, 2, 3, 4, 4, 5, 5, 5)), review_text=_sentence(rng, 12))
+            for _ in range(reviews)
+        ], batch_size=batch_size)
+
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+        order_rows = Order.objects.bulk_create([
+            Order(user_id=rng.choice(user_ids), total_price=0, status='Completed') for _ in range(orders)
+        ], batch_size=batch_size)
+        items = []
+        for order in order_rows:
+            for product_id in rng.sample(product_ids, min(rng.randint(1, 4), len(product_ids))):
+                items.append(OrderItem(order=order, product_id=product_id,
+                                       quantity=rng.randint(1, 3), price=prices[product_id]))
+        OrderItem.objects.bulk_create(items, batch_size=batch_size)
+
+        # the counters the signals keep up to date on single saves
+        sold = {}
+        for item in items:
+            sold[item.product_id] = sold.get(item.product_id, 0) + item.quantity
+        by_quantity = {}
+        for product_id, quantity in sold.items():
+            by_quantity.setdefault(quantity, []).append(product_id)
+        for quantity, ids in by_quantity.items():
+            Product.objects.filter(pk__in=ids).update(sales_count=quantity)
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            Product.refresh_like_counts(batch)
+            Product.refresh_rating_aggregates(batch)
+    search.rebuild_index(batch_size=batch_size)
+    cache.clear()
+    return {
+        'categories': len(category_rows), 'products': len(product_ids), 'users': len(user_ids),
+        'likes': len(like_rows), 'reviews': reviews, 'orders': len(order_rows), 'order_items': len(items),
+    }
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _product(rng, index, categories):
+    name = f"{_sentence(rng, 3).title()} {index}"
+    product = Product(
+        category=rng.choice(categories),
+        name=name,
+        slug=f"bench-product-{index}",
+        description=_sentence(rng, 40),
+        price=rng.randint(5, 2000),
+        brand_name=f"Brand {rng.randint(1, 60)}",
+        sku=f"BENCH-{index}",
+        tags=','.join(rng.sample(TAGS, rng.randint(1, 3))),
+        stock=rng.randint(0, 100),
+        availability=rng.random() > 0.05,
+        colors=','.join(rng.sample(COLORS, rng.randint(1, 4))),
+        sizes=','.join(rng.sample(SIZES, rng.randint(0, 4))),
+        image1=IMAGE,
+        image2=IMAGE,
+        is_hot=rng.random() < 0.05,
+    )
+    product.effective_price = discounted_price(product.price, product.category.active_discount_percentage)
+    return product
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _anonymous_urls(rng):
+    """{scenario: (next url function, extra headers)} of the pages anyone can see"""
+    slugs = list(Product.objects.order_by('pk').values_list('slug', flat=True)[:1000])
+    category_slugs = list(Category.objects.order_by('pk').values_list('slug', flat=True))
+
+    def search_url():
+        return f"{reverse('search')}?search_text={'+'.join(rng.sample(WORDS, rng.randint(1, 2)))}"
+
+    return {
+        'home': (lambda: reverse('home'), {}),
+        'shop': (lambda: reverse('shop'), {}),
+        'search': (search_url, {}),
+        'search-htmx': (search_url, {'HTTP_HX_REQUEST': 'true'}),
+        'category-detail': (lambda: reverse('category-detail', args=[rng.choice(category_slugs)]), {}),
+        'product-detail': (lambda: reverse('product-detail', args=[rng.choice(slugs)]), {}),
+    }
+
+
+def _requests(rng):
+    """{scenario: (client, next url function, extra headers)}"""
+    anonymous = Client()
+    member = Client()
+    liker = Product.likes.through.objects.order_by('user_id').values_list('user_id', flat=True).first()
+    user = User.objects.filter(pk=liker).first() or User.objects.order_by('pk').first()
+    if user is not None:
+        member.force_login(user)
+    requests = {name: (anonymous, next_url, headers) for name, (next_url, headers) in _anonymous_urls(rng).items()}
+    requests['wishlist'] = (member, lambda: reverse('wishlist'), {})
+    return requests
+
+
+def run_benchmark(scenarios=SCENARIOS, requests=100, warmup=5, memory_requests=5, cold_cache=True, seed=0):
+    """
+    Latency report of each scenario. With `cold_cache` the cache is cleared
+    before every request, so the views themselves are measured rather than
+    the page cache.
+    """
+    rng = random.Random(seed)
+    report = {}
+    with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+        clients = _requests(rng)
+        for name in scenarios:
+            client, next_url, headers = clients[name]
+            for _ in range(warmup):
+                client.get(next_url(), **headers)
+
+            timings, queries, statuses = [], [], set()
+            for _ in range(requests):
+                url = next_url()
+                if cold_cache:
+                    cache.clear()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.get(url, **headers)
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries.append(len(captured))
+                statuses.add(response.status_code)
+
+            peaks = []
+            for _ in range(memory_requests):
+                url = next_url()
+                if cold_cache:
+                    cache.clear()
+                tracemalloc.start()
+                try:
+                    client.get(url, **headers)
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+
+            report[name] = {
+                'requests': requests,
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'mean_ms': round(sum(timings) / len(timings), 3),
+                'queries_per_request': round(sum(queries) / len(queries), 2),
+                'max_queries': max(queries),
+                'peak_memory_kb': round(max(peaks) / 1024, 1) if peaks else None,
+                'statuses': sorted(statuses),
+            }
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Regressions of `report` against `baseline`: a p95 more than `tolerance`
+    slower, more queries per request, or a scenario answering with an error.
+    """
+    regressions = []
+    for name, result in report.items():
+        if any(status >= 400 for status in result['statuses']):
+            regressions.append(f"{name}: answered {result['statuses']}")
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.1f} ms, baseline {before['p95_ms']:.1f} ms")
+        if result['max_queries'] > before['max_queries']:
+            regressions.append(f"{name}: {result['max_queries']} queries, baseline {before['max_queries']}")
+    return regressions
+
+
+def _wsgi_get(application, url, headers):
+    """Status of a GET through a WSGI application"""
+    path, _, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        **headers,
+    }
+    statuses = []
+    body = application(environ, lambda status, response_headers, exc_info=None: statuses.append(status))
+    try:
+        for _ in body:
+            pass
+    finally:
+        body.close()  # request_finished, as a server would send it
+    return int(statuses[0].split()[0])
+
+
+async def _asgi_get(application, url, headers):
+    """Status of a GET through an ASGI application"""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')] + [
+            (name[5:].lower().replace('_', '-').encode(), value.encode()) for name, value in headers.items()
+        ],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    messages = []
+    received = False
+    disconnected = asyncio.Event()  # never set: the client stays until the response is sent
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+
+def _server_result(timings, statuses, seconds, concurrency):
+    return {
+        'requests': len(timings),
+        'concurrency': concurrency,
+        'throughput_rps': round(len(timings) / seconds, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'statuses': sorted(statuses),
+    }
+
+
+def _run_wsgi(urls, concurrency):
+    application = get_wsgi_application()
+    timings, statuses = [], set()
+
+    def get(url_and_headers):
+        started = time.perf_counter()
+        status = _wsgi_get(application, *url_and_headers)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed, status in pool.map(get, urls):
+            timings.append(elapsed * 1000)
+            statuses.add(status)
+    return _server_result(timings, statuses, time.perf_counter() - started, concurrency)
+
+
+def _run_asgi(urls, concurrency):
+    application = get_asgi_application()
+    timings, statuses = [], set()
+    pending = list(reversed(urls))
+
+    async def worker():
+        while pending:
+            url, headers = pending.pop()
+            started = time.perf_counter()
+            statuses.add(await _asgi_get(application, url, headers))
+            timings.append((time.perf_counter() - started) * 1000)
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return _server_result(timings, statuses, time.perf_counter() - started, concurrency)
+
+
+def run_server_benchmark(scenarios=SERVER_SCENARIOS, requests=200, concurrency=8, warmup=5, cold_cache=True,
+                         seed=0):
+    """
+    {server: {scenario: throughput and latency}} of `requests` anonymous GETs
+    per scenario, `concurrency` at a time, through the WSGI and the ASGI path.
+    Both paths get the same URLs. With `cold_cache` the page and result caches
+    are switched off, so the views themselves are measured.
+    """
+    report = {}
+    for server, urlconf in SERVERS.items():
+        overrides = {'DEBUG': False, 'ALLOWED_HOSTS': ['testserver'], 'ROOT_URLCONF': urlconf}
+        if cold_cache:
+            overrides['CACHES'] = NO_CACHE
+        with override_settings(**overrides):
+            rng = random.Random(seed)  # the same URLs for both servers
+            pages = _anonymous_urls(rng)
+            report[server] = {}
+            for name in scenarios:
+                next_url, headers = pages[name]
+                urls = [(next_url(), headers) for _ in range(warmup + requests)]
+                run = _run_wsgi if server == 'wsgi' else _run_asgi
+                run(urls[:warmup], 1)
+                report[server][name] = run(urls[warmup:], concurrency)
+    return report
@@ -0,0 +1,282 @@
+"""
+Catalog-versioned page and fragment caching.
+
+Every cache key for catalog content contains the current catalog version, a
+counter that the Product/Category/Review save and delete signals bump. A bump
+makes all older page and fragment entries unreachable at once; they simply
+expire. Whole pages are only cached for anonymous visitors, keyed on the path,
+the HX-Request header and the auth state. Templates use the same version
+through the `catalog_version` context variable with `{% cache %}`.
+
+`conditional_catalog_page` adds HTTP validators on top: an ETag and a
+Last-Modified computed by one cheap query per request, so a browser or CDN
+revalidating a page gets a 304 without the view running at all.
+
+The cache backends below count hits and misses per key family (`page`,
+`fragment`, `search`, ...) so the cache can be sized from `cache_stats()`; the
+local-memory one also reports the entries and bytes each family holds.
+"""
+import hashlib
+import threading
+from collections import defaultdict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+PAGE_TIMEOUT = getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 300)
+BROWSER_MAX_AGE = getattr(settings, 'CATALOG_BROWSER_MAX_AGE', 60)
+STALE_WHILE_REVALIDATE = getattr(settings, 'CATALOG_STALE_WHILE_REVALIDATE', 300)
+VERSION_KEY = 'catalog:version'
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_MISSING = object()
+
+
+def _key_family(key):
+    if key.startswith('template.cache.'):
+        return 'fragment'
+    return key.split(':', 1)[0]
+
+
+def _count(key, hit):
+    with _stats_lock:
+        _stats[_key_family(key)]['hits' if hit else 'misses'] += 1
+
+
+class CountingCacheMixin:
+    """Counts hits and misses of get() per key family"""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        _count(key, value is not _MISSING)
+        return default if value is _MISSING else value
+
+
+class CountingLocMemCache(CountingCacheMixin, LocMemCache):
+    def usage(self):
+        """{family: {'entries', 'bytes'}} held right now (values are stored pickled)"""
+        usage = defaultdict(lambda: {'entries': 0, 'bytes': 0})
+        with self._lock:
+            items = list(self._cache.items())
+        for key, value in items:
+            family = usage[_key_family(key.split(':', 2)[-1])]  # stored as prefix:version:key
+            family['entries'] += 1
+            family['bytes'] += len(value)
+        return dict(usage)
+
+
+class CountingFileBasedCache(CountingCacheMixin, FileBasedCache):
+    pass
+
+
+def cache_stats():
+    """
+    {family: {'hits', 'misses', 'hit_ratio'}} since the process started, plus
+    'entries' and 'bytes' when the backend can tell (local memory).
+    """
+    with _stats_lock:
+        stats = {family: dict(counts) for family, counts in _stats.items()}
+    for counts in stats.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / total, 4) if total else 0.0
+    if hasattr(cache, 'usage'):
+        for family, usage in cache.usage().items():
+            stats.setdefault(family, {'hits': 0, 'misses': 0, 'hit_ratio': 0.0}).update(usage)
+    return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def catalog_version():
+    """Current catalog version (starts at 1)"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every cached page and fragment of the catalog"""
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:  # not set yet (or evicted)
+        cache.add(VERSION_KEY, 2, timeout=None)
+        return cache.get(VERSION_KEY, 2)
+
+
+def page_cache_key(request):
+    htmx = 'hx' if request.headers.get('HX-Request') == 'true' else 'full'
+    auth = 'auth' if request.user.is_authenticated else 'anon'
+    # under conditional_catalog_page, the same Last-Modified as the ETag: rows changed by a
+    # queryset update() (stock at checkout) don't bump the catalog version
+    last_modified = getattr(request, 'catalog_last_modified', None)
+    modified = last_modified.isoformat() if last_modified is not None else '-'
+    return f"page:{catalog_version()}:{modified}:{auth}:{htmx}:{request.get_full_path()}"
+
+
+def _is_cacheable(request):
+    from .cart import has_session_cart
+
+    # a visitor with a cart sees their own cart count in the navbar
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not has_session_cart(request)
+    )
+
+
+def _cached_page(request):
+    """(cache key, cached response) of a request; the key is None when the page isn't cacheable"""
+    if not _is_cacheable(request):
+        return None, None
+    key = page_cache_key(request)
+    entry = cache.get(key)
+    if entry is None:
+        return key, None
+    if entry['viewed_product_id'] is not None:
+        from .viewcounter import record_view
+        record_view(entry['viewed_product_id'])
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers']:
+        response[header] = value
+    response['X-Cache'] = 'HIT'
+    return key, response
+
+
+def _store_page(request, key, response, timeout):
+    patch_vary_headers(response, ('HX-Request',))
+    # responses that set cookies or carry a csrf token belong to one visitor
+    personal = response.cookies or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    if response.status_code == 200 and not personal and not getattr(response, 'streaming', False):
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        cache.set(key, {
+            'content': response.content,
+            'status': response.status_code,
+            'headers': [(header, value) for header, value in response.items()],
+            'viewed_product_id': getattr(response, 'viewed_product_id', None),
+        }, timeout)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def cache_catalog_page(timeout=None):
+    """
+    Cache a catalog view's whole response for anonymous visitors until the
+    catalog version changes. A view can set `response.viewed_product_id` so the
+    view is still counted when the page is served from the cache. Works on
+    sync and async views; for async ones the session and user are loaded in a
+    worker thread.
+    """
+    timeout = PAGE_TIMEOUT if timeout is None else timeout
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                key, cached = await sync_to_async(_cached_page)(request)
+                if cached is not None:
+                    return cached
+                response = await view(request, *args, **kwargs)
+                return response if key is None else _store_page(request, key, response, timeout)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, cached = _cached_page(request)
+            if cached is not None:
+                return cached
+            response = view(request, *args, **kwargs)
+            return response if key is None else _store_page(request, key, response, timeout)
+        return wrapper
+    return decorator
+
+
+def _revalidate(request, last_modified_func, args, kwargs):
+    """
+    (validators, 304 response or None) of a request. `validators` is None when
+    the page gets no shared caching: signed-in visitors and missing objects.
+    """
+    if not _is_cacheable(request):
+        return None, None
+    last_modified = last_modified_func(request, *args, **kwargs)
+    if last_modified is None:
+        return None, None
+    request.catalog_last_modified = last_modified  # part of the page cache key too
+
+    htmx = 'hx' if request.headers.get('HX-Request') == 'true' else 'full'
+    validator = f"{catalog_version()}:{last_modified.isoformat()}:{htmx}:{request.get_full_path()}"
+    validators = (quote_etag(hashlib.md5(validator.encode()).hexdigest()), int(last_modified.timestamp()))
+
+    response = get_conditional_response(request, etag=validators[0], last_modified=validators[1])
+    if response is not None and getattr(request, 'viewed_product_id', None) is not None:
+        from .viewcounter import record_view
+        record_view(request.viewed_product_id)
+    return validators, response
+
+
+def _add_validators(request, response, validators, max_age):
+    patch_vary_headers(response, ('HX-Request',))
+    # as in cache_catalog_page: cookies or a csrf token make the page the visitor's own
+    personal = response.cookies or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    if validators is None or response.status_code not in (200, 304) or personal:
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    etag, timestamp = validators
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    patch_cache_control(response, public=True, max_age=max_age, stale_while_revalidate=STALE_WHILE_REVALIDATE)
+    return response
+
+
+def conditional_catalog_page(last_modified_func, max_age=None):
+    """
+    Answer If-None-Match / If-Modified-Since for anonymous visitors with a
+    304 before the view (or the page cache) runs.
+
+    `last_modified_func(request, *args, **kwargs)` returns the datetime of
+    the newest row the page shows, from a single indexed query, or None when
+    the object doesn't exist (the view then answers its 404). It may set
+    `request.viewed_product_id` so a revalidated product page still counts as
+    a view. The ETag also covers the catalog version, which changes on
+    deletes and on edits of other products the page lists, plus the
+    HX-Request header and the query string.
+
+    Put it above `cache_catalog_page`, whose key then includes the same
+    Last-Modified, so a cached body never outlives its ETag.
+
+    Anonymous pages are `public` for `max_age` seconds and may be served stale
+    while revalidating; pages of signed-in visitors are `private, no-cache`.
+    """
+    max_age = BROWSER_MAX_AGE if max_age is None else max_age
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                validators, response = await sync_to_async(_revalidate)(request, last_modified_func, args, kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _add_validators(request, response, validators, max_age)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            validators, response = _revalidate(request, last_modified_func, args, kwargs)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _add_validators(request, response, validators, max_age)
+        return wrapper
+    return decorator
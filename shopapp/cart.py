@@ -0,0 +1,216 @@
+"""
+Server-side shopping carts.
+
+Anonymous visitors get a `Cart` row whose id is kept in their session; a
+signed-in user has one cart through `Cart.user`. When an anonymous visitor
+signs in, their session cart is merged into the user's cart (see
+`merge_session_cart`, called from the user_logged_in signal).
+
+Every line stores the unit and discounted price it was last priced at, and
+the cart keeps item_count, subtotal and discount_total as running sums of its
+lines. A change only applies the difference it makes with one F() UPDATE on
+the cart, so rendering a cart never has to add anything up: `load_cart`
+reads the lines, their products and the cart totals in a single query.
+The item count is mirrored in the session for the navbar badge.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+
+SESSION_KEY = 'cart_id'
+COUNT_SESSION_KEY = 'cart_count'
+MAX_QUANTITY = getattr(settings, 'CART_MAX_QUANTITY', 99)
+# product columns a cart row renders
+LINE_PRODUCT_FIELDS = (
+    'product__name', 'product__slug', 'product__image1', 'product__price',
+    'product__effective_price', 'product__stock', 'product__availability',
+)
+
+
+def has_session_cart(request):
+    """True when the visitor's session holds a cart, without loading a session that doesn't exist"""
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return False
+    return bool(request.session.get(SESSION_KEY))
+
+
+def get_cart(request, create=False):
+    """The visitor's cart, created on demand when `create` is set"""
+    if request.user.is_authenticated:
+        if create:
+            return Cart.objects.get_or_create(user=request.user)[0]
+        return Cart.objects.filter(user=request.user).first()
+    cart_id = request.session.get(SESSION_KEY)
+    cart = Cart.objects.filter(pk=cart_id, user=None).first() if cart_id else None
+    if cart is None and create:
+        cart = Cart.objects.create()
+        request.session[SESSION_KEY] = cart.pk
+    return cart
+
+
+def _lines():
+    """Cart lines with their product and the cart row in the same query"""
+    return CartItem.objects.select_related('cart', 'product').only(
+        'quantity', 'unit_price', 'discounted_price', 'cart', 'product',
+        'cart__item_count', 'cart__subtotal', 'cart__discount_total', 'cart__user',
+        *LINE_PRODUCT_FIELDS,
+    ).order_by('added_at', 'pk')
+
+
+def load_cart(request):
+    """(cart, lines) for rendering, in one query. An empty cart is an unsaved Cart"""
+    lines = _lines()
+    if request.user.is_authenticated:
+        lines = lines.filter(cart__user=request.user)
+    elif has_session_cart(request):
+        lines = lines.filter(cart_id=request.session[SESSION_KEY], cart__user=None)
+    else:
+        return Cart(), []
+    lines = list(lines)
+    return (lines[0].cart if lines else Cart()), lines
+
+
+def line_product(product_id):
+    """The product columns pricing a line needs; DoesNotExist for unknown ids"""
+    return Product.objects.only('price', 'effective_price', 'stock', 'availability').get(pk=product_id)
+
+
+def _line_values(quantity, unit_price, discounted_price):
+    """(item_count, subtotal, discount_total) a line contributes to its cart"""
+    return quantity, unit_price * quantity, (unit_price - discounted_price) * quantity
+
+
+def _apply(cart, before, after):
+    """Move the cart totals from a line's `before` contribution to `after`"""
+    count, subtotal, discount = (a - b for a, b in zip(after, before))
+    if count or subtotal or discount:
+        Cart.objects.filter(pk=cart.pk).update(
+            item_count=F('item_count') + count,
+            subtotal=F('subtotal') + subtotal,
+            discount_total=F('discount_total') + discount,
+            updated_at=timezone.now(),
+        )
+    cart.refresh_from_db(fields=['item_count', 'subtotal', 'discount_total'])
+
+
+def set_quantity(cart, product, quantity):
+    """
+    Set the quantity of `product` in the cart, at its current price; 0
+    removes the line. Returns the line, or None when it was removed.
+    """
+    quantity = max(0, min(int(quantity), MAX_QUANTITY))
+    with transaction.atomic():
+        item = CartItem.objects.select_for_update().filter(cart=cart, product=product).first()
+        before = _line_values(item.quantity, item.unit_price, item.discounted_price) if item else (0, 0, 0)
+        if quantity == 0:
+            if item:
+                item.delete()
+            _apply(cart, before, (0, 0, 0))
+            return None
+        unit_price = product.price
+        discounted_price = Decimal(product.get_discounted_price())
+        if item is None:
+            item = CartItem.objects.create(
+                cart=cart, product=product, quantity=quantity,
+                unit_price=unit_price, discounted_price=discounted_price,
+            )
+        else:
+            item.quantity = quantity
+            item.unit_price = unit_price
+            item.discounted_price = discounted_price
+            item.save(update_fields=['quantity', 'unit_price', 'discounted_price'])
+        _apply(cart, before, _line_values(quantity, unit_price, discounted_price))
+    return item
+
+
+def add_item(cart, product, quantity=1):
+    """Add `quantity` units of `product`; returns the line"""
+    with transaction.atomic():
+        current = CartItem.objects.select_for_update().filter(
+            cart=cart, product=product
+        ).values_list('quantity', flat=True).first()
+        return set_quantity(cart, product, (current or 0) + int(quantity))
+
+
+def recalculate(cart):
+    """Recompute the running totals of a cart from its lines (after bulk changes)"""
+    money = DecimalField(max_digits=12, decimal_places=2)
+    totals = cart.items.aggregate(
+        item_count=Coalesce(Sum('quantity'), 0),
+        subtotal=Coalesce(Sum(ExpressionWrapper(F('unit_price') * F('quantity'), output_field=money)), Decimal(0), output_field=money),
+        discount_total=Coalesce(Sum(ExpressionWrapper(
+            (F('unit_price') - F('discounted_price')) * F('quantity'), output_field=money
+        )), Decimal(0), output_field=money),
+    )
+    Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now(), **totals)
+    for field, value in totals.items():
+        setattr(cart, field, value)
+    return cart
+
+
+def reprice(cart, lines):
+    """
+    Bring lines loaded by `load_cart` up to the current prices and category
+    discounts. Returns True when anything changed.
+    """
+    changed = []
+    for line in lines:
+        unit_price = line.product.price
+        discounted_price = Decimal(line.product.get_discounted_price())
+        if (line.unit_price, line.discounted_price) != (unit_price, discounted_price):
+            line.unit_price, line.discounted_price = unit_price, discounted_price
+            changed.append(line)
+    if changed:
+        with transaction.atomic():
+            CartItem.objects.bulk_update(changed, ['unit_price', 'discounted_price'])
+            recalculate(cart)
+    return bool(changed)
+
+
+def clear(cart):
+    with transaction.atomic():
+        cart.items.all().delete()
+        recalculate(cart)
+
+
+def merge_session_cart(request, user):
+    """Move the anonymous session cart into `user`'s cart (on login)"""
+    cart_id = request.session.pop(SESSION_KEY, None)
+    anonymous = Cart.objects.filter(pk=cart_id, user=None).first() if cart_id else None
+    if anonymous is None:
+        cart = Cart.objects.filter(user=user).first()
+    else:
+        with transaction.atomic():
+            cart = Cart.objects.filter(user=user).first()
+            if cart is None:
+                # nothing to merge with, the session cart becomes the user's
+                anonymous.user = user
+                anonymous.save(update_fields=['user', 'updated_at'])
+                cart = anonymous
+            else:
+                existing = {item.product_id: item for item in cart.items.all()}
+                moved, merged = [], []
+                for item in anonymous.items.all():
+                    if item.product_id in existing:
+                        line = existing[item.product_id]
+                        line.quantity = min(line.quantity + item.quantity, MAX_QUANTITY)
+                        merged.append(line)
+                    else:
+                        moved.append(item.pk)
+                CartItem.objects.filter(pk__in=moved).update(cart=cart)
+                CartItem.objects.bulk_update(merged, ['quantity'])
+                anonymous.delete()
+                recalculate(cart)
+    remember_count(request, cart)
+    return cart
+
+
+def remember_count(request, cart):
+    """Mirror the cart's item count in the session, for the navbar"""
+    request.session[COUNT_SESSION_KEY] = cart.item_count if cart else 0
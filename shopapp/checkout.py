@@ -0,0 +1,93 @@
+"""
+Transactional checkout.
+
+`place_order` turns a set of (product, quantity) lines into an `Order` with
+its `OrderItem`s in one transaction. Stock and sales counts are changed with
+guarded UPDATEs:
+
+    UPDATE shopapp_product SET stock = stock - q, sales_count = sales_count + q
+    WHERE id = ? AND availability AND stock >= q
+
+so concurrent checkouts can neither lose a sale nor oversell. An update that
+matches no row rejects that line. The updates run before anything is read,
+which makes every checkout take the SQLite write lock up front (waiting on
+busy_timeout) instead of failing to upgrade a read transaction.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product
+
+
+class CheckoutError(Exception):
+    """Raised when lines of an order cannot be fulfilled; nothing is written"""
+
+    def __init__(self, rejected):
+        self.rejected = rejected  # {product_id: requested quantity}
+        super().__init__(
+            "Not enough stock for product(s) " + ", ".join(str(pk) for pk in sorted(rejected))
+        )
+
+
+def normalize_lines(lines):
+    """{product_id: quantity} from a mapping or (product_id, quantity) pairs"""
+    if hasattr(lines, 'items'):
+        lines = lines.items()
+    quantities = {}
+    for product_id, quantity in lines:
+        quantity = int(quantity)
+        if quantity <= 0:
+            raise ValueError(f"invalid quantity {quantity} for product {product_id}")
+        product_id = int(product_id)
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def reserve_stock(product_id, quantity):
+    """Take `quantity` units out of stock and count them as sold; False if short"""
+    return Product.objects.filter(
+        pk=product_id, availability=True, stock__gte=quantity
+    ).update(
+        stock=F('stock') - quantity,
+        sales_count=F('sales_count') + quantity,
+        updated_at=timezone.now(),
+    ) == 1
+
+
+def place_order(user, lines, allow_partial=False):
+    """
+    Create an order for `lines` ({product_id: quantity} or pairs) at the
+    current discounted prices. Raises CheckoutError, with nothing written,
+    when any line is short of stock, unless `allow_partial` is set, in which
+    case the order keeps the lines that could be fulfilled (and is returned
+    with a `rejected` attribute).
+    """
+    quantities = normalize_lines(lines)
+    if not quantities:
+        raise ValueError("an order needs at least one line")
+
+    with transaction.atomic():
+        rejected = {}
+        # always in the same order, so row locking databases can't deadlock
+        for product_id in sorted(quantities):
+            if not reserve_stock(product_id, quantities[product_id]):
+                rejected[product_id] = quantities[product_id]
+        if rejected and (not allow_partial or len(rejected) == len(quantities)):
+            raise CheckoutError(rejected)
+
+        accepted = {pk: quantity for pk, quantity in quantities.items() if pk not in rejected}
+        products = Product.objects.only('price', 'effective_price').in_bulk(list(accepted))
+        prices = {pk: Decimal(products[pk].get_discounted_price()) for pk in accepted}
+        order = Order.objects.create(
+            user=user,
+            total_price=sum(prices[pk] * quantity for pk, quantity in accepted.items()),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=pk, quantity=quantity, price=prices[pk])
+            for pk, quantity in accepted.items()
+        ])
+    order.rejected = rejected
+    return order
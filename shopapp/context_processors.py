@@ -0,0 +1,16 @@
+from django.conf import settings
+
+from .cache import catalog_version
+from .cart import COUNT_SESSION_KEY
+
+
+def catalog_cache(request):
+    """`catalog_version` for the {% cache %} fragments of the catalog templates"""
+    return {'catalog_version': catalog_version()}
+
+
+def cart(request):
+    """`cart_count` for the navbar, from the session so it costs no query"""
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return {'cart_count': 0}
+    return {'cart_count': request.session.get(COUNT_SESSION_KEY, 0)}
@@ -0,0 +1,103 @@
+"""
+Production SQLite support.
+
+* Every new SQLite connection gets the SQLITE_PRAGMAS from the settings
+  (synchronous=NORMAL, busy_timeout, mmap and page cache) and connections are
+  reused (CONN_MAX_AGE).
+* The WAL journal, which keeps readers from blocking behind the writer, is a
+  property of the database file. It is only switched on explicitly, with
+  `manage.py sqlite_journal_mode wal` or the SQLITE_JOURNAL_MODE setting, so
+  running a management command never rewrites a checked-in database.
+* With a `readonly` database alias configured (see settings.py), the
+  ReadOnlyRequestMiddleware marks GET/HEAD requests and ReadOnlyRequestRouter
+  sends their reads to that alias, a `mode=ro` connection to the same file.
+  Writes, and reads inside a transaction on the default database, stay on
+  `default` so a request always sees its own writes.
+"""
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+READ_ALIAS = getattr(settings, 'DATABASE_READ_ALIAS', 'readonly')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+
+_read_only_request = ContextVar('read_only_request', default=False)
+
+
+def set_journal_mode(connection, mode):
+    """Switch the journal mode of the database file behind `connection`; returns the mode in effect"""
+    mode = mode.upper()
+    if mode not in JOURNAL_MODES:
+        raise ValueError(f"unknown journal mode {mode!r}")
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {mode}")
+        return cursor.fetchone()[0].upper()
+
+
+def apply_sqlite_pragmas(connection):
+    """Run the configured PRAGMAs (and SQLITE_JOURNAL_MODE, if set) on a freshly opened SQLite connection"""
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    journal_mode = getattr(settings, 'SQLITE_JOURNAL_MODE', None)
+    read_only = connection.alias == READ_ALIAS
+    if read_only:
+        # the journal mode belongs to the database file, set by the writer
+        journal_mode = None
+        pragmas['query_only'] = 'ON'
+    if journal_mode:
+        pragmas['journal_mode'] = journal_mode
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+class ReadOnlyRequestMiddleware:
+    """Flags GET/HEAD/OPTIONS requests so their reads can use the read alias"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _read_only_request.set(request.method in SAFE_METHODS)
+        try:
+            return self.get_response(request)
+        finally:
+            _read_only_request.reset(token)
+
+    async def __acall__(self, request):
+        # the flag is a context variable, so the ORM calls of sync_to_async threads see it
+        token = _read_only_request.set(request.method in SAFE_METHODS)
+        try:
+            return await self.get_response(request)
+        finally:
+            _read_only_request.reset(token)
+
+
+class ReadOnlyRequestRouter:
+    def db_for_read(self, model, **hints):
+        if not _read_only_request.get() or READ_ALIAS not in connections:
+            return None
+        if connections['default'].in_atomic_block:
+            return None  # read your own uncommitted writes
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases are the same database file
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != READ_ALIAS
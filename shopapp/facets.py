@@ -0,0 +1,181 @@
+"""
+Faceted filtering of the shop and search listings.
+
+Filters come from the query string (`?color=red&color=blue&size=xl&price=50-100`):
+values of one facet are OR-ed, different facets are AND-ed. Tags, colors and
+sizes are matched through the indexed ProductAttribute rows, so "l" no longer
+matches "xl". Price ranges apply to the discounted Product.effective_price.
+
+`facet_counts` computes the counts of every facet in a single query: one
+grouped SELECT per facet, glued together with UNION ALL. Each facet is
+counted with the filters of all the *other* facets applied, so the counts
+show how many products a click would add ("disjunctive" faceting).
+The counts are cached per listing and filter set until the catalog version
+changes, so the query only runs for the first visitor of a combination.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+
+from .cache import PAGE_TIMEOUT, catalog_version
+from .models import ProductAttribute
+
+# facet (its query string parameter) -> heading, in display order
+FACETS = {
+    'category': "Category",
+    'brand': "Brand",
+    'color': "Color",
+    'size': "Size",
+    'tag': "Tag",
+    'price': "Price",
+    'availability': "Availability",
+}
+ATTRIBUTE_FACETS = {'color': ProductAttribute.COLOR, 'size': ProductAttribute.SIZE, 'tag': ProductAttribute.TAG}
+# (key, lower bound, upper bound or None)
+PRICE_RANGES = (
+    ('0-50', 0, 50),
+    ('50-100', 50, 100),
+    ('100-500', 100, 500),
+    ('500-1000', 500, 1000),
+    ('1000-', 1000, None),
+)
+PRICE_KEYS = tuple(key for key, _, _ in PRICE_RANGES)
+AVAILABILITY = {'in-stock': "In stock", 'out-of-stock': "Out of stock"}
+# values listed per facet, most frequent first (selected values are always listed)
+FACET_LIMIT = 12
+
+
+def parse_filters(params):
+    """{facet: [values]} of the facets selected in a QueryDict"""
+    filters = {}
+    for facet in FACETS:
+        values = [value.strip() for value in params.getlist(facet) if value.strip()]
+        if facet in ATTRIBUTE_FACETS:
+            values = [value.lower() for value in values]
+        elif facet == 'price':
+            values = [value for value in values if value in PRICE_KEYS]
+        elif facet == 'availability':
+            values = [value for value in values if value in AVAILABILITY]
+        if values:
+            filters[facet] = list(dict.fromkeys(values))
+    return filters
+
+
+def _in_stock():
+    return Q(availability=True, stock__gt=0)
+
+
+def facet_q(facet, values):
+    """Q selecting the products that have any of `values` for `facet`"""
+    if facet == 'category':
+        return Q(category__slug__in=values)
+    if facet == 'brand':
+        return Q(brand_name__in=values)
+    if facet in ATTRIBUTE_FACETS:
+        return Q(pk__in=ProductAttribute.objects.filter(
+            kind=ATTRIBUTE_FACETS[facet], value__in=values
+        ).values('product_id'))
+    if facet == 'price':
+        condition = Q()
+        for key, low, high in PRICE_RANGES:
+            if key in values:
+                condition |= Q(effective_price__gte=low, effective_price__lt=high) if high is not None else Q(effective_price__gte=low)
+        return condition
+    if facet == 'availability':
+        condition = Q()
+        if 'in-stock' in values:
+            condition |= _in_stock()
+        if 'out-of-stock' in values:
+            condition |= ~_in_stock()
+        return condition
+    raise ValueError(f"unknown facet {facet!r}")
+
+
+def apply_filters(queryset, filters, exclude=None):
+    """`queryset` narrowed by every selected facet except `exclude`"""
+    for facet, values in filters.items():
+        if facet != exclude:
+            queryset = queryset.filter(facet_q(facet, values))
+    return queryset
+
+
+def _price_bucket():
+    return Case(
+        *[When(effective_price__gte=low, effective_price__lt=high, then=Value(key)) for key, low, high in PRICE_RANGES if high is not None],
+        default=Value(PRICE_RANGES[-1][0]),
+        output_field=CharField(),
+    )
+
+
+def _availability_bucket():
+    return Case(When(_in_stock(), then=Value('in-stock')), default=Value('out-of-stock'), output_field=CharField())
+
+
+def _facet_query(facet, products):
+    """(facet, value, label, count) rows of one facet over `products`"""
+    if facet in ATTRIBUTE_FACETS:
+        rows = ProductAttribute.objects.filter(kind=ATTRIBUTE_FACETS[facet])
+        if products.query.where:  # unfiltered listings count straight from the index
+            rows = rows.filter(product__in=products.values('pk'))
+        rows = rows.annotate(label=F('value'))
+        count = Count('product_id')
+    else:
+        value, label = {
+            'category': (F('category__slug'), F('category__name')),
+            'brand': (F('brand_name'), F('brand_name')),
+            'price': (_price_bucket(), _price_bucket()),
+            'availability': (_availability_bucket(), _availability_bucket()),
+        }[facet]
+        rows = products.annotate(facet_value=value, label=label)
+        count = Count('pk')
+    value_field = 'value' if facet in ATTRIBUTE_FACETS else 'facet_value'
+    return rows.order_by().annotate(facet=Value(facet, output_field=CharField())).values(
+        'facet', value_field, 'label'
+    ).annotate(count=count).values_list('facet', value_field, 'label', 'count')
+
+
+def facet_counts(products, filters):
+    """
+    {facet: [{'value', 'label', 'count', 'selected'}, ...]} for the products
+    of the listing (before any facet filter), in one query.
+    """
+    products = products.order_by()
+    queries = [_facet_query(facet, apply_filters(products, filters, exclude=facet)) for facet in FACETS]
+    rows = queries[0].union(*queries[1:], all=True)
+
+    counts = {facet: [] for facet in FACETS}
+    for facet, value, label, count in rows:
+        counts[facet].append({'value': value, 'label': label, 'count': count})
+    for facet, values in counts.items():
+        selected = set(filters.get(facet, ()))
+        for entry in values:
+            entry['selected'] = entry['value'] in selected
+        if facet == 'price':
+            values.sort(key=lambda entry: PRICE_KEYS.index(entry['value']))
+            for entry in values:
+                entry['label'] = _price_label(entry['value'])
+        elif facet == 'availability':
+            values.sort(key=lambda entry: entry['value'])
+            for entry in values:
+                entry['label'] = AVAILABILITY[entry['value']]
+        else:
+            values.sort(key=lambda entry: (not entry['selected'], -entry['count'], entry['label'].lower()))
+            del values[max(FACET_LIMIT, len(selected)):]
+    return counts
+
+
+def cached_facet_counts(products, filters, listing):
+    """facet_counts, cached under `listing` (e.g. 'shop' or the search terms) and the filters"""
+    raw = repr((listing, sorted((facet, sorted(values)) for facet, values in filters.items())))
+    key = f"facets:{catalog_version()}:{hashlib.md5(raw.encode()).hexdigest()}"
+    counts = cache.get(key)
+    if counts is None:
+        counts = facet_counts(products, filters)
+        cache.set(key, counts, PAGE_TIMEOUT)
+    return counts
+
+
+def _price_label(key):
+    low, _, high = key.partition('-')
+    return f"रु{low}+" if not high else f"रु{low} – रु{high}"
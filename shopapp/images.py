@@ -0,0 +1,188 @@
+"""
+Resized JPEG/WebP derivatives of product and category images.
+
+Uploads are served at their original size, which is far too big for a
+12-card grid. For every uploaded image we generate one JPEG and one WebP per
+width in IMAGE_DERIVATIVE_WIDTHS under MEDIA_ROOT/derivatives/, mirroring the
+original's path:
+
+    product_images/sony_cam.jpg -> derivatives/product_images/sony_cam_300w.webp
+
+The work runs in a process pool after the saving transaction commits, so
+admin saves return immediately. The pool starts its workers with `spawn`:
+forking the threaded web process would copy locks held by other threads.
+Widths larger than the original are not generated (only the smallest one
+is, at the original's size), and each srcset only lists the widths that exist in its format. `manage.py generate_image_derivatives`
+backfills existing media and the `{% responsive_img %}` template tag emits a
+<picture> with srcset for them, falling back to the original until the
+derivatives exist. Writing derivatives bumps the catalog version, so cached
+pages stop showing the fallback.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import models, transaction
+
+from .cache import bump_catalog_version
+
+WIDTHS = tuple(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (300, 600)))
+WORKERS = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+ASYNC = getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True)
+DERIVATIVE_DIR = 'derivatives'
+FORMATS = {
+    # extension: (Pillow format, save options)
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def derivative_name(name, width, extension):
+    """Storage name of one derivative of the image stored as `name`"""
+    base, _ = os.path.splitext(name)
+    return f"{DERIVATIVE_DIR}/{base}_{width}w.{extension}"
+
+
+def derivative_url(name, width, extension):
+    return settings.MEDIA_URL + derivative_name(name, width, extension)
+
+
+def generated_widths(name, extension='jpg'):
+    """The widths of WIDTHS whose `extension` derivative of `name` exists, smallest first"""
+    return [
+        width for width in sorted(WIDTHS)
+        if os.path.exists(os.path.join(settings.MEDIA_ROOT, derivative_name(name, width, extension)))
+    ]
+
+
+def _targets(name):
+    return [
+        (width, extension, os.path.join(settings.MEDIA_ROOT, derivative_name(name, width, extension)))
+        for width in WIDTHS
+        for extension in FORMATS
+    ]
+
+
+def render_derivatives(source, targets, force=False):
+    """
+    Write the resized copies of the file `source`. Runs in the worker
+    processes, so it only deals with plain paths and Pillow. Returns the
+    number of files written.
+    """
+    from PIL import Image, ImageOps
+
+    if not os.path.exists(source):
+        return 0
+    source_mtime = os.path.getmtime(source)
+    pending = [
+        (width, extension, path) for width, extension, path in targets
+        if force or not os.path.exists(path) or os.path.getmtime(path) < source_mtime
+    ]
+    if not pending:
+        return 0
+    smallest = min(width for width, _, _ in targets)
+    written = 0
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        for width, extension, path in pending:
+            if width > original.width and width != smallest:
+                continue  # never upscale; the smallest width stands in for small originals
+            image = original.copy()
+            if image.width > width:
+                image.thumbnail((width, width * 10), Image.LANCZOS)
+            image_format, options = FORMATS[extension]
+            if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            image.save(tmp_path, image_format, **options)
+            os.replace(tmp_path, path)  # readers never see a half written file
+            written += 1
+    return written
+
+
+def generate(name, force=False):
+    """Generate the derivatives of one stored image in this process"""
+    return render_derivatives(os.path.join(settings.MEDIA_ROOT, name), _targets(name), force)
+
+
+def _new_pool(workers=None):
+    return ProcessPoolExecutor(max_workers=workers or WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+
+def get_pool(workers=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool(workers)
+        return _pool
+
+
+def _rendered(name):
+    """
+    Done-callback of a pool render: log a failure, or bump the catalog version
+    so cached pages and fragments pick up the new srcset instead of the original.
+    """
+    def callback(future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("image derivatives of %s failed", name, exc_info=future.exception())
+        elif future.result():
+            bump_catalog_version()
+    return callback
+
+
+def schedule(names):
+    """
+    Generate derivatives for image names once the current transaction commits,
+    in the process pool (or inline when IMAGE_DERIVATIVES_ASYNC is off).
+    """
+    names = sorted({name for name in names if name})
+    if not names:
+        return
+
+    def submit():
+        written = 0
+        for name in names:
+            if ASYNC:
+                future = get_pool().submit(render_derivatives, os.path.join(settings.MEDIA_ROOT, name), _targets(name))
+                future.add_done_callback(_rendered(name))
+            else:
+                written += generate(name)
+        if written:
+            bump_catalog_version()
+
+    transaction.on_commit(submit)
+
+
+def generate_many(names, force=False, workers=None):
+    """Backfill: generate derivatives for `names` in a pool. Yields (name, files written)"""
+    names = sorted({name for name in names if name})
+    with _new_pool(workers) as pool:
+        futures = {
+            name: pool.submit(render_derivatives, os.path.join(settings.MEDIA_ROOT, name), _targets(name), force)
+            for name in names
+        }
+        for name, future in futures.items():
+            try:
+                yield name, future.result()
+            except Exception as e:
+                yield name, e
+
+
+def image_names(instance):
+    """Names of every image stored on a Product or Category instance"""
+    return [
+        field.value_from_object(instance).name
+        for field in instance._meta.fields
+        if isinstance(field, models.ImageField) and field.value_from_object(instance)
+    ]
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from shopapp.cache import bump_catalog_version
+from shopapp.models import Category
+
+
+class Command(BaseCommand):
+    help = (
+        "Start and end the scheduled promotions: reprice every category whose active discount changed "
+        "(one UPDATE of its products each). Run it from cron, e.g. every minute."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', help="Apply the promotions running at this ISO date/time instead of now")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['at']:
+            now = parse_datetime(options['at'])
+            if now is None:
+                raise CommandError(f"invalid date/time {options['at']!r}")
+            if timezone.is_naive(now):
+                now = timezone.make_aware(now)
+        changed = Category.reprice(now=now)
+        if changed:
+            bump_catalog_version()
+        names = dict(Category.objects.filter(pk__in=changed).values_list('pk', 'name'))
+        for pk, discount in changed.items():
+            self.stdout.write(f"{names.get(pk, pk)}: {discount}% off")
+        self.stdout.write(self.style.SUCCESS(f"{len(changed)} categories repriced"))
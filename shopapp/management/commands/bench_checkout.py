@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import Sum
+
+from shopapp.checkout import CheckoutError, place_order
+from shopapp.models import Category, Order, Product, assign_effective_prices, assign_unique_slugs
+
+SKU_PREFIX = 'BENCH-CHECKOUT-'
+
+
+class Command(BaseCommand):
+    help = (
+        "Place orders from concurrent threads against a few benchmark products and check "
+        "that no stock or sales count update was lost. The benchmark rows are removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=200, help="Orders per thread")
+        parser.add_argument('--products', type=int, default=5, help="Few products means heavy contention")
+        parser.add_argument('--stock', type=int, default=1000, help="Initial stock per product, low values exercise rejections")
+        parser.add_argument('--legacy', action='store_true', help="Also run the old read-modify-write save() for comparison")
+
+    def handle(self, *args, **options):
+        user, category = self.setup()
+        try:
+            self.run('checkout', self.checkout, user, category, options)
+            if options['legacy']:
+                self.run('legacy save()', self.legacy, user, category, options)
+        finally:
+            self.cleanup()
+
+    def setup(self):
+        self.cleanup()
+        user = User.objects.create_user(username=f"{SKU_PREFIX.lower()}user")
+        category = Category.objects.create(name=f"{SKU_PREFIX}category")
+        return user, category
+
+    def cleanup(self):
+        Order.objects.filter(user__username=f"{SKU_PREFIX.lower()}user").delete()
+        Product.objects.filter(sku__startswith=SKU_PREFIX).delete()
+        Category.objects.filter(name=f"{SKU_PREFIX}category").delete()
+        User.objects.filter(username=f"{SKU_PREFIX.lower()}user").delete()
+
+    def create_products(self, category, count, stock):
+        Product.objects.filter(sku__startswith=SKU_PREFIX).delete()
+        products = [
+            Product(category=category, name=f"Bench product {i}", description='', price=10,
+                    brand_name='bench', sku=f"{SKU_PREFIX}{i}", stock=stock)
+            for i in range(count)
+        ]
+        Product.objects.bulk_create(assign_effective_prices(assign_unique_slugs(products)))
+        return list(Product.objects.filter(sku__startswith=SKU_PREFIX).values_list('pk', flat=True))
+
+    def checkout(self, user, product_ids):
+        lines = {pk: random.randint(1, 3) for pk in random.sample(product_ids, random.randint(1, len(product_ids)))}
+        try:
+            place_order(user, lines)
+        except CheckoutError:
+            return 0
+        return sum(lines.values())
+
+    def legacy(self, user, product_ids):
+        sold = 0
+        for pk in random.sample(product_ids, random.randint(1, len(product_ids))):
+            quantity = random.randint(1, 3)
+            product = Product.objects.get(pk=pk)
+            if product.stock < quantity:
+                continue
+            product.stock -= quantity
+            product.sales_count += quantity
+            product.save(update_fields=['stock', 'sales_count'])
+            sold += quantity
+        return sold
+
+    def run(self, label, place, user, category, options):
+        product_ids = self.create_products(category, options['products'], options['stock'])
+        lock = threading.Lock()
+        totals = {'orders': 0, 'rejected': 0, 'sold': 0, 'errors': 0}
+
+        def worker():
+            try:
+                for _ in range(options['orders']):
+                    try:
+                        sold = place(user, product_ids)
+                    except OperationalError:
+                        with lock:
+                            totals['errors'] += 1
+                        continue
+                    with lock:
+                        totals['orders' if sold else 'rejected'] += 1
+                        totals['sold'] += sold
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = Product.objects.filter(pk__in=product_ids).aggregate(
+            sales=Sum('sales_count'), stock=Sum('stock')
+        )
+        initial_stock = options['stock'] * len(product_ids)
+        lost = totals['sold'] - result['sales']
+        oversold = totals['sold'] - (initial_stock - result['stock'])
+        self.stdout.write(
+            f"{label}: {totals['orders']} orders ({totals['orders'] / elapsed:.0f} orders/s), "
+            f"{totals['rejected']} rejected, {totals['errors']} database errors; "
+            f"sold {totals['sold']}, recorded {result['sales']}, stock left {result['stock']}"
+        )
+        if lost or oversold:
+            self.stdout.write(self.style.ERROR(
+                f"{label}: {lost} lost sales_count updates, {oversold} units sold without a stock decrement"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{label}: no lost updates"))
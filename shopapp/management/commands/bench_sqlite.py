@@ -0,0 +1,161 @@
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connections
+from django.db.models import F
+from django.test import override_settings
+from django.utils import timezone
+
+from shopapp.db import READ_ALIAS, ReadOnlyRequestMiddleware, set_journal_mode
+from shopapp.models import Product
+
+# name -> (journal mode, PRAGMAs, CONN_MAX_AGE, read-only alias)
+SCENARIOS = {
+    'default': ('DELETE', {}, 0, False),  # the old setup: rollback journal, a connection per request
+    'wal': ('WAL', getattr(settings, 'SQLITE_PRAGMAS', {}), 60, False),
+    'wal+readonly': ('WAL', getattr(settings, 'SQLITE_PRAGMAS', {}), 60, True),
+}
+
+
+def read_product_page(request):
+    """The queries of a product page: the product and its category's best sellers"""
+    product = Product.card_queryset().get(pk=request.product_id)
+    list(Product.objects.filter(category_id=product.category_id).order_by('-sales_count').values_list('pk')[:4])
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent read throughput on a copy of the database while a writer "
+        "updates view counts, through Django's connections: the old SQLite setup vs WAL + "
+        "pragmas + persistent connections, with and without the read-only alias and router"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help="Concurrent reader threads")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per scenario")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        source = str(connections['default'].settings_dict['NAME'])
+        if connections['default'].vendor != 'sqlite' or not os.path.exists(source):
+            raise CommandError("bench_sqlite needs the default database to be an SQLite file")
+        workdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+        try:
+            results = {}
+            for scenario in SCENARIOS:
+                path = os.path.join(workdir, f"{scenario}.sqlite3")
+                shutil.copy(source, path)
+                with self.database(path, scenario):
+                    results[scenario] = self.run(options['readers'], options['duration'])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for scenario, result in results.items():
+            self.stdout.write(
+                f"{scenario:>12}: {result['reads_per_sec']:>9.0f} reads/s  "
+                f"p95 {result['read_p95_ms']:.2f} ms  {result['writes_per_sec']:.0f} writes/s  "
+                f"{result['busy_errors']} busy errors"
+            )
+
+    @contextmanager
+    def database(self, path, scenario):
+        """Point the `default` (and read-only) alias at the copy in `path`, configured as `scenario`"""
+        journal_mode, pragmas, conn_max_age, read_alias = SCENARIOS[scenario]
+        saved = dict(connections.settings)
+        self.drop_connections()
+        default = {**saved['default'], 'NAME': path, 'CONN_MAX_AGE': conn_max_age}
+        connections.settings['default'] = default
+        connections.settings.pop(READ_ALIAS, None)
+        routers = []
+        if read_alias:
+            connections.settings[READ_ALIAS] = {**default, 'NAME': f"file:{path}?mode=ro"}
+            routers = ['shopapp.db.ReadOnlyRequestRouter']
+        try:
+            with override_settings(SQLITE_PRAGMAS=pragmas, SQLITE_JOURNAL_MODE=None, DATABASE_ROUTERS=routers):
+                set_journal_mode(connections['default'], journal_mode)
+                connections['default'].close()
+                yield
+        finally:
+            self.drop_connections()
+            connections.settings.clear()
+            connections.settings.update(saved)
+
+    def drop_connections(self):
+        """Close this thread's connections and forget them, so the next query reads the new settings"""
+        for alias in list(connections):
+            if hasattr(connections._connections, alias):
+                connections[alias].close()
+                del connections[alias]
+
+    def run(self, readers, duration):
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        connections['default'].close()
+        if not product_ids:
+            raise CommandError("The database has no products to read, seed the catalog first")
+
+        stop = threading.Event()
+        latencies = [[] for _ in range(readers)]
+        counters = {'writes': 0, 'busy': 0}
+        lock = threading.Lock()
+        # GET requests go through the middleware, which lets the router pick the read-only alias
+        handle_get = ReadOnlyRequestMiddleware(read_product_page)
+
+        def reader(index):
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    handle_get(SimpleNamespace(method='GET', product_id=random.choice(product_ids)))
+                except OperationalError:
+                    with lock:
+                        counters['busy'] += 1
+                    continue
+                finally:
+                    close_old_connections()  # what request_finished does
+                latencies[index].append(time.perf_counter() - started)
+            connections.close_all()
+
+        def writer():
+            while not stop.is_set():
+                try:
+                    Product.objects.filter(pk=random.choice(product_ids)).update(
+                        views_count=F('views_count') + 1, last_viewed=timezone.now()
+                    )
+                    with lock:
+                        counters['writes'] += 1
+                except OperationalError:
+                    with lock:
+                        counters['busy'] += 1
+            connections.close_all()
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        samples = sorted(latency for per_thread in latencies for latency in per_thread)
+        p95 = samples[int(len(samples) * 0.95)] if samples else 0.0
+        return {
+            'readers': readers,
+            'reads_per_sec': len(samples) / duration,
+            'read_p50_ms': statistics.median(samples) * 1000 if samples else 0.0,
+            'read_p95_ms': p95 * 1000,
+            'writes_per_sec': counters['writes'] / duration,
+            'busy_errors': counters['busy'],
+        }
@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from shopapp import benchmark, viewcounter
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic catalog into a throwaway database, time the catalog views "
+        "through the test client and compare p50/p95/p99 latency and queries with a baseline; "
+        "--servers compares the WSGI and ASGI paths under concurrent load instead"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--reviews', type=int, default=None, help="Default: 2 per product")
+        parser.add_argument('--orders', type=int, default=None, help="Default: 1 per 2 products")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the data and the requests")
+        parser.add_argument('--requests', type=int, default=100, help="Timed requests per scenario")
+        parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS,
+                            help="Scenario to run (repeatable, default all)")
+        parser.add_argument('--warm-cache', action='store_true', help="Keep the page cache between requests")
+        parser.add_argument('--database', help="SQLite file to seed once and reuse on later runs (default: a temporary file)")
+        parser.add_argument('--baseline', help="JSON report to compare against; exits with an error on regressions")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p95 slowdown against the baseline")
+        parser.add_argument('--save', help="Write the JSON report to this file (e.g. to make it the new baseline)")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+        parser.add_argument('--servers', action='store_true',
+                            help="Compare throughput and tail latency of the sync views behind WSGI with the "
+                                 "async views behind ASGI")
+        parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight with --servers")
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_views seeds a separate SQLite database")
+        if len(connections.settings) > 1:
+            raise CommandError("Run bench_views with only the default database configured (unset BIKRANTE_SQLITE_READ_ALIAS)")
+
+        path = options['database'] or os.path.join(tempfile.mkdtemp(prefix='bench_views_'), 'bench.sqlite3')
+        keep = bool(options['database'])
+        original_name = connection.settings_dict['NAME']
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=keep)
+        try:
+            report = {'meta': self.seed(options)}
+            started = time.perf_counter()
+            if options['servers']:
+                report['servers'] = benchmark.run_server_benchmark(
+                    scenarios=[
+                        name for name in options['scenario'] or benchmark.SERVER_SCENARIOS
+                        if name in benchmark.SERVER_SCENARIOS
+                    ],
+                    requests=options['requests'],
+                    concurrency=options['concurrency'],
+                    cold_cache=not options['warm_cache'],
+                    seed=options['seed'],
+                )
+            else:
+                report['scenarios'] = benchmark.run_benchmark(
+                    scenarios=options['scenario'] or benchmark.SCENARIOS,
+                    requests=options['requests'],
+                    cold_cache=not options['warm_cache'],
+                    seed=options['seed'],
+                )
+            report['meta']['seconds'] = round(time.perf_counter() - started, 2)
+            if resource is not None:
+                report['meta']['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        finally:
+            # product views counted during the run belong to the benchmark database
+            viewcounter.flush()
+            connection.creation.destroy_test_db(original_name, verbosity=0, keepdb=keep)
+            if not keep:
+                os.rmdir(os.path.dirname(path))
+
+        self.output(report, options)
+        if options['save']:
+            with open(options['save'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+        if options['baseline'] and 'scenarios' in report:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+            regressions = benchmark.compare(report['scenarios'], baseline['scenarios'], options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stderr.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def seed(self, options):
+        products = options['products']
+        meta = {key: options[key] for key in ('products', 'categories', 'users', 'seed', 'requests', 'warm_cache', 'concurrency')}
+        if Product.objects.exists():
+            meta['reused_database'] = True
+            return meta
+        started = time.perf_counter()
+        meta['rows'] = benchmark.seed_catalog(
+            products=products,
+            categories=options['categories'],
+            users=options['users'],
+            reviews=products * 2 if options['reviews'] is None else options['reviews'],
+            orders=products // 2 if options['orders'] is None else options['orders'],
+            seed=options['seed'],
+        )
+        meta['seed_seconds'] = round(time.perf_counter() - started, 2)
+        return meta
+
+    def output(self, report, options):
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if 'servers' in report:
+            self.stdout.write(f"{'scenario':<16} {'server':<6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+            for name in next(iter(report['servers'].values())):
+                for server, results in report['servers'].items():
+                    result = results[name]
+                    self.stdout.write(
+                        f"{name:<16} {server:<6} {result['throughput_rps']:>8.1f} {result['p50_ms']:>8.2f} "
+                        f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+                    )
+            return
+        self.stdout.write(f"{'scenario':<16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'peak KiB':>9}")
+        for name, result in report['scenarios'].items():
+            self.stdout.write(
+                f"{name:<16} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                f"{result['queries_per_request']:>8.1f} {result['peak_memory_kb'] or 0:>9.0f}"
+            )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shopapp import images
+from shopapp.cache import bump_catalog_version
+from shopapp.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = "Generate the resized JPEG/WebP copies of every product and category image"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives that already exist")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default IMAGE_DERIVATIVE_WORKERS)")
+
+    def handle(self, *args, **options):
+        image_fields = [f"image{i}" for i in range(1, 7)]
+        names = set()
+        for row in Product.objects.values_list(*image_fields).iterator():
+            names.update(name for name in row if name)
+        names.update(name for name in Category.objects.values_list('image', flat=True) if name)
+
+        started = time.monotonic()
+        written = failed = 0
+        for name, result in images.generate_many(names, force=options['force'], workers=options['workers']):
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write(f"{name}: {result}")
+            else:
+                written += result
+        if written:
+            bump_catalog_version()  # cached pages still show the originals
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(names)} images, {written} derivatives written, {failed} failed in {elapsed:.1f}s"
+        ))
@@ -0,0 +1,250 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from shopapp import images, search
+from shopapp.cache import bump_catalog_version
+from shopapp.models import (
+    Category, Product, ProductAttribute, assign_effective_prices, assign_unique_slugs, generate_slug,
+)
+
+IMAGE_FIELDS = [f"image{i}" for i in range(1, 7)]
+TEXT_FIELDS = ['name', 'description', 'brand_name', 'tags', 'colors', 'sizes', 'specifications']
+# bulk_update skips auto_now and Product.save(), updated_at and effective_price are set by write_batch
+UPDATE_FIELDS = TEXT_FIELDS + [
+    'category', 'price', 'effective_price', 'stock', 'availability', 'is_hot', 'updated_at'
+] + IMAGE_FIELDS
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+
+
+class RowError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products from a CSV or JSON Lines file into the catalog, "
+        "creating or updating them by sku in batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with a header row) or .jsonl file")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows written per transaction")
+        parser.add_argument('--image-dir', help="Directory the image columns are relative to; files are copied into MEDIA_ROOT")
+        parser.add_argument('--image-workers', type=int, default=8, help="Threads copying image files")
+        parser.add_argument('--no-update', action='store_true', help="Skip rows whose sku already exists instead of updating them")
+        parser.add_argument('--resume', action='store_true', help="Continue after the last committed batch of a previous run")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.batch_size = options['batch_size']
+        self.image_dir = options['image_dir']
+        self.update = not options['no_update']
+        self.progress_path = f"{path}.progress"
+        self.categories = self.load_categories()
+        self.image_pool = ThreadPoolExecutor(max_workers=options['image_workers'])
+
+        skip = self.read_progress() if options['resume'] else 0
+        if skip:
+            self.stdout.write(f"Resuming after row {skip}")
+
+        started = time.monotonic()
+        done = skip
+        totals = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
+        batch = []
+        try:
+            for line_number, row in enumerate(self.read_rows(path, file_format), start=1):
+                if line_number <= skip:
+                    continue
+                batch.append((line_number, row))
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch, totals)
+                    done += len(batch)
+                    batch = []
+                    self.save_progress(done)
+                    self.report(done - skip, started, totals)
+            if batch:
+                self.write_batch(batch, totals)
+                done += len(batch)
+                self.save_progress(done)
+        finally:
+            self.image_pool.shutdown()
+        bump_catalog_version()
+
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+        self.report(done - skip, started, totals)
+        self.stdout.write(self.style.SUCCESS("Import finished"))
+
+    # reading
+
+    def read_rows(self, path, file_format):
+        """Yield one dict per row without loading the file"""
+        with open(path, newline='', encoding='utf-8') as f:
+            if file_format == 'csv':
+                yield from csv.DictReader(f)
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def read_progress(self):
+        try:
+            with open(self.progress_path) as f:
+                return json.load(f)['rows']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def save_progress(self, rows):
+        with open(self.progress_path, 'w') as f:
+            json.dump({'rows': rows}, f)
+
+    def report(self, rows, started, totals):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            f"{rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s): "
+            f"{totals['created']} created, {totals['updated']} updated, "
+            f"{totals['skipped']} skipped, {totals['errors']} errors"
+        )
+
+    # categories
+
+    def load_categories(self):
+        categories = {}
+        for category in Category.objects.all():
+            categories[category.name.lower()] = category
+            categories[category.slug] = category
+        return categories
+
+    def get_category(self, value):
+        value = (value or '').strip()
+        if not value:
+            raise RowError("missing category")
+        category = self.categories.get(value.lower()) or self.categories.get(generate_slug(value))
+        if category is None:
+            category = Category.objects.create(name=value)
+            self.categories[category.name.lower()] = category
+            self.categories[category.slug] = category
+        return category
+
+    # rows
+
+    def build(self, row):
+        """Field values for one row"""
+        sku = (row.get('sku') or '').strip()
+        if not sku:
+            raise RowError("missing sku")
+        try:
+            price = Decimal(str(row.get('price', '')).strip())
+        except InvalidOperation:
+            raise RowError(f"invalid price {row.get('price')!r}")
+        if not price.is_finite() or price < 0:  # Decimal parses NaN, Infinity and negatives
+            raise RowError(f"invalid price {row.get('price')!r}")
+        try:
+            stock = int(row.get('stock') or 0)
+        except (TypeError, ValueError):
+            raise RowError(f"invalid stock {row.get('stock')!r}")
+        values = {field: (row.get(field) or '') for field in TEXT_FIELDS}
+        if not values['name']:
+            raise RowError("missing name")
+        values.update({
+            'sku': sku,
+            'price': price,
+            'stock': stock,
+            'category': self.get_category(row.get('category')),
+            'availability': str(row.get('availability', 'true')).strip().lower() in TRUE_VALUES,
+            'is_hot': str(row.get('is_hot', '')).strip().lower() in TRUE_VALUES,
+        })
+        for field in IMAGE_FIELDS:
+            values[field] = (row.get(field) or '').strip()
+        return values
+
+    def write_batch(self, batch, totals):
+        rows = {}
+        for line_number, row in batch:
+            try:
+                values = self.build(row)
+            except RowError as e:
+                totals['errors'] += 1
+                self.stderr.write(f"row {line_number}: {e}")
+                continue
+            rows[values['sku']] = values  # the last row of a duplicated sku wins
+        if not rows:
+            return
+        self.attach_images(rows.values())
+
+        now = timezone.now()
+        with transaction.atomic():
+            existing = Product.objects.in_bulk(list(rows), field_name='sku')
+            created, updated = [], []
+            for sku, values in rows.items():
+                product = existing.get(sku)
+                if product is None:
+                    created.append(Product(**values))
+                elif self.update:
+                    for field, value in values.items():
+                        if field in IMAGE_FIELDS and not value:
+                            continue  # keep the current image
+                        setattr(product, field, value)
+                    product.updated_at = now
+                    updated.append(product)
+                else:
+                    totals['skipped'] += 1
+            assign_effective_prices(created + updated)
+            if created:
+                assign_unique_slugs(created)
+                Product.objects.bulk_create(created, batch_size=self.batch_size)
+            if updated:
+                Product.objects.bulk_update(updated, UPDATE_FIELDS, batch_size=self.batch_size)
+            # bulk writes skip the post_save signals, keep the search index, attributes and images in sync here
+            search.index_products(created + updated)
+            ProductAttribute.sync(created + updated)
+            images.schedule(
+                getattr(product, field).name for product in created + updated for field in IMAGE_FIELDS
+            )
+        totals['created'] += len(created)
+        totals['updated'] += len(updated)
+
+    # images
+
+    def attach_images(self, rows):
+        """Copy the image files of a batch into media storage in parallel"""
+        if not self.image_dir:
+            return
+        jobs = {}
+        for values in rows:
+            for field in IMAGE_FIELDS:
+                source = values[field]
+                if source and source not in jobs:
+                    jobs[source] = self.image_pool.submit(self.store_image, source)
+        for values in rows:
+            for field in IMAGE_FIELDS:
+                source = values[field]
+                if source:
+                    try:
+                        values[field] = jobs[source].result()
+                    except OSError as e:
+                        self.stderr.write(f"sku {values['sku']}: image {source}: {e}")
+                        values[field] = ''
+
+    def store_image(self, source):
+        path = source if os.path.isabs(source) else os.path.join(self.image_dir, source)
+        name = f"product_images/{os.path.basename(source)}"
+        # the same file imported again (e.g. on resume) is not copied twice
+        if default_storage.exists(name) and default_storage.size(name) == os.path.getsize(path):
+            return name
+        with open(path, 'rb') as f:
+            return default_storage.save(name, File(f))
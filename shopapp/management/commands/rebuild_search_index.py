@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shopapp import search
+
+
+class Command(BaseCommand):
+    help = "Repopulate the full-text product search index from the Product table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Products indexed per batch")
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING("The database has no FTS5 index, search uses the icontains fallback."))
+            return
+        started = time.monotonic()
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products in {elapsed:.2f}s"))
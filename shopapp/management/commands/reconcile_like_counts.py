@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    help = "Repair Product.like_count values that drifted from the likes table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report the drifted products")
+
+    def handle(self, *args, **options):
+        drifted = list(
+            Product.objects.annotate(actual=Product.like_count_subquery())
+            .exclude(like_count=F('actual'))
+            .values_list('pk', 'like_count', 'actual')
+        )
+        for pk, stored, actual in drifted:
+            self.stdout.write(f"Product {pk}: like_count {stored} -> {actual}")
+        if drifted and not options['dry_run']:
+            Product.refresh_like_counts([pk for pk, _, _ in drifted])
+        verb = "Found" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(drifted)} drifted like counts"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    help = "Repair Product review counts, rating sums and histograms that drifted from the reviews table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report the drifted products")
+
+    def handle(self, *args, **options):
+        actual = {f"actual_{field}": subquery for field, subquery in Product.rating_aggregate_subqueries().items()}
+        drift = Q()
+        for field in Product.RATING_FIELDS:
+            drift |= ~Q(**{field: F(f"actual_{field}")})
+        drifted = list(
+            Product.objects.annotate(**actual).filter(drift)
+            .values('pk', *Product.RATING_FIELDS, *actual)
+        )
+        for row in drifted:
+            changes = ", ".join(
+                f"{field} {row[field]} -> {row[f'actual_{field}']}"
+                for field in Product.RATING_FIELDS if row[field] != row[f"actual_{field}"]
+            )
+            self.stdout.write(f"Product {row['pk']}: {changes}")
+        if drifted and not options['dry_run']:
+            Product.refresh_rating_aggregates([row['pk'] for row in drifted])
+        verb = "Found" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(drifted)} products with drifted review aggregates"))
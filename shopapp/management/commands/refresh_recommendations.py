@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shopapp import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the frequently-bought-together neighbours of the products ordered since "
+        "the last run (all products with --full)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild every product, also picks up new likes")
+        parser.add_argument('--top-k', type=int, default=None, help="Neighbours stored per product (default RECOMMENDER_TOP_K)")
+
+    def handle(self, *args, **options):
+        run = recommendations.refresh(full=options['full'], top_k=options['top_k'])
+        kind = 'full' if run.full else 'incremental'
+        self.stdout.write(self.style.SUCCESS(
+            f"{kind} refresh: {run.products_updated} products updated (orders up to #{run.last_order_id})"
+        ))
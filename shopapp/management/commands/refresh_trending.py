@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from shopapp import trending, viewcounter
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed trending rankings from the hourly view buckets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, action='append', help="Window to refresh (repeatable, default TRENDING_WINDOWS)")
+        parser.add_argument('--top-k', type=int, default=None, help="Products stored per window (default TRENDING_TOP_K)")
+        parser.add_argument('--no-prune', action='store_true', help="Keep buckets older than the retention period")
+
+    def handle(self, *args, **options):
+        # views buffered by this process (none for a standalone run)
+        viewcounter.flush()
+        stored = trending.refresh(windows=options['days'], top_k=options['top_k'])
+        for days, count in stored.items():
+            self.stdout.write(f"{days}-day window: {count} products ranked")
+        if not options['no_prune']:
+            deleted = trending.prune_buckets()
+            self.stdout.write(f"Pruned {deleted} old view buckets")
+        self.stdout.write(self.style.SUCCESS("Trending rankings refreshed"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from shopapp.db import JOURNAL_MODES, set_journal_mode
+
+
+class Command(BaseCommand):
+    help = (
+        "Show or switch the journal mode of the SQLite database file, e.g. `sqlite_journal_mode wal` "
+        "once on a production database. The mode is stored in the file and kept by every connection."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', nargs='?', type=str.upper, choices=JOURNAL_MODES, help="Journal mode to switch to")
+        parser.add_argument('--database', default='default', help="Database alias (default: default)")
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError("sqlite_journal_mode only applies to SQLite databases")
+        if options['mode'] is None:
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.stdout.write(cursor.fetchone()[0].upper())
+            return
+        mode = set_journal_mode(connection, options['mode'])
+        if mode != options['mode']:
+            raise CommandError(f"SQLite kept the {mode} journal mode (is the database in use or in memory?)")
+        self.stdout.write(self.style.SUCCESS(f"Journal mode: {mode}"))
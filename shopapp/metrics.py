@@ -0,0 +1,322 @@
+"""
+Per-view request metrics in Prometheus text format.
+
+MetricsMiddleware times every request and labels it with the URL name of the
+view that answered it. For a sampled request (METRICS_SAMPLE_RATE) it also
+records the number and total time of its SQL queries, through an execute
+wrapper installed on every database connection (`time_queries`), the time
+spent rendering templates (TimedDjangoTemplates backend) and the response
+size. Unsampled requests only count towards `bikrante_requests_total`.
+The sample of the running request lives in a context variable, so queries
+and templates of async views, run in sync_to_async threads, are counted too.
+
+Values go into fixed-bucket histograms kept in process memory: an
+observation is a bisect and two additions under a lock, so the middleware
+can stay on in production. `/metrics` renders them, together with the cache
+hit/miss counters of `shopapp.cache`, for Prometheus to scrape. Like the
+cache counters they are per process: scrape each worker, or sum them.
+
+SQL statements slower than METRICS_SLOW_QUERY_MS are logged to the
+`shopapp.metrics` logger with the view that ran them.
+"""
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+from .cache import cache_stats
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+SAMPLE_RATE = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+SLOW_QUERY_MS = getattr(settings, 'METRICS_SLOW_QUERY_MS', None)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (help, buckets), every histogram is labelled by view
+HISTOGRAMS = {
+    'bikrante_request_duration_seconds': ("Wall time of a request", SECONDS_BUCKETS),
+    'bikrante_db_queries': ("SQL queries run by a request", QUERY_COUNT_BUCKETS),
+    'bikrante_db_query_duration_seconds': ("Time a request spent in SQL queries", SECONDS_BUCKETS),
+    'bikrante_template_render_seconds': ("Time a request spent rendering templates", SECONDS_BUCKETS),
+    'bikrante_response_size_bytes': ("Size of the response body", SIZE_BUCKETS),
+}
+
+_current = ContextVar('request_sample', default=None)
+
+
+class Histogram:
+    """Prometheus style histogram with fixed upper bounds"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(upper bound, observations <= bound), ...] ending with +Inf"""
+        total, result = 0, []
+        for bound, count in zip((*self.bounds, float('inf')), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, view) -> Histogram
+        self.requests = {}  # (view, method, status) -> count
+        self.slow_queries = {}  # view -> count
+
+    def observe(self, view, values):
+        """Add one request's {histogram name: value}"""
+        with self.lock:
+            for name, value in values.items():
+                histogram = self.histograms.get((name, view))
+                if histogram is None:
+                    histogram = self.histograms[(name, view)] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def count_request(self, view, method, status):
+        key = (view, method, status)
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def count_slow_query(self, view):
+        with self.lock:
+            self.slow_queries[view] = self.slow_queries.get(view, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {
+                key: (list(histogram.cumulative()), histogram.sum, histogram.count)
+                for key, histogram in self.histograms.items()
+            }
+            return histograms, dict(self.requests), dict(self.slow_queries)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+            self.slow_queries.clear()
+
+
+registry = Registry()
+
+
+class RequestSample:
+    """What one sampled request spent, filled in while it runs"""
+
+    __slots__ = ('view', 'queries', 'query_seconds', 'template_seconds', 'template_depth')
+
+    def __init__(self):
+        self.view = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.query_seconds += elapsed
+            if SLOW_QUERY_MS is not None and elapsed * 1000 >= SLOW_QUERY_MS:
+                view = self.view or 'unresolved'
+                registry.count_slow_query(view)
+                logger.warning("slow query in %s (%.1f ms): %s", view, elapsed * 1000, sql)
+
+
+def time_queries(execute, sql, params, many, context):
+    """Execute wrapper of every connection: times the query for the sampled request, if any"""
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample(execute, sql, params, many, context)
+
+
+def install(connection):
+    """Add time_queries to a new connection (connection_created signal)"""
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """Records the metrics of every request, see the module docstring"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        token = _current.set(self.new_sample())
+        try:
+            response = self.get_response(request)
+        finally:
+            sample = _current.get()
+            _current.reset(token)
+        self.record(request, response, sample, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not ENABLED:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        token = _current.set(self.new_sample())
+        try:
+            response = await self.get_response(request)
+        finally:
+            sample = _current.get()
+            _current.reset(token)
+        self.record(request, response, sample, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def new_sample():
+        """A RequestSample, or None for a request left out by METRICS_SAMPLE_RATE"""
+        if SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE:
+            return None
+        return RequestSample()
+
+    @staticmethod
+    def record(request, response, sample, elapsed):
+        view = _view_name(request)
+        registry.count_request(view, request.method, response.status_code)
+        if sample is None:
+            return
+        values = {
+            'bikrante_request_duration_seconds': elapsed,
+            'bikrante_db_queries': sample.queries,
+            'bikrante_db_query_duration_seconds': sample.query_seconds,
+            'bikrante_template_render_seconds': sample.template_seconds,
+        }
+        if not getattr(response, 'streaming', False):
+            values['bikrante_response_size_bytes'] = len(response.content)
+        registry.observe(view, values)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # name the view early so slow queries are logged against it
+        sample = _current.get()
+        if sample is not None:
+            sample.view = _view_name(request)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        sample = _current.get()
+        if sample is None:
+            return super().render(context, request)
+        sample.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.template_depth -= 1
+            if not sample.template_depth:  # templates rendered inside others count once
+                sample.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for MetricsMiddleware"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _labels(**labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format"""
+    histograms, requests, slow_queries = registry.snapshot()
+    lines = [
+        "# HELP bikrante_requests_total Requests answered, sampled or not",
+        "# TYPE bikrante_requests_total counter",
+    ]
+    for (view, method, status), count in sorted(requests.items()):
+        lines.append(f"bikrante_requests_total{{{_labels(view=view, method=method, status=status)}}} {count}")
+
+    for name, (help_text, _bounds) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (metric, view), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, cumulative in buckets:
+                lines.append(f"{name}_bucket{{{_labels(view=view, le=_number(float(bound)))}}} {cumulative}")
+            lines.append(f"{name}_sum{{{_labels(view=view)}}} {_number(total)}")
+            lines.append(f"{name}_count{{{_labels(view=view)}}} {count}")
+
+    lines += [
+        f"# HELP bikrante_slow_queries_total SQL statements slower than {SLOW_QUERY_MS} ms",
+        "# TYPE bikrante_slow_queries_total counter",
+    ]
+    for view, count in sorted(slow_queries.items()):
+        lines.append(f"bikrante_slow_queries_total{{{_labels(view=view)}}} {count}")
+
+    families = sorted(cache_stats().items())
+    lines += ["# HELP bikrante_cache_requests_total Cache lookups by key family", "# TYPE bikrante_cache_requests_total counter"]
+    for family, counts in families:
+        for result, key in (('hit', 'hits'), ('miss', 'misses')):
+            lines.append(f"bikrante_cache_requests_total{{{_labels(family=family, result=result)}}} {counts[key]}")
+    for name, key, help_text in (
+        ('bikrante_cache_entries', 'entries', "Entries held in the local cache by key family"),
+        ('bikrante_cache_bytes', 'bytes', "Bytes held in the local cache by key family"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{{{_labels(family=family)}}} {counts[key]}" for family, counts in families if key in counts]
+    return "\n".join(lines) + "\n"
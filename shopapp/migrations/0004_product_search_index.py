@@ -0,0 +1,46 @@
+from itertools import islice
+
+from django.db import migrations
+
+FTS_TABLE = 'shopapp_product_fts'
+BATCH_SIZE = 1000
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Product = apps.get_model('shopapp', 'Product')
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "name, brand_name, tags, category_name, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+    )
+    products = Product.objects.select_related('category').order_by('pk').iterator(chunk_size=BATCH_SIZE)
+    with schema_editor.connection.cursor() as cursor:
+        while rows := [
+            (product.pk, product.name, product.brand_name, (product.tags or '').replace(',', ' '),
+             product.category.name, product.description)
+            for product in islice(products, BATCH_SIZE)
+        ]:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, brand_name, tags, category_name, description) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0003_remove_product_extra_info_product_specifications'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
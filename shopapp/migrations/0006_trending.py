@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0005_product_like_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.PositiveIntegerField(help_text='Hours since the Unix epoch (UTC)')),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_buckets', to='shopapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='shopapp_pro_hour_0297e9_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'hour'), name='unique_product_view_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_days', models.PositiveSmallIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField(help_text='Exponentially decayed views within the window')),
+                ('window_views', models.PositiveIntegerField()),
+                ('refreshed_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trending_ranks', to='shopapp.product')),
+            ],
+            options={
+                'ordering': ['window_days', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('window_days', 'rank'), name='unique_trending_rank')],
+            },
+        ),
+    ]
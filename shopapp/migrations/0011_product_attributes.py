@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# kind -> comma-separated Product field, as ProductAttribute.SOURCE_FIELDS
+SOURCE_FIELDS = {'tag': 'tags', 'color': 'colors', 'size': 'sizes'}
+
+
+def split_values(text):
+    values = []
+    for value in (text or '').split(','):
+        value = value.strip().lower()[:100]
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+def backfill_attributes(apps, schema_editor):
+    Product = apps.get_model('shopapp', 'Product')
+    ProductAttribute = apps.get_model('shopapp', 'ProductAttribute')
+    rows = []
+    for product in Product.objects.only(*SOURCE_FIELDS.values()).order_by('pk').iterator(chunk_size=2000):
+        for kind, field in SOURCE_FIELDS.items():
+            rows.extend(
+                ProductAttribute(product_id=product.pk, kind=kind, value=value)
+                for value in split_values(getattr(product, field))
+            )
+        if len(rows) >= 5000:
+            ProductAttribute.objects.bulk_create(rows, batch_size=1000)
+            rows = []
+    ProductAttribute.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductAttribute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('tag', 'Tag'), ('color', 'Color'), ('size', 'Size')], max_length=5)),
+                ('value', models.CharField(max_length=100)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attributes', to='shopapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'value', 'product'], name='attribute_kind_value_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'kind', 'value'), name='unique_product_attribute')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['brand_name'], name='product_brand_idx'),
+        ),
+        migrations.RunPython(backfill_attributes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:02
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, Value
+from django.db.models.functions import Round
+
+
+def backfill_effective_prices(apps, schema_editor):
+    """Every category starts with its standing discount, one UPDATE of its products each"""
+    Category = apps.get_model('shopapp', 'Category')
+    Product = apps.get_model('shopapp', 'Product')
+    for pk, discount in Category.objects.values_list('pk', 'discount_percentage'):
+        discount = Decimal(str(discount))
+        Category.objects.filter(pk=pk).update(active_discount_percentage=discount)
+        Product.objects.filter(category_id=pk).update(effective_price=Round(ExpressionWrapper(
+            F('price') * (100 - Value(discount)) / 100,
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ), 2))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0012_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_discount_percentage',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_effective_prices, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_cat_price_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price'], name='product_effective_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'effective_price'], name='product_cat_eff_price_idx'),
+        ),
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('discount_percentage', models.DecimalField(decimal_places=2, help_text="Replaces the category's discount while running, when larger", max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='shopapp.category')),
+            ],
+            options={
+                'ordering': ['-starts_at'],
+                'indexes': [models.Index(fields=['category', 'starts_at', 'ends_at'], name='promotion_category_time_idx')],
+            },
+        ),
+    ]
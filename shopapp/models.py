@@ -1,10 +1,13 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 import re
 from django.utils import timezone
-from django.db.models import Count, Sum
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Sum, OuterRef, Subquery, Q, Value
+from django.db.models.functions import Coalesce, Greatest, Round
 from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
 from django.core.files.storage import default_storage
 from django.core.files import File
 import os
@@ -27,6 +30,138 @@ def generate_slug(title):
     
     return slug
 
+
+SLUG_SAVE_RETRIES = 5
+
+
+def _slug_base(model, value):
+    max_length = model._meta.get_field('slug').max_length
+    # leave room for a "-<n>" suffix
+    base = generate_slug(value)[:max_length - 7].strip('-')
+    return base or model._meta.model_name
+
+
+def _slugs_of_bases(bases):
+    """
+    Q matching the slugs `base` and `base-...` of every base. A range rather
+    than startswith: SQLite can't search the slug index for a LIKE pattern.
+    """
+    query = Q(slug__in=bases)
+    for base in bases:
+        query |= Q(slug__gte=f"{base}-", slug__lt=f"{base}.")  # "." sorts right after "-"
+    return query
+
+
+def _taken_suffixes(model, bases, exclude_pk=None):
+    """
+    {base: set of taken suffixes} for every base, in one query per 200 bases.
+    Suffix 0 stands for the bare base slug.
+    """
+    taken = {base: set() for base in bases}
+    bases = list(taken)
+    for start in range(0, len(bases), 200):
+        slugs = model._default_manager.filter(_slugs_of_bases(bases[start:start + 200]))
+        if exclude_pk is not None:
+            slugs = slugs.exclude(pk=exclude_pk)
+        for slug in slugs.values_list('slug', flat=True):
+            if slug in taken:
+                taken[slug].add(0)
+            base, _, suffix = slug.rpartition('-')
+            if base in taken and suffix.isdigit():
+                taken[base].add(int(suffix))
+    return taken
+
+
+def _next_slug(base, taken):
+    """Lowest free slug for `base`, marking it as taken"""
+    suffix = 0
+    while suffix in taken:
+        suffix += 1
+    taken.add(suffix)
+    return base if suffix == 0 else f"{base}-{suffix}"
+
+
+def unique_slug(model, value, exclude_pk=None):
+    """First free slug for `value` (e.g. "shirt", "shirt-1", ...) with a single query"""
+    base = _slug_base(model, value)
+    return _next_slug(base, _taken_suffixes(model, [base], exclude_pk)[base])
+
+
+def assign_unique_slugs(objects, source='name'):
+    """
+    Give every object without a slug a unique one, in memory. Meant for
+    bulk_create(), which skips save(); costs one query per 200 distinct names.
+    """
+    pending = [obj for obj in objects if not obj.slug]
+    if not pending:
+        return objects
+    model = type(pending[0])
+    bases = {id(obj): _slug_base(model, getattr(obj, source)) for obj in pending}
+    taken = _taken_suffixes(model, set(bases.values()))
+    # slugs set on the other objects of the batch are taken too
+    for obj in objects:
+        if obj.slug:
+            base, _, suffix = obj.slug.rpartition('-')
+            if obj.slug in taken:
+                taken[obj.slug].add(0)
+            if base in taken and suffix.isdigit():
+                taken[base].add(int(suffix))
+    for obj in pending:
+        obj.slug = _next_slug(bases[id(obj)], taken[bases[id(obj)]])
+    return objects
+
+
+def save_with_unique_slug(instance, save, *args, **kwargs):
+    """
+    Run `save` after picking a unique slug when the instance has none. A
+    concurrent insert may take the same slug first; the unique constraint then
+    fails and we pick again.
+    """
+    if instance.slug:
+        return save(*args, **kwargs)
+    model = type(instance)
+    for attempt in range(SLUG_SAVE_RETRIES):
+        instance.slug = unique_slug(model, instance.name, exclude_pk=instance.pk)
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            slug_taken = model._default_manager.filter(slug=instance.slug).exclude(pk=instance.pk).exists()
+            if not slug_taken or attempt == SLUG_SAVE_RETRIES - 1:
+                instance.slug = ''
+                raise
+
+
+CENT = Decimal('0.01')
+
+
+def discounted_price(price, percentage):
+    """`price` less `percentage` percent, rounded to the cent like effective_price_expression"""
+    price = Decimal(str(price))
+    return (price * (100 - Decimal(str(percentage))) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def effective_price_expression(percentage):
+    """SQL computing a product's effective_price from its price, for set-based UPDATEs"""
+    return Round(ExpressionWrapper(
+        F('price') * (100 - Value(Decimal(str(percentage)))) / 100,
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    ), 2)
+
+
+def assign_effective_prices(products):
+    """
+    Set effective_price on every product, in memory, from its category's
+    active discount. Meant for bulk_create()/bulk_update(), which skip save();
+    costs one query.
+    """
+    discounts = dict(Category.objects.filter(
+        pk__in={product.category_id for product in products}
+    ).values_list('pk', 'active_discount_percentage'))
+    for product in products:
+        product.effective_price = discounted_price(product.price, discounts.get(product.category_id, 0))
+    return products
+
 # Create your models here.
 
 
@@ -50,6 +185,11 @@ class Category(models.Model):
         default=0.0,
         help_text="Discount percentage for all products in this category (e.g., 10 for 10%)",
     )
+    ##! the discount Product.effective_price was computed with: the standing discount above or a running
+    ##! promotion, whichever is larger (see Category.reprice)
+    active_discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0, editable=False)
+    ##! HTTP validators (ETag/Last-Modified) of the catalog pages are computed from the updated_at columns
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -59,9 +199,46 @@ class Category(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        if not self.slug:  # Only generate slug if it's empty
-            self.slug = generate_slug(self.name)
-        super().save(*args, **kwargs)
+        # Only generate slug if it's empty
+        save_with_unique_slug(self, super().save, *args, **kwargs)
+        # a changed discount reprices the products with one UPDATE
+        self.active_discount_percentage = self.reprice([self.pk]).get(self.pk, self.active_discount_percentage)
+
+    @classmethod
+    def target_discounts(cls, category_ids=None, now=None):
+        """{category id: (active discount, discount it should have at `now`)} in one query"""
+        now = now or timezone.now()
+        running = Promotion.objects.filter(
+            category=OuterRef('pk'), starts_at__lte=now, ends_at__gt=now
+        ).order_by().values('category').annotate(best=Max('discount_percentage')).values('best')
+        categories = cls.objects.all()
+        if category_ids is not None:
+            categories = categories.filter(pk__in=category_ids)
+        rows = categories.annotate(
+            target=Greatest('discount_percentage', Coalesce(Subquery(running), Value(Decimal(0))))
+        ).values_list('pk', 'active_discount_percentage', 'target')
+        return {pk: (Decimal(str(active)), Decimal(str(target)).quantize(CENT)) for pk, active, target in rows}
+
+    @classmethod
+    def reprice(cls, category_ids=None, now=None):
+        """
+        Bring the active discount of the categories (all when no ids given) in
+        line with their standing discount and running promotions. Every
+        category that changes costs one set-based UPDATE of its products.
+        Returns {category id: new active discount} of the repriced categories.
+        """
+        now = now or timezone.now()
+        changed = {
+            pk: target for pk, (active, target) in cls.target_discounts(category_ids, now).items()
+            if active != target
+        }
+        with transaction.atomic():
+            for pk, discount in changed.items():
+                Product.objects.filter(category_id=pk).update(
+                    effective_price=effective_price_expression(discount), updated_at=now
+                )
+                cls.objects.filter(pk=pk).update(active_discount_percentage=discount, updated_at=now)
+        return changed
 
     def get_absolute_url(self):
         return reverse('category-detail', kwargs={'slug': self.slug})
@@ -74,6 +251,36 @@ class Category(models.Model):
             return None
 
 
+# Scheduled category discounts
+class Promotion(models.Model):
+    """A discount on a category for a limited time, applied by `manage.py apply_promotions`"""
+    name = models.CharField(max_length=255)
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name="promotions"
+    )
+    discount_percentage = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        validators=[MinValueValidator(0), MaxValueValidator(100)],
+        help_text="Replaces the category's discount while running, when larger",
+    )
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-starts_at']
+        indexes = [
+            models.Index(fields=['category', 'starts_at', 'ends_at'], name='promotion_category_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.discount_percentage}% off {self.category})"
+
+    def clean(self):
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': "A promotion has to end after it starts."})
+
+
 # Product
 class Product(models.Model):
     category = models.ForeignKey(
@@ -82,6 +289,8 @@ class Product(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    ##! price less the category's active discount, what customers pay; sorts, filters and upsell use it
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
     brand_name=models.CharField(max_length=255)
     sku = models.CharField(max_length=100, unique=True)
     tags = models.CharField(
@@ -103,6 +312,8 @@ class Product(models.Model):
     image6 = models.ImageField(upload_to="product_images/", null=True, blank=True)
     likes = models.ManyToManyField(User, related_name="liked_products", blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    ##! bumped by every save and by the UPDATEs of fields the pages show (stock, review aggregates)
+    updated_at = models.DateTimeField(auto_now=True)
     slug = models.SlugField(unique=True, blank=True)  # Add slug field
     is_hot = models.BooleanField(default=False)
     ##! for word like gui type text typing
@@ -110,90 +321,342 @@ class Product(models.Model):
     views_count = models.PositiveIntegerField(default=0)
     sales_count = models.PositiveIntegerField(default=0)
     last_viewed = models.DateTimeField(null=True, blank=True)
-    
- 
+    ##! denormalized likes.count(), kept current by the m2m_changed handler in signals.py
+    like_count = models.PositiveIntegerField(default=0, db_index=True)
+    ##! review aggregates, kept up to date by the Review signals (see refresh_rating_aggregates)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)  # reviews with a rating
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    # precomputed recommendations stored for this product (see shopapp.recommendations)
+    neighbor_count = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ##! one index per ranking method / listing sort, see QueryPlanTests in tests.py
+        indexes = [
+            models.Index(fields=['created_at'], name='product_created_at_idx'),  # new arrivals, newest/oldest
+            models.Index(fields=['updated_at'], name='product_updated_at_idx'),  # Last-Modified of the listings
+            models.Index(fields=['sales_count'], name='product_sales_count_idx'),  # top selling, best_selling
+            models.Index(fields=['effective_price'], name='product_effective_price_idx'),  # price_low/price_high
+            models.Index(fields=['name'], name='product_name_idx'),  # name sort
+            models.Index(fields=['brand_name'], name='product_brand_idx'),  # brand facet
+            models.Index(fields=['is_hot', 'created_at'], name='product_hot_created_idx'),  # home featured
+            models.Index(fields=['category', 'created_at'], name='product_cat_created_idx'),  # category listing
+            models.Index(fields=['category', 'sales_count'], name='product_cat_sales_idx'),  # cross-sell
+            models.Index(fields=['category', 'effective_price'], name='product_cat_eff_price_idx'),  # upsell, category price sort
+        ]
+
     def __str__(self):
         return self.name
 
     def get_discounted_price(self):
         """
-        Dynamically calculates the discounted price based on the catagory's discount percentage.
+        The price after the category's discount (stored in effective_price, see Category.reprice).
         """
-        if self.category.discount_percentage > 0:
-            discount_amount = (self.price * self.category.discount_percentage) / 100
-            return round(self.price - discount_amount, 2)
-        return self.price
+        return self.effective_price
 
     def total_likes(self):
         """
         Returns the total number of likes for the product
         """
-        return self.likes.count()
+        return self.like_count
+
+    @classmethod
+    def like_count_subquery(cls):
+        """Correlated subquery counting the likes of the outer product"""
+        return Coalesce(Subquery(
+            cls.likes.through.objects.filter(product=OuterRef('pk'))
+            .order_by().values('product').annotate(total=Count('*')).values('total')
+        ), 0)
+
+    @classmethod
+    def refresh_like_counts(cls, product_ids=None):
+        """Recompute like_count from the likes table (all products when no ids given)"""
+        products = cls.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        return products.update(like_count=cls.like_count_subquery())
+
+    RATING_HISTOGRAM_FIELDS = tuple(f"rating_{stars}_count" for stars in range(1, 6))
+    RATING_FIELDS = ('review_count', 'rating_count', 'rating_sum') + RATING_HISTOGRAM_FIELDS
+
+    @property
+    def average_rating(self):
+        """Mean star rating, None without rated reviews"""
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 1)
+
+    def rating_histogram(self):
+        """[(stars, count, percent)] from 5 stars down to 1"""
+        return [
+            (stars, count, round(100 * count / self.rating_count) if self.rating_count else 0)
+            for stars, count in reversed(list(enumerate(
+                (getattr(self, field) for field in self.RATING_HISTOGRAM_FIELDS), start=1
+            )))
+        ]
+
+    @classmethod
+    def add_review_to_aggregates(cls, product_id, rating, sign=1):
+        """Count a review (sign=1) or discount it (sign=-1) with one F() UPDATE"""
+        changes = {'review_count': F('review_count') + sign, 'updated_at': timezone.now()}
+        if rating:
+            changes.update({
+                'rating_count': F('rating_count') + sign,
+                'rating_sum': F('rating_sum') + sign * rating,
+                f"rating_{rating}_count": F(f"rating_{rating}_count") + sign,
+            })
+        cls.objects.filter(pk=product_id).update(**changes)
+
+    @classmethod
+    def rating_aggregate_subqueries(cls):
+        """{field: correlated subquery recomputing it from the reviews table}"""
+        def aggregate(expression, **filters):
+            reviews = Review.objects.filter(product=OuterRef('pk'), **filters).order_by().values('product')
+            return Coalesce(Subquery(reviews.annotate(total=expression).values('total')), 0)
+
+        subqueries = {
+            'review_count': aggregate(Count('*')),
+            'rating_count': aggregate(Count('*'), rating__isnull=False),
+            'rating_sum': aggregate(Sum('rating')),
+        }
+        for stars, field in enumerate(cls.RATING_HISTOGRAM_FIELDS, start=1):
+            subqueries[field] = aggregate(Count('*'), rating=stars)
+        return subqueries
+
+    @classmethod
+    def refresh_rating_aggregates(cls, product_ids=None):
+        """Recompute the review aggregates from the reviews table (all products when no ids given)"""
+        products = cls.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        return products.update(updated_at=timezone.now(), **cls.rating_aggregate_subqueries())
     # unique slug generator
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = generate_slug(self.name)
-            # Check for existing slugs
-            unique_slug = base_slug
-            counter = 1
-            while Product.objects.filter(slug=unique_slug).exists():
-                unique_slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = unique_slug
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'price', 'category'}.intersection(update_fields):
+            self.effective_price = discounted_price(self.price, self.category.active_discount_percentage)
+            if update_fields is not None:
+                update_fields = [*update_fields, 'effective_price']
+        if update_fields is not None and 'updated_at' not in update_fields:
+            update_fields = [*update_fields, 'updated_at']  # auto_now only writes listed fields
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        save_with_unique_slug(self, super().save, *args, **kwargs)
 
     
+    # columns a product card needs (_product_card.html, _product_page.html)
+    CARD_FIELDS = (
+        'name', 'slug', 'price', 'effective_price', 'image1', 'image2', 'is_hot', 'rating_count', 'rating_sum',
+        'category__name', 'category__slug', 'category__active_discount_percentage',
+    )
+
+    @classmethod
+    def card_queryset(cls):
+        """Products with only the card columns and their category in the same query"""
+        return cls.objects.select_related('category').only(*cls.CARD_FIELDS)
+
     @classmethod
     def get_trending_products(cls, days=7, limit=4):
-        """Products with most views in last 7 days"""
-        date_threshold = timezone.now() - timedelta(days=days)
-        return cls.objects.filter(
-            last_viewed__gte=date_threshold
-        ).order_by('-views_count')[:limit]
+        """Products trending over the last `days` days (see shopapp.trending)"""
+        from .trending import get_trending
+        return get_trending(days=days, limit=limit)
 
     @classmethod
     def get_new_arrivals(cls, days=30, limit=4):
         """Products added in last 30 days"""
         date_threshold = timezone.now() - timedelta(days=days)
-        return cls.objects.filter(
+        return cls.card_queryset().filter(
             created_at__gte=date_threshold
         ).order_by('-created_at')[:limit]
 
     @classmethod
     def get_top_selling(cls, limit=4):
         """Products with highest sales count"""
-        return cls.objects.order_by('-sales_count')[:limit]
+        return cls.card_queryset().order_by('-sales_count')[:limit]
 
     @classmethod
     def get_popular_products(cls, limit=4):
         """Products with most likes"""
-        return cls.objects.annotate(
-            like_count=Count('likes')
-        ).order_by('-like_count')[:limit]
+        return cls.card_queryset().order_by('-like_count')[:limit]
+
+    def recommended_products(self):
+        """Precomputed neighbours (bought or liked together), best first"""
+        return Product.card_queryset().filter(
+            neighbor_of__product_id=self.pk
+        ).order_by('neighbor_of__rank')
 
     def get_cross_sell_products(self, limit=4):
-        """Products from same category that others bought"""
-        return Product.objects.filter(
-            category=self.category
+        """Products others bought (or liked) together with this one; best sellers of the category until there are any"""
+        if self.neighbor_count:
+            return self.recommended_products()[:limit]
+        return Product.card_queryset().filter(
+            category_id=self.category_id
         ).exclude(id=self.id).order_by('-sales_count')[:limit]
 
+    def category_upsell_products(self):
+        """More expensive products of the same category, cheapest first"""
+        return Product.card_queryset().filter(
+            category_id=self.category_id,
+            effective_price__gt=self.effective_price
+        ).order_by('effective_price')
+
     def get_upsell_products(self, limit=4):
-        """More expensive products in same category"""
-        return Product.objects.filter(
-            category=self.category,
-            price__gt=self.price
-        ).order_by('price')[:limit]
+        """
+        More expensive products bought together with this one, topped up from
+        the same category when fewer of them are pricier (a list)
+        """
+        products = []
+        if self.neighbor_count:
+            products = list(self.recommended_products().filter(effective_price__gt=self.effective_price)[:limit])
+        if len(products) < limit:
+            products += self.category_upsell_products().exclude(
+                pk__in=[product.pk for product in products]
+            )[:limit - len(products)]
+        return products
 
     def increment_views(self):
-        """Increment view count when product is viewed"""
-        self.views_count += 1
-        self.last_viewed = timezone.now()
-        self.save()
+        """Record a view; buffered in memory and flushed in batches by viewcounter"""
+        from .viewcounter import record_view
+        record_view(self.pk)
 
     def record_sale(self, quantity=1):
-        """Record a sale of the product"""
-        self.sales_count += quantity
-        self.save()
+        """Record a sale of the product (an atomic UPDATE, see shopapp.checkout for orders)"""
+        Product.objects.filter(pk=self.pk).update(sales_count=F('sales_count') + quantity)
+        self.refresh_from_db(fields=['sales_count'])
+
+
+#  Attributes
+def split_attribute_values(text):
+    """'Red, XL,red' -> ['red', 'xl']: lowercased, without blanks or duplicates"""
+    values = []
+    for value in (text or '').split(','):
+        value = value.strip().lower()[:100]
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+class ProductAttribute(models.Model):
+    """
+    One tag, color or size of a product. The admin keeps editing the
+    comma-separated Product fields; `sync` rewrites these rows from them so
+    filters and facet counts use an index instead of icontains scans.
+    """
+    TAG, COLOR, SIZE = 'tag', 'color', 'size'
+    KIND_CHOICES = [(TAG, "Tag"), (COLOR, "Color"), (SIZE, "Size")]
+    # kind -> the comma-separated Product field it comes from
+    SOURCE_FIELDS = {TAG: 'tags', COLOR: 'colors', SIZE: 'sizes'}
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="attributes")
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    value = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'kind', 'value'], name='unique_product_attribute'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'value', 'product'], name='attribute_kind_value_idx'),  # filters, facet counts
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.kind}={self.value}"
+
+    @classmethod
+    def sync(cls, products):
+        """Rewrite the attribute rows of `products` from their tags/colors/sizes"""
+        products = [product for product in products if product.pk is not None]
+        if not products:
+            return
+        with transaction.atomic():
+            cls.objects.filter(product_id__in=[product.pk for product in products]).delete()
+            cls.objects.bulk_create([
+                cls(product_id=product.pk, kind=kind, value=value)
+                for product in products
+                for kind, field in cls.SOURCE_FIELDS.items()
+                for value in split_attribute_values(getattr(product, field))
+            ], batch_size=1000)
+
+
+#  Trending
+class ProductViewBucket(models.Model):
+    """Views of a product during one hour; written by the view counter flush"""
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="view_buckets"
+    )
+    hour = models.PositiveIntegerField(help_text="Hours since the Unix epoch (UTC)")
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'hour'], name='unique_product_view_bucket'),
+        ]
+        indexes = [models.Index(fields=['hour'])]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.hour}: {self.views}"
+
+
+class TrendingProduct(models.Model):
+    """Precomputed trending top-K per window, rebuilt by `manage.py refresh_trending`"""
+    window_days = models.PositiveSmallIntegerField()
+    rank = models.PositiveSmallIntegerField()
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="trending_ranks"
+    )
+    score = models.FloatField(help_text="Exponentially decayed views within the window")
+    window_views = models.PositiveIntegerField()
+    refreshed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['window_days', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['window_days', 'rank'], name='unique_trending_rank'),
+        ]
+
+    def __str__(self):
+        return f"#{self.rank} ({self.window_days}d): {self.product_id}"
+
+
+#  Recommendations
+class ProductNeighbor(models.Model):
+    """
+    Top-K item-to-item recommendations of a product, from order and like
+    co-occurrence; rebuilt by `manage.py refresh_recommendations`
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="neighbors")
+    rank = models.PositiveSmallIntegerField()
+    neighbor = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="neighbor_of")
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_product_neighbor_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} #{self.rank}: {self.neighbor_id}"
+
+
+class RecommendationRun(models.Model):
+    """One refresh of the recommendations; the next incremental run starts after last_order_id"""
+    last_order_id = models.PositiveIntegerField(default=0)
+    full = models.BooleanField(default=False)
+    products_updated = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        get_latest_by = 'finished_at'
+
+    def __str__(self):
+        kind = "full" if self.full else "incremental"
+        return f"{kind} run up to order {self.last_order_id}: {self.products_updated} products"
 
 
 #  Reviews
@@ -213,10 +676,22 @@ class Review(models.Model):
 
     review_text = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the product page review list, newest first (keyset paginated)
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s review on {self.product.name}"
 
+    def save(self, *args, **kwargs):
+        # the signals updating the product's review aggregates share this transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 #  Orders
 class Order(models.Model):
@@ -248,6 +723,52 @@ class OrderItem(models.Model):  # Changed from OrderItems to OrderItem
         return f"{self.quantity} x {self.product.name}"
 
 
+#  Cart
+class Cart(models.Model):
+    """
+    A visitor's cart. Anonymous carts are found through the session, a user's
+    through `user`; the totals are kept up to date by shopapp.cart on every change.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name="cart"
+    )
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    discount_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        owner = self.user.username if self.user_id else "anonymous"
+        return f"Cart #{self.id} ({owner})"
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount_total
+
+
+class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="cart_items")
+    quantity = models.PositiveIntegerField(default=1)
+    # prices when the line was last changed, the cart totals are sums of these
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discounted_price = models.DecimalField(max_digits=10, decimal_places=2)
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in cart #{self.cart_id}"
+
+    @property
+    def line_total(self):
+        return self.discounted_price * self.quantity
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     address = models.TextField(blank=True)
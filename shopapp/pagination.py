@@ -0,0 +1,201 @@
+"""
+Cursor (keyset) pagination for the product listings and review lists.
+
+Instead of `OFFSET n`, the next page continues after the sort key of the
+last product shown (e.g. `WHERE (created_at, id) < (...)`), so every page
+costs the same as the first one. The cursor is an opaque url-safe token.
+Totals are only counted for the first page and are capped at
+APPROXIMATE_COUNT_CAP, shown as "1000+" on large result sets.
+"""
+import asyncio
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PER_PAGE = 12
+APPROXIMATE_COUNT_CAP = 1000
+
+# sort name -> ordering, always ending with the primary key as tie breaker
+SORTS = {
+    'newest': ('-created_at', '-id'),
+    'oldest': ('created_at', 'id'),
+    'price_low': ('effective_price', 'id'),
+    'price_high': ('-effective_price', '-id'),
+    'popular': ('-like_count', '-id'),
+    'best_selling': ('-sales_count', '-id'),
+    'name': ('name', 'id'),
+}
+DEFAULT_SORT = 'newest'
+# product page reviews, see Review.Meta.indexes
+REVIEW_ORDERING = ('-created_at', '-id')
+REVIEWS_PER_PAGE = 10
+
+
+class CursorPage:
+    """One page of products plus the cursor of the next page"""
+
+    def __init__(self, object_list, next_cursor=None, total=None, total_is_approximate=False):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_is_approximate = total_is_approximate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+def get_ordering(sort):
+    """Ordering for a `sort` query parameter, falling back to the default sort"""
+    return SORTS.get(sort, SORTS[DEFAULT_SORT])
+
+
+def encode_cursor(values):
+    raw = json.dumps([str(value) if value is not None else None for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, model=None, fields=()):
+    """
+    Values stored in `token`, converted back to the python type of each model
+    field. Returns None for a missing or malformed cursor.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list):
+            return None
+        if model is None:
+            return values
+        if len(values) != len(fields):
+            return None
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def approximate_count(queryset, cap=APPROXIMATE_COUNT_CAP):
+    """(count, is_approximate): counts at most `cap` + 1 rows"""
+    count = queryset.order_by()[:cap + 1].count()
+    if count > cap:
+        return cap, True
+    return count, False
+
+
+async def aapproximate_count(queryset, cap=APPROXIMATE_COUNT_CAP):
+    count = await queryset.order_by()[:cap + 1].acount()
+    if count > cap:
+        return cap, True
+    return count, False
+
+
+def _after(ordering, values):
+    """Q matching the rows that come after `values` in `ordering`"""
+    condition = Q()
+    equal = Q()
+    for key, value in zip(ordering, values):
+        name = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def _keyset_query(queryset, ordering, cursor, per_page):
+    """(rows queryset of the page plus one, sort fields, cursor values or None)"""
+    fields = [key.lstrip('-') for key in ordering]
+    values = decode_cursor(cursor, queryset.model, fields)
+    page = queryset.order_by(*ordering)
+    loaded, deferred = queryset.query.deferred_loading
+    if loaded and not deferred:
+        # an only() queryset must still load the sort keys for the next cursor
+        page = page.only(*loaded, *fields)
+    if values is not None:
+        page = page.filter(_after(ordering, values))
+    return page[:per_page + 1], fields, values
+
+
+def _keyset_result(rows, fields, per_page, total, total_is_approximate):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([getattr(rows[-1], name) for name in fields])
+    return CursorPage(rows, next_cursor, total, total_is_approximate)
+
+
+def keyset_page(queryset, ordering, cursor=None, per_page=PER_PAGE, count=True):
+    """
+    The page of `queryset` (sorted by `ordering`) that follows `cursor`.
+    `count=False` skips the first page total when the caller already knows it.
+    """
+    page, fields, values = _keyset_query(queryset, ordering, cursor, per_page)
+    total, total_is_approximate = (None, False)
+    if values is None and count:
+        total, total_is_approximate = approximate_count(queryset)
+    return _keyset_result(list(page), fields, per_page, total, total_is_approximate)
+
+
+async def akeyset_page(queryset, ordering, cursor=None, per_page=PER_PAGE, count=True):
+    """keyset_page for async views: the page and the first page total are fetched concurrently"""
+    page, fields, values = _keyset_query(queryset, ordering, cursor, per_page)
+    total, total_is_approximate = (None, False)
+    if values is None and count:
+        rows, (total, total_is_approximate) = await asyncio.gather(
+            _alist(page), aapproximate_count(queryset)
+        )
+    else:
+        rows = await _alist(page)
+    return _keyset_result(rows, fields, per_page, total, total_is_approximate)
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+def _id_slice(ids, cursor, per_page):
+    """(ids of the page, next cursor, total or None) of a ranked id list"""
+    values = decode_cursor(cursor)
+    start = 0
+    if values:
+        try:
+            start = max(int(values[0]), 0)
+        except (TypeError, ValueError):
+            start = 0
+    page_ids = ids[start:start + per_page]
+    end = start + len(page_ids)
+    next_cursor = encode_cursor([end]) if end < len(ids) else None
+    total = len(ids) if values is None else None
+    return page_ids, next_cursor, total
+
+
+def id_list_page(ids, load, cursor=None, per_page=PER_PAGE, cap=None):
+    """
+    Page over an already ranked list of ids (search results). The cursor holds
+    the position in the list and `load(ids)` fetches only this page's objects.
+    A list of `cap` ids was cut off there, its total is shown as approximate.
+    """
+    page_ids, next_cursor, total = _id_slice(ids, cursor, per_page)
+    return CursorPage(load(page_ids), next_cursor, total, _is_capped(total, cap))
+
+
+async def aid_list_page(ids, aload, cursor=None, per_page=PER_PAGE, cap=None):
+    """id_list_page with an async `aload(ids)`"""
+    page_ids, next_cursor, total = _id_slice(ids, cursor, per_page)
+    return CursorPage(await aload(page_ids), next_cursor, total, _is_capped(total, cap))
+
+
+def _is_capped(total, cap):
+    return total is not None and cap is not None and total >= cap
@@ -0,0 +1,159 @@
+"""
+Item-to-item recommendations from order and like co-occurrence.
+
+Two products are related when they are bought in the same order or liked by
+the same user. For every product we score the others by cosine similarity
+over both signals:
+
+    score(a, b) = cos_orders(a, b) + RECOMMENDER_LIKE_WEIGHT * cos_likes(a, b)
+    cos(a, b)   = baskets holding both / sqrt(baskets holding a * baskets holding b)
+
+and store the best RECOMMENDER_TOP_K as `ProductNeighbor` rows, so the
+product page reads its cross-sells with one indexed query
+(`Product.get_cross_sell_products`). Products without neighbours yet keep
+the category best sellers.
+
+`manage.py refresh_recommendations` only recomputes the products of orders
+placed since the previous run (and the baskets they appear in); `--full`
+rebuilds every product, which also picks up likes of products nobody has
+bought since. Pairs are counted basket by basket in BATCH_SIZE batches of
+products.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+TOP_K = getattr(settings, 'RECOMMENDER_TOP_K', 20)
+LIKE_WEIGHT = getattr(settings, 'RECOMMENDER_LIKE_WEIGHT', 0.5)
+# products recomputed per batch, bounds the pair counts held in memory
+BATCH_SIZE = 2000
+
+
+def order_baskets(product_ids=None):
+    """{order_id: [product_id, ...]} of the orders containing any of `product_ids` (all orders when None)"""
+    from .models import OrderItem
+
+    items = OrderItem.objects.all()
+    if product_ids is not None:
+        items = items.filter(order_id__in=OrderItem.objects.filter(product_id__in=product_ids).values('order_id'))
+    baskets = defaultdict(list)
+    for order_id, product_id in items.values_list('order_id', 'product_id').distinct().iterator():
+        baskets[order_id].append(product_id)
+    return baskets
+
+
+def like_baskets(product_ids=None):
+    """{user_id: [product_id, ...]} of the users who liked any of `product_ids` (all likes when None)"""
+    from .models import Product
+
+    likes = Product.likes.through.objects.all()
+    if product_ids is not None:
+        likes = likes.filter(user_id__in=Product.likes.through.objects.filter(product_id__in=product_ids).values('user_id'))
+    baskets = defaultdict(list)
+    for user_id, product_id in likes.values_list('user_id', 'product_id').iterator():
+        baskets[user_id].append(product_id)
+    return baskets
+
+
+def basket_frequencies():
+    """({product_id: orders holding it}, {product_id: users liking it}) over the whole history"""
+    from .models import OrderItem, Product
+
+    orders = dict(
+        OrderItem.objects.order_by().values('product_id')
+        .annotate(total=Count('order_id', distinct=True)).values_list('product_id', 'total')
+    )
+    likes = dict(Product.objects.filter(like_count__gt=0).values_list('pk', 'like_count'))
+    return orders, likes
+
+
+def cosine_neighbors(baskets, targets, frequency):
+    """{target: {product: cosine}} by counting pairs basket by basket"""
+    target_set = set(targets)
+    pairs = defaultdict(lambda: defaultdict(int))
+    for products in baskets.values():
+        for a in target_set.intersection(products):
+            row = pairs[a]
+            for b in products:
+                if b != a:
+                    row[b] += 1
+    return {
+        a: {b: count / math.sqrt(frequency[a] * frequency[b]) for b, count in row.items()}
+        for a, row in pairs.items()
+    }
+
+
+def compute_neighbors(product_ids, top_k=None, like_weight=None):
+    """{product_id: [(neighbor_id, score), ...]} best first, for `product_ids`"""
+    top_k = top_k or TOP_K
+    like_weight = LIKE_WEIGHT if like_weight is None else like_weight
+    order_frequency, like_frequency = basket_frequencies()
+    bought = cosine_neighbors(order_baskets(product_ids), product_ids, order_frequency)
+    liked = cosine_neighbors(like_baskets(product_ids), product_ids, like_frequency) if like_weight else {}
+
+    neighbors = {}
+    for product_id in product_ids:
+        scores = dict(bought.get(product_id, {}))
+        for other, score in liked.get(product_id, {}).items():
+            scores[other] = scores.get(other, 0.0) + like_weight * score
+        neighbors[product_id] = heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
+    return neighbors
+
+
+def store_neighbors(neighbors):
+    """Replace the ProductNeighbor rows (and neighbor_count) of the products in `neighbors`"""
+    from .models import Product, ProductNeighbor
+
+    with transaction.atomic():
+        ProductNeighbor.objects.filter(product_id__in=list(neighbors)).delete()
+        ProductNeighbor.objects.bulk_create([
+            ProductNeighbor(product_id=product_id, rank=rank, neighbor_id=neighbor_id, score=score)
+            for product_id, ranked in neighbors.items()
+            for rank, (neighbor_id, score) in enumerate(ranked, start=1)
+        ], batch_size=1000)
+        by_count = defaultdict(list)
+        for product_id, ranked in neighbors.items():
+            by_count[len(ranked)].append(product_id)
+        for count, product_ids in by_count.items():
+            Product.objects.filter(pk__in=product_ids).update(neighbor_count=count)
+
+
+def products_to_refresh(after_order_id=0):
+    """Products of the orders after `after_order_id`, i.e. whose co-purchases changed"""
+    from .models import OrderItem
+
+    return sorted(set(
+        OrderItem.objects.filter(order_id__gt=after_order_id).values_list('product_id', flat=True)
+    ))
+
+
+def refresh(full=False, top_k=None, like_weight=None):
+    """
+    Recompute the neighbours of the products touched by orders since the last
+    run (every product with an order or a like when `full`). Returns the run.
+    """
+    from .models import Order, Product, RecommendationRun
+
+    last_order_id = Order.objects.aggregate(last=Max('pk'))['last'] or 0
+    previous = RecommendationRun.objects.order_by('-finished_at', '-pk').first()
+    if full or previous is None:
+        # products that lost all their orders and likes drop their neighbours too
+        product_ids = sorted(
+            set(products_to_refresh())
+            | set(Product.objects.filter(like_count__gt=0).values_list('pk', flat=True))
+            | set(Product.objects.filter(neighbor_count__gt=0).values_list('pk', flat=True))
+        )
+        full = True
+    else:
+        product_ids = products_to_refresh(previous.last_order_id)
+
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        batch = product_ids[start:start + BATCH_SIZE]
+        store_neighbors(compute_neighbors(batch, top_k=top_k, like_weight=like_weight))
+    return RecommendationRun.objects.create(
+        last_order_id=last_order_id, full=full, products_updated=len(product_ids)
+    )
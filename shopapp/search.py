@@ -0,0 +1,261 @@
+"""
+Full-text product search backed by an SQLite FTS5 index.
+
+`shopapp_product_fts` holds one row per product (rowid = product id) with the
+searchable text of the product and its category. It is kept in sync by the
+Product/Category signals in `shopapp.signals` and can be repopulated with
+`manage.py rebuild_search_index` (needed after bulk_create/update, which
+skip signals). Results are ranked with BM25, weighting name > brand > tags >
+category > description, and every term is prefix matched so the HTMX search
+box gets results while the user is still typing.
+
+Terms are normalized (lowercased, de-duplicated, sorted) before they reach
+the index, so "Shoes red" and "red shoes" are the same query. The ranked id
+list of a query and facet filter set is cached (`cached_product_ids`) under the
+catalog version, so repeated searches only load the products of their page.
+Only the best MAX_RESULTS matches are ranked, so a one letter query costs
+about the same as a precise one.
+
+On databases without FTS5 the search falls back to the old icontains filter.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .cache import PAGE_TIMEOUT, catalog_version
+
+FTS_TABLE = 'shopapp_product_fts'
+# column order of the FTS table, used for the bm25() weights as well
+FTS_COLUMNS = ('name', 'brand_name', 'tags', 'category_name', 'description')
+# Product fields the index is built from; saves touching none of them skip it
+INDEXED_FIELDS = frozenset({'name', 'brand_name', 'tags', 'category', 'description'})
+FTS_WEIGHTS = (10.0, 5.0, 3.0, 2.0, 1.0)
+RESULT_CACHE_TIMEOUT = getattr(settings, 'SEARCH_RESULT_CACHE_TIMEOUT', PAGE_TIMEOUT)
+# longer result lists (one or two letter queries) are not worth the cache memory
+RESULT_CACHE_MAX_IDS = getattr(settings, 'SEARCH_RESULT_CACHE_MAX_IDS', 5000)
+# matches ranked per query (and facet filter set); nobody scrolls further
+MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+
+
+def is_available():
+    """True when the current database has the FTS index"""
+    return connection.vendor == 'sqlite'
+
+
+def _document(product, category_name=None):
+    if category_name is None:
+        category_name = product.category.name
+    return [
+        product.name,
+        product.brand_name,
+        (product.tags or '').replace(',', ' '),
+        category_name,
+        product.description,
+    ]
+
+
+def index_product(product):
+    """Add or replace the index row for a single product"""
+    if not is_available():
+        return
+    # one transaction, or concurrent saves of a product both insert its rowid
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s)",
+            [product.pk, *_document(product)],
+        )
+
+
+def remove_product(product_id):
+    """Drop the index row of a deleted product"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def index_products(products, batch_size=1000):
+    """Re-index an iterable of products (category must be loadable per product)"""
+    if not is_available():
+        return 0
+    count = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for product in products:
+            batch.append(product)
+            if len(batch) >= batch_size:
+                count += _index_batch(cursor, batch)
+                batch = []
+        if batch:
+            count += _index_batch(cursor, batch)
+    return count
+
+
+def _index_batch(cursor, products):
+    ids = [product.pk for product in products]
+    placeholders = ', '.join(['%s'] * len(ids))
+    with transaction.atomic():
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", ids)
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s)",
+            [[product.pk, *_document(product)] for product in products],
+        )
+    return len(products)
+
+
+def reindex_category(category):
+    """Refresh the category name stored for every product of `category`"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {FTS_TABLE} SET category_name = %s WHERE rowid IN "
+            "(SELECT id FROM shopapp_product WHERE category_id = %s)",
+            [category.name, category.pk],
+        )
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Empty the index and repopulate it from every product, in one transaction:
+    searches keep seeing the old index until the new one is complete.
+    """
+    from .models import Product
+
+    if not is_available():
+        return 0
+    products = Product.objects.select_related('category').only(
+        'name', 'brand_name', 'tags', 'description', 'category__name'
+    ).order_by('pk')
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        return index_products(products.iterator(chunk_size=batch_size), batch_size=batch_size)
+
+
+def split_terms(search_text):
+    """Lowercased, de-duplicated search terms in sorted order (the match is order independent)"""
+    return sorted(set(search_text.lower().split()))
+
+
+def build_match_query(terms):
+    """
+    FTS5 MATCH expression: any term, each as a quoted prefix query so user
+    input can never be parsed as FTS syntax.
+    """
+    quoted = []
+    for term in terms:
+        term = term.replace('"', '""')
+        quoted.append(f'"{term}"*')
+    return ' OR '.join(quoted)
+
+
+def search_product_ids(search_text, limit=None, within=None):
+    """
+    Product ids matching `search_text`, best match first. Any term may match
+    (OR), like the previous icontains search. `within` (a Product queryset,
+    e.g. facet filters) narrows the matches in the same query, before `limit`.
+    """
+    terms = split_terms(search_text)
+    if not terms:
+        return []
+    if not is_available():
+        return _fallback_search_ids(terms, limit, within)
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    sql = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    params = [build_match_query(terms)]
+    if within is not None:
+        within_sql, within_params = within.order_by().values('pk').query.sql_with_params()
+        sql += f" AND rowid IN ({within_sql})"
+        params.extend(within_params)
+    sql += f" ORDER BY bm25({FTS_TABLE}, {weights}), rowid DESC"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def result_cache_key(search_text, filters=None):
+    filters = sorted((facet, sorted(values)) for facet, values in (filters or {}).items())
+    normalized = repr((split_terms(search_text), filters))
+    return f"search:{catalog_version()}:{hashlib.md5(normalized.encode()).hexdigest()}"
+
+
+def cached_product_ids(search_text, filters=None):
+    """
+    The best MAX_RESULTS ids of search_product_ids among the products passing
+    the facet `filters`, cached until the catalog changes. The cache evicts least recently used
+    entries first (CACHES MAX_ENTRIES); hits, misses and bytes are reported by
+    `cache_stats()` under the 'search' family.
+    """
+    from .facets import apply_filters
+    from .models import Product
+
+    key = result_cache_key(search_text, filters)
+    product_ids = cache.get(key)
+    if product_ids is None:
+        within = apply_filters(Product.objects.all(), filters) if filters else None
+        product_ids = search_product_ids(search_text, limit=MAX_RESULTS, within=within)
+        if len(product_ids) <= RESULT_CACHE_MAX_IDS:
+            cache.set(key, product_ids, RESULT_CACHE_TIMEOUT)
+    return product_ids
+
+
+def match_q(search_text):
+    """Q matching the same products as search_product_ids, to combine with other filters in SQL"""
+    terms = split_terms(search_text)
+    if not terms:
+        return Q(pk__in=[])
+    if not is_available():
+        return _fallback_q(terms)
+    return Q(pk__in=RawSQL(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [build_match_query(terms)]
+    ))
+
+
+def _fallback_q(terms):
+    query = Q()
+    for term in terms:
+        query |= (
+            Q(name__icontains=term) |
+            Q(description__icontains=term) |
+            Q(category__name__icontains=term) |
+            Q(brand_name__icontains=term) |
+            Q(tags__icontains=term)
+        )
+    return query
+
+
+def _fallback_search_ids(terms, limit=None, within=None):
+    from .models import Product
+
+    products = Product.objects.filter(_fallback_q(terms))
+    if within is not None:
+        products = products.filter(pk__in=within.values('pk'))
+    ids = products.order_by('-created_at').values_list('pk', flat=True)
+    if limit is not None:
+        ids = ids[:limit]
+    return list(ids)
+
+
+def load_products(product_ids):
+    """The products for `product_ids` in one query, keeping the ranked order"""
+    from .models import Product
+
+    by_id = Product.card_queryset().in_bulk(product_ids)
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+
+async def aload_products(product_ids):
+    """load_products for async views"""
+    from .models import Product
+
+    by_id = await Product.card_queryset().ain_bulk(product_ids)
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
@@ -0,0 +1,155 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import cart, images, metrics, search, typeahead
+from .cache import bump_catalog_version
+from .db import apply_sqlite_pragmas
+from .models import Category, Product, ProductAttribute, Promotion, Review
+
+
+##! keep the full-text search index in sync with the catalog
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:  # loaddata, the fixture rows are indexed by rebuild_search_index
+        return
+    if update_fields is not None and not search.INDEXED_FIELDS.intersection(update_fields):
+        return  # e.g. a stock or counter update
+    search.index_product(instance)
+
+
+##! keep the normalized tag/color/size rows in sync with the comma-separated fields
+@receiver(post_save, sender=Product)
+def sync_product_attributes(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:  # loaddata: the fixture brings its own attribute rows
+        return
+    if update_fields is not None and not set(ProductAttribute.SOURCE_FIELDS.values()).intersection(update_fields):
+        return
+    ProductAttribute.sync([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+##! this process's typeahead index sees its own product edits at once (see shopapp.typeahead)
+@receiver(post_save, sender=Product)
+def update_typeahead(sender, instance, raw=False, **kwargs):
+    if not raw:
+        typeahead.product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_typeahead(sender, instance, **kwargs):
+    typeahead.product_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:  # a new category has no products yet
+        return
+    search.reindex_category(instance)
+
+
+##! keep Product.like_count equal to the number of rows in Product.likes
+@receiver(m2m_changed, sender=Product.likes.through)
+def update_like_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # user.liked_products.add/remove/clear: pk_set holds product ids
+        if action == 'pre_clear':
+            instance._cleared_liked_product_ids = list(
+                instance.liked_products.values_list('pk', flat=True)
+            )
+            return
+        if action == 'post_clear':
+            product_ids = getattr(instance, '_cleared_liked_product_ids', [])
+        elif action in ('post_add', 'post_remove'):
+            product_ids = pk_set or []
+        else:
+            return
+    else:
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+        product_ids = [instance.pk]
+    if product_ids:
+        Product.refresh_like_counts(product_ids)
+
+
+##! Product review aggregates follow every review change, inside Review.save()'s transaction
+@receiver(pre_save, sender=Review)
+def remember_reviewed_rating(sender, instance, raw=False, **kwargs):
+    instance._counted_review = None
+    if raw or instance.pk is None:
+        return
+    instance._counted_review = Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def count_saved_review(sender, instance, raw=False, **kwargs):
+    if raw:  # loaddata, repaired by reconcile_review_aggregates
+        return
+    before = getattr(instance, '_counted_review', None)
+    after = (instance.product_id, instance.rating)
+    if before == after:
+        return
+    if before is not None:
+        Product.add_review_to_aggregates(*before, sign=-1)
+    Product.add_review_to_aggregates(*after)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_deleted_review(sender, instance, **kwargs):
+    Product.add_review_to_aggregates(instance.product_id, instance.rating, sign=-1)
+
+
+##! a promotion edited while it runs (or starting right away) reprices its category at once;
+##! the others are picked up by `manage.py apply_promotions`
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def reprice_promoted_category(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Category.reprice([instance.category_id])
+
+
+##! any catalog change invalidates the cached pages and fragments
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+##! resized JPEG/WebP copies of uploaded images, generated off the request path
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    images.schedule(images.image_names(instance))
+
+
+##! tuned PRAGMAs on every SQLite connection (settings.SQLITE_PRAGMAS, SQLITE_JOURNAL_MODE)
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        apply_sqlite_pragmas(connection)
+
+
+##! per-request SQL timings (shopapp.metrics), whichever thread runs the query
+@receiver(connection_created)
+def time_connection_queries(sender, connection, **kwargs):
+    metrics.install(connection)
+
+
+##! the cart filled before signing in carries over to the account
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        cart.merge_session_cart(request, user)
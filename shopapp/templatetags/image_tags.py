@@ -0,0 +1,36 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from .. import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_img(image, alt='', css_class='', sizes='(max-width: 576px) 50vw, 300px'):
+    """
+    <picture> with WebP and JPEG srcsets of the derivatives of `image`, or a
+    plain <img> of the original while the derivatives are not generated yet.
+
+    {% responsive_img product.image1 alt=product.name css_class="product__img default" %}
+    """
+    if not image:
+        return ''
+    widths = images.generated_widths(image.name)
+    if not widths:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy" />', image.url, alt, css_class)
+
+    def srcset(extension, widths):
+        return ', '.join(
+            f"{images.derivative_url(image.name, width, extension)} {width}w" for width in widths
+        )
+
+    # WebP is written separately and may be missing (failed or still pending) for some widths
+    webp_widths = images.generated_widths(image.name, 'webp')
+    webp = format_html(
+        '<source type="image/webp" srcset="{}" sizes="{}" />', srcset('webp', webp_widths), sizes
+    ) if webp_widths else ''
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" /></picture>',
+        webp, images.derivative_url(image.name, widths[0], 'jpg'), srcset('jpg', widths), sizes, alt, css_class,
+    )
@@ -0,0 +1,22 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def rating_stars(rating, count=None):
+    """
+    Five star icons for a 0-5 rating (solid for earned stars), optionally
+    followed by the number of ratings.
+
+    {% rating_stars product.average_rating product.rating_count %}
+    """
+    filled = round(rating or 0)
+    stars = format_html_join(
+        '', '<i class="fi {}"></i>',
+        (('fi-ss-star' if star <= filled else 'fi-rs-star',) for star in range(1, 6)),
+    )
+    if count is None:
+        return stars
+    return format_html('{} <span class="rating__count">({})</span>', stars, count)
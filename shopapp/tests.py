@@ -1,3 +1,1384 @@
-from django.test import TestCase
+import os
+import tempfile
+from concurrent.futures import Future
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from itertools import count
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection, connections
+from django.http import QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cart as shopping_cart
+from . import benchmark, db, facets, images, metrics, recommendations, search, trending, typeahead, viewcounter
+from .cache import bump_catalog_version, cache_stats, catalog_version, page_cache_key, reset_cache_stats
+from .templatetags import image_tags
+from .checkout import CheckoutError, place_order
+from .models import (
+    Cart, Category, Order, Product, ProductAttribute, ProductNeighbor, ProductViewBucket, Promotion, RecommendationRun,
+    Review, TrendingProduct,
+    assign_effective_prices,
+    assign_unique_slugs,
+    unique_slug,
+)
+from .pagination import SORTS, decode_cursor, encode_cursor, id_list_page, keyset_page
 
 # Create your tests here.
+
+
+def create_catalog(categories=3, products_per_category=20, users=5):
+    """Small seeded catalog: categories, products, likes and reviews"""
+    people = [
+        User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com", password="x")
+        for i in range(users)
+    ]
+    products = []
+    for c in range(categories):
+        category = Category.objects.create(name=f"Category {c}", discount_percentage=c * 5)
+        for p in range(products_per_category):
+            product = Product.objects.create(
+                category=category,
+                name=f"Product {c}-{p}",
+                description=f"Description of product {c}-{p}",
+                price=10 + p,
+                brand_name=f"Brand {p % 4}",
+                sku=f"SKU-{c}-{p}",
+                tags="tech,home",
+                stock=10,
+                is_hot=p % 5 == 0,
+                image1="product_images/sony_cam.jpg",
+                image2="product_images/sony_Alpha.webp",
+            )
+            products.append(product)
+    for i, product in enumerate(products):
+        product.likes.add(*people[: i % len(people)])
+        Review.objects.create(product=product, user=people[i % len(people)], rating=1 + i % 5, review_text="ok")
+    return people, products
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every listing path must render in a bounded number of queries, however many
+    products are on the page. Budgets are for an uncached render, including the
+    query of the ETag/Last-Modified validators where a view has them.
+    """
+
+    BUDGETS = {
+        'home': 3,
+        'home-section': 2,
+        'shop': 4,  # + the facet counts (cached after the first visitor)
+        'search': 4,
+        'category-detail': 4,
+        'product-detail': 3,
+        'wishlist': 3,
+        'product-reviews': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog()
+        cls.category = cls.products[0].category
+
+    def setUp(self):
+        cache.clear()
+
+    def assertWithinBudget(self, name, url, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), self.BUDGETS[name],
+            f"{url} ran {len(queries)} queries:\n" + "\n".join(q['sql'] for q in queries.captured_queries),
+        )
+        return response
+
+    def test_home(self):
+        self.assertWithinBudget('home', reverse('home'))
+
+    def test_home_sections(self):
+        for section in ('popular', 'new-added', 'trending', 'top-selling'):
+            self.assertWithinBudget('home-section', reverse('home-section', args=[section]))
+
+    def test_shop(self):
+        response = self.assertWithinBudget('shop', reverse('shop'))
+        self.assertEqual(len(response.context['products']), 12)
+        self.assertWithinBudget('shop', response.context['next_url'], HTTP_HX_REQUEST='true')
+
+    def test_search(self):
+        self.assertWithinBudget('search', reverse('search') + '?search_text=product brand')
+        self.assertWithinBudget('search', reverse('search') + '?search_text=product', HTTP_HX_REQUEST='true')
+        self.assertWithinBudget('search', reverse('search'))
+
+    def test_category_detail(self):
+        self.assertWithinBudget('category-detail', self.category.get_absolute_url())
+
+    def test_product_detail(self):
+        product = self.products[0]
+        self.assertWithinBudget('product-detail', reverse('product-detail', args=[product.slug]))
+
+    def test_wishlist(self):
+        self.client.force_login(self.users[-1])
+        self.assertWithinBudget('wishlist', reverse('wishlist'))
+
+    def test_product_reviews(self):
+        product = self.products[0]
+        Review.objects.bulk_create([
+            Review(product=product, user=self.users[i % len(self.users)], rating=5, review_text=f"review {i}")
+            for i in range(25)
+        ])
+        url = reverse('product-reviews', args=[product.slug])
+        response = self.assertWithinBudget('product-reviews', url)
+        self.assertEqual(len(response.context['reviews']), 10)
+        response = self.assertWithinBudget('product-reviews', response.context['next_url'], HTTP_HX_REQUEST='true')
+        self.assertEqual(len(response.context['reviews']), 10)
+
+
+class QueryPlanTests(TestCase):
+    """
+    The ranking methods and listing sorts must be answered from an index:
+    no full scan of shopapp_product and no temporary B-tree for ORDER BY.
+    """
+
+    PRODUCTS = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name=f"Category {c}") for c in range(10)]
+        products = [
+            Product(
+                category=categories[i % len(categories)],
+                name=f"Product {i}",
+                description="",
+                price=i % 997,
+                brand_name=f"Brand {i % 50}",
+                sku=f"SKU-{i}",
+                stock=i % 20,
+                is_hot=i % 25 == 0,
+                sales_count=i % 301,
+                like_count=i % 89,
+            )
+            for i in range(cls.PRODUCTS)
+        ]
+        Product.objects.bulk_create(assign_effective_prices(assign_unique_slugs(products)), batch_size=1000)
+        cls.product = Product.objects.order_by('pk')[cls.PRODUCTS // 2]
+        TrendingProduct.objects.bulk_create([
+            TrendingProduct(window_days=7, rank=rank, product_id=cls.product.pk + rank, score=1.0,
+                            window_views=1, refreshed_at=cls.product.created_at)
+            for rank in range(1, 51)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset):
+        if connection.vendor != 'sqlite':
+            self.skipTest("EXPLAIN QUERY PLAN is SQLite specific")
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            self.assertNotIn("TEMP B-TREE", line, f"sort without index:\n{plan}")
+            if "SCAN shopapp_product" in line:
+                self.assertIn("USING", line, f"full table scan:\n{plan}")
+        return plan
+
+    def test_slug_allocation_searches_the_slug_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("EXPLAIN QUERY PLAN is SQLite specific")
+        products = [Product(name=f"Product {i % 50}") for i in range(100)]
+        with CaptureQueriesContext(connection) as queries:
+            assign_unique_slugs(products)
+            unique_slug(Product, "Product 7", exclude_pk=self.product.pk)
+        for query in queries:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                plan = "\n".join(row[-1] for row in cursor.fetchall())
+            self.assertNotIn("SCAN", plan)
+            self.assertIn("(slug>? AND slug<?)", plan)
+
+    def test_new_arrivals(self):
+        self.assertUsesIndex(Product.get_new_arrivals())
+
+    def test_top_selling(self):
+        self.assertUsesIndex(Product.get_top_selling())
+
+    def test_popular_products(self):
+        self.assertUsesIndex(Product.get_popular_products())
+
+    def test_trending_products(self):
+        self.assertUsesIndex(Product.card_queryset().filter(
+            trending_ranks__window_days=7, trending_ranks__refreshed_at__gte=self.product.created_at
+        ).order_by('trending_ranks__rank')[:4])
+
+    def test_cross_sell_products(self):
+        self.assertUsesIndex(self.product.get_cross_sell_products())
+
+    def test_upsell_products(self):
+        self.assertUsesIndex(self.product.category_upsell_products()[:4])
+
+    def test_recommended_products(self):
+        ProductNeighbor.objects.bulk_create([
+            ProductNeighbor(product=self.product, rank=rank, neighbor_id=self.product.pk + rank, score=1.0 / rank)
+            for rank in range(1, 21)
+        ])
+        self.product.neighbor_count = 20
+        self.assertUsesIndex(self.product.get_cross_sell_products())
+        self.assertUsesIndex(self.product.recommended_products().filter(effective_price__gt=self.product.effective_price)[:4])
+
+    def test_home_featured(self):
+        self.assertUsesIndex(Product.card_queryset().filter(is_hot=True).order_by('-created_at')[:8])
+
+    def test_listing_sorts(self):
+        for sort, ordering in SORTS.items():
+            with self.subTest(sort=sort):
+                self.assertUsesIndex(Product.card_queryset().order_by(*ordering)[:13])
+
+    def test_category_listing(self):
+        category = self.product.category
+        for sort in ('newest', 'price_low', 'price_high', 'best_selling'):
+            with self.subTest(sort=sort):
+                self.assertUsesIndex(
+                    Product.card_queryset().filter(category=category).order_by(*SORTS[sort])[:13]
+                )
+
+
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, products = create_catalog(categories=2, products_per_category=10, users=3)
+        start = timezone.now()
+        for i, product in enumerate(products):
+            # few distinct values per sort key, so every page boundary falls inside a tie
+            Product.objects.filter(pk=product.pk).update(
+                created_at=start - timedelta(hours=i // 4), name=f"Product {i % 3}",
+                effective_price=Decimal(10 + i % 4), sales_count=i % 5,
+            )
+
+    def walk(self, ordering, per_page):
+        """Every page of the catalog in `ordering`, following the cursors"""
+        pages = [keyset_page(Product.objects.all(), ordering, per_page=per_page)]
+        while pages[-1].has_next:
+            pages.append(keyset_page(Product.objects.all(), ordering, pages[-1].next_cursor, per_page=per_page))
+        return pages
+
+    def test_every_sort_pages_through_ties_in_order(self):
+        for sort, ordering in SORTS.items():
+            with self.subTest(sort=sort):
+                pages = self.walk(ordering, per_page=3)
+                self.assertEqual(
+                    [product.pk for page in pages for product in page],
+                    list(Product.objects.order_by(*ordering).values_list('pk', flat=True)),
+                )
+                self.assertEqual([len(page) for page in pages], [3] * 6 + [2])
+                self.assertEqual((pages[0].total, pages[0].total_is_approximate), (20, False))
+                self.assertIsNone(pages[1].total)
+
+    def test_bad_cursors_fall_back_to_the_first_page(self):
+        ordering = SORTS['newest']
+        first = [product.pk for product in keyset_page(Product.objects.all(), ordering, per_page=3)]
+        bad_cursors = [
+            "not a cursor!",
+            encode_cursor(["yesterday", 5]),  # not a datetime
+            encode_cursor([timezone.now()]),  # one value for two sort keys
+            encode_cursor([timezone.now(), 5])[:-4],  # truncated
+            "eyJpZCI6IDV9",  # {"id": 5}
+        ]
+        for cursor in bad_cursors:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor, Product, ['created_at', 'id']))
+                page = keyset_page(Product.objects.all(), ordering, cursor, per_page=3)
+                self.assertEqual([product.pk for product in page], first)
+                self.assertEqual(page.total, 20)
+
+    def test_ranked_id_lists_page_by_position(self):
+        ids = list(range(100, 125))
+        seen, cursor, totals = [], None, []
+        while True:
+            page = id_list_page(ids, list, cursor, per_page=10)
+            seen += page.object_list
+            totals.append(page.total)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, ids)
+        self.assertEqual(totals, [25, None, None])
+        for cursor in (encode_cursor([-5]), encode_cursor(["x"]), "garbage!"):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(id_list_page(ids, list, cursor, per_page=10).object_list, ids[:10])
+        self.assertEqual(id_list_page(ids, list, encode_cursor([40]), per_page=10).object_list, [])
+        self.assertTrue(id_list_page(ids, list, per_page=10, cap=25).total_is_approximate)
+        self.assertFalse(id_list_page(ids, list, per_page=10, cap=1000).total_is_approximate)
+
+
+class SlugTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Clothes")
+
+    def setUp(self):
+        self.skus = count()
+
+    def product(self, name, slug=''):
+        return Product(category=self.category, name=name, slug=slug, description="", price=10,
+                       brand_name="A", sku=f"SKU-{next(self.skus)}", stock=1)
+
+    def create(self, name, slug=''):
+        product = self.product(name, slug)
+        product.save()
+        return product.slug
+
+    def test_names_sharing_a_prefix(self):
+        self.assertEqual(self.create("Shirt"), "shirt")
+        self.assertEqual(self.create("Shirt", slug="shirt-2"), "shirt-2")
+        self.assertEqual(self.create("Shirts"), "shirts")
+        self.assertEqual(self.create("Shirt"), "shirt-1")
+        self.assertEqual(self.create("Shirt"), "shirt-3")
+        self.assertEqual(self.create("Shirts"), "shirts-1")
+        self.assertEqual(unique_slug(Product, "Shirt!"), "shirt-4")
+        self.assertEqual(unique_slug(Product, "Shirt", exclude_pk=Product.objects.get(slug="shirt-3").pk), "shirt-3")
+
+    def test_batch_allocation(self):
+        self.create("Hat")
+        products = [self.product("Hat"), self.product("Hat", slug="hat-1"), self.product("Hat"), self.product("Cap")]
+        with self.assertNumQueries(1):
+            assign_unique_slugs(products)
+        self.assertEqual([p.slug for p in products], ["hat-2", "hat-1", "hat-3", "cap"])
+        Product.objects.bulk_create(assign_effective_prices(products))
+        self.assertEqual(Product.objects.filter(slug__startswith="hat").count(), 4)
+
+    def test_retry_after_a_concurrent_insert(self):
+        self.create("Shirt")
+        product = self.product("Shirt")
+        # another process took "shirt" between the lookup and the INSERT
+        with mock.patch('shopapp.models.unique_slug', side_effect=["shirt", "shirt-1"]) as pick:
+            product.save()
+        self.assertEqual((product.slug, pick.call_count), ("shirt-1", 2))
+
+        product = self.product("Shirt")
+        with mock.patch('shopapp.models.unique_slug', return_value="shirt"):
+            with self.assertRaises(IntegrityError):
+                product.save()
+        self.assertEqual((product.slug, product.pk), ("", None))
+
+
+class ImportCatalogTests(TestCase):
+    HEADER = "sku,name,category,price,stock,tags,description\n"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cameras = Category.objects.create(name="Cameras", discount_percentage=10)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def run_import(self, rows, *args):
+        path = os.path.join(self.tmp.name, "catalog.csv")
+        with open(path, "w") as f:
+            f.write(self.HEADER + "".join(rows))
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_create_then_update_by_sku(self):
+        self.run_import(["cam-1,Zoom Camera,Cameras,100,3,tech,Sharp\n", "cam-2,Zoom Camera,cameras,50,1,,\n"])
+        camera = Product.objects.get(sku="cam-1")
+        self.assertEqual((camera.slug, camera.category, camera.effective_price), ("zoom-camera", self.cameras, 90))
+        self.assertEqual(Product.objects.get(sku="cam-2").slug, "zoom-camera-1")
+        self.assertEqual(Category.objects.count(), 1)
+
+        out, _ = self.run_import(["cam-1,Zoom Camera,Lenses,200,3,portrait,Sharp\n"])
+        self.assertIn("0 created, 1 updated", out)
+        camera.refresh_from_db()
+        self.assertEqual((camera.price, camera.effective_price, camera.category.name), (200, 200, "Lenses"))
+        self.assertEqual(list(camera.attributes.values_list('value', flat=True)), ["portrait"])
+        self.assertEqual(search.search_product_ids("portrait"), [camera.pk])
+        self.assertEqual(search.search_product_ids("tech"), [])
+
+        out, _ = self.run_import(["cam-1,Renamed,Cameras,1,1,,\n"], "--no-update")
+        self.assertIn("1 skipped", out)
+        self.assertEqual(Product.objects.get(sku="cam-1").name, "Zoom Camera")
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        out, err = self.run_import([
+            "ok-1,Tripod,Cameras,20,1,,\n",
+            ",No sku,Cameras,20,1,,\n",
+            "bad-1,Free,Cameras,NaN,1,,\n",
+            "bad-2,Endless,Cameras,Infinity,1,,\n",
+            "bad-3,Refund,Cameras,-5,1,,\n",
+            "bad-4,Cheap,Cameras,abc,1,,\n",
+            "bad-5,Stocky,Cameras,5,many,,\n",
+            "ok-2,Strap,Cameras,0,1,,\n",
+        ], "--batch-size", "3")
+        self.assertIn("2 created, 0 updated, 0 skipped, 6 errors", out)
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ["ok-1", "ok-2"])
+        for line, message in ((2, "missing sku"), (3, "invalid price 'NaN'"), (5, "invalid price '-5'"),
+                              (7, "invalid stock 'many'")):
+            self.assertIn(f"row {line}: {message}", err)
+
+
+class ImageDerivativeTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, MEDIA_URL='/media/'))
+        self.enterContext(mock.patch('shopapp.images.WIDTHS', (300, 600)))
+        self.media = media.name
+
+    def upload(self, name, width):
+        from PIL import Image
+
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', (width, width // 2), 'red').save(path)
+        return SimpleNamespace(name=name, url=f"/media/{name}")
+
+    def test_no_upscaled_widths(self):
+        small = self.upload("product_images/small.png", 400)
+        self.assertEqual(images.generated_widths(small.name), [])
+        self.assertNotIn("<picture>", image_tags.responsive_img(small))
+
+        self.assertEqual(images.generate(small.name), 2)  # 300w in JPEG and WebP
+        self.assertEqual(images.generated_widths(small.name), [300])
+        tag = image_tags.responsive_img(small, alt="Small")
+        self.assertIn("small_300w.webp 300w", tag)
+        self.assertNotIn("600w", tag)
+
+        tiny = self.upload("product_images/tiny.png", 100)
+        images.generate(tiny.name)
+        self.assertEqual(images.generated_widths(tiny.name), [300])
+
+        large = self.upload("product_images/large.png", 1000)
+        self.assertEqual(images.generate(large.name), 4)
+        self.assertIn("large_600w.jpg 600w", image_tags.responsive_img(large))
+
+    def test_webp_source_lists_only_existing_files(self):
+        large = self.upload("product_images/large.png", 1000)
+        images.generate(large.name)
+        os.remove(os.path.join(self.media, images.derivative_name(large.name, 600, 'webp')))
+        self.assertEqual(images.generated_widths(large.name, 'webp'), [300])
+        tag = image_tags.responsive_img(large)
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/product_images/large_300w.webp 300w"', tag)
+        self.assertNotIn("large_600w.webp", tag)
+        self.assertIn("large_600w.jpg 600w", tag)
+
+        os.remove(os.path.join(self.media, images.derivative_name(large.name, 300, 'webp')))
+        tag = image_tags.responsive_img(large)
+        self.assertNotIn("<source", tag)
+        self.assertIn("<picture><img", tag)
+
+    def test_backfill_uses_spawned_workers(self):
+        large = self.upload("product_images/large.png", 800)
+        self.assertEqual(dict(images.generate_many([large.name, "missing.png"], workers=1)),
+                         {large.name: 4, "missing.png": 0})
+        self.assertEqual(images._new_pool(1)._mp_context.get_start_method(), 'spawn')
+
+    def test_failed_render_is_logged(self):
+        future = Future()
+        future.add_done_callback(images._rendered("broken.png"))
+        with self.assertLogs('shopapp.images', 'ERROR') as logs:
+            future.set_exception(OSError("truncated file"))
+        self.assertIn("broken.png", logs.output[0])
+
+    def test_written_derivatives_invalidate_cached_pages(self):
+        version = catalog_version()
+        for written, expected in ((0, version), (2, version + 1)):
+            future = Future()
+            future.add_done_callback(images._rendered("photo.png"))
+            future.set_result(written)
+            self.assertEqual(catalog_version(), expected)
+
+        large = self.upload("product_images/large.png", 800)
+        with mock.patch('shopapp.images.ASYNC', False), \
+                mock.patch('shopapp.images.transaction.on_commit', lambda submit: submit()):
+            images.schedule([large.name])
+        self.assertEqual(catalog_version(), version + 2)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="buyer", password="x")
+        category = Category.objects.create(name="Cameras", discount_percentage=10)
+        cls.camera, cls.lens = [
+            Product.objects.create(category=category, name=name, description="", price=100,
+                                   brand_name="Sony", sku=name, stock=stock)
+            for name, stock in (("Camera", 5), ("Lens", 1))
+        ]
+
+    def test_place_order(self):
+        order = place_order(self.user, {self.camera.pk: 2, self.lens.pk: 1})
+        self.assertEqual(order.total_price, 270)
+        self.assertEqual(
+            sorted(order.orderitem_set.values_list('product_id', 'quantity', 'price')),
+            [(self.camera.pk, 2, 90), (self.lens.pk, 1, 90)],
+        )
+        self.camera.refresh_from_db()
+        self.assertEqual((self.camera.stock, self.camera.sales_count), (3, 2))
+
+    def test_short_stock_rejects_the_whole_order(self):
+        with self.assertRaises(CheckoutError) as raised:
+            place_order(self.user, [(self.camera.pk, 1), (self.lens.pk, 2)])
+        self.assertEqual(raised.exception.rejected, {self.lens.pk: 2})
+        self.assertFalse(Order.objects.exists())
+        self.camera.refresh_from_db()
+        self.assertEqual((self.camera.stock, self.camera.sales_count), (5, 0))
+
+    def test_allow_partial(self):
+        order = place_order(self.user, {self.camera.pk: 1, self.lens.pk: 2}, allow_partial=True)
+        self.assertEqual(order.rejected, {self.lens.pk: 2})
+        self.assertEqual(list(order.orderitem_set.values_list('product_id', flat=True)), [self.camera.pk])
+
+
+class CartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="shopper", email="shopper@example.com", password="x")
+        sale = Category.objects.create(name="Sale", discount_percentage=20)
+        full_price = Category.objects.create(name="Full price")
+        cls.shirt = Product.objects.create(category=sale, name="Shirt", description="", price=50,
+                                           brand_name="A", sku="shirt", stock=10, image1="a.jpg", image2="b.jpg")
+        cls.hat = Product.objects.create(category=full_price, name="Hat", description="", price=20,
+                                         brand_name="B", sku="hat", stock=10, image1="a.jpg", image2="b.jpg")
+
+    def add(self, product, quantity=1):
+        return self.client.post(reverse('cart-add', args=[product.pk]), {'quantity': quantity}, HTTP_HX_REQUEST='true')
+
+    def assertTotalsConsistent(self, cart):
+        stored = (cart.item_count, cart.subtotal, cart.discount_total)
+        shopping_cart.recalculate(cart)
+        self.assertEqual(stored, (cart.item_count, cart.subtotal, cart.discount_total))
+
+    def test_running_totals(self):
+        self.add(self.shirt, 2)
+        response = self.add(self.hat)
+        self.assertContains(response, 'id="cart-count" hx-swap-oob="true">3<')
+        cart = Cart.objects.get()
+        self.assertEqual((cart.item_count, cart.subtotal, cart.discount_total, cart.total), (3, 120, 20, 100))
+        self.client.post(reverse('cart-update', args=[self.shirt.pk]), {'quantity': 1}, HTTP_HX_REQUEST='true')
+        response = self.client.post(reverse('cart-update', args=[self.hat.pk]), {'remove': '1'}, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'shopapp/includes/_cart_contents.html')
+        cart.refresh_from_db()
+        self.assertEqual((cart.item_count, cart.total), (1, 40))
+        self.assertTotalsConsistent(cart)
+
+    def test_cart_renders_with_one_query(self):
+        self.add(self.shirt)
+        self.add(self.hat)
+        # the session read, then the lines with products and totals
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('cart'))
+        self.assertEqual(len(response.context['lines']), 2)
+        self.assertContains(response, "$60.00")
+
+    def test_session_cart_merged_on_login(self):
+        Cart.objects.create(user=self.user)
+        shopping_cart.set_quantity(self.user.cart, self.hat, 1)
+        self.add(self.shirt)
+        self.add(self.hat, 2)
+        self.client.post(reverse('login'), {'email': self.user.email, 'password': 'x'})
+        cart = Cart.objects.get()
+        self.assertEqual(cart.user, self.user)
+        self.assertEqual(dict(cart.items.values_list('product_id', 'quantity')), {self.shirt.pk: 1, self.hat.pk: 3})
+        self.assertTotalsConsistent(cart)
+        self.assertEqual(self.client.session[shopping_cart.COUNT_SESSION_KEY], 4)
+
+    def test_checkout(self):
+        self.client.force_login(self.user)
+        self.add(self.shirt, 2)
+        self.assertRedirects(self.client.post(reverse('checkout')), reverse('user-dashboard') + '#orders',
+                             fetch_redirect_response=False)
+        order = self.user.orders.get()
+        self.assertEqual(order.total_price, 80)
+        self.assertEqual(self.user.cart.items.count(), 0)
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 8)
+
+
+class EffectivePriceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cameras = Category.objects.create(name="Cameras", discount_percentage=10)
+        cls.lenses = Category.objects.create(name="Lenses")
+        cls.camera = Product.objects.create(category=cls.cameras, name="Camera", description="", price=100,
+                                            brand_name="A", sku="camera", stock=5, image1="a.jpg", image2="b.jpg")
+        cls.big_camera = Product.objects.create(category=cls.cameras, name="Big camera", description="", price="120.55",
+                                                brand_name="A", sku="big", stock=5, image1="a.jpg", image2="b.jpg")
+        cls.lens = Product.objects.create(category=cls.lenses, name="Lens", description="", price=95,
+                                          brand_name="B", sku="lens", stock=5, image1="a.jpg", image2="b.jpg")
+
+    def effective_prices(self):
+        return dict(Product.objects.values_list('sku', 'effective_price'))
+
+    def test_price_sort_and_filter_use_the_discounted_price(self):
+        self.assertEqual(self.effective_prices(), {'camera': 90, 'big': Decimal('108.50'), 'lens': 95})
+        response = self.client.get(reverse('shop'), {'sort': 'price_low', 'price': '50-100'})
+        self.assertEqual([p.sku for p in response.context['products']], ['camera', 'lens'])
+        self.assertEqual(list(self.camera.get_upsell_products()), [self.big_camera])
+
+    def test_listings_show_the_discounted_price(self):
+        shop = self.client.get(reverse('shop'))
+        search = self.client.get(reverse('search'), {'search_text': 'camera'})
+        for response in (shop, search):
+            self.assertContains(response, '<span class="new__price">रु90.00</span>', html=True)
+            self.assertContains(response, '<span class="old__price">रु100.00</span>', html=True)
+        # no discount on lenses: no struck-through price
+        self.assertContains(shop, '<span class="new__price">रु95.00</span>', html=True)
+        self.assertContains(shop, 'class="old__price"', count=2)
+
+    def test_discount_change_reprices_with_one_update(self):
+        self.cameras.discount_percentage = 50
+        with CaptureQueriesContext(connection) as queries:
+            self.cameras.save()
+        product_updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "shopapp_product"')]
+        self.assertEqual(len(product_updates), 1)
+        self.assertEqual(self.effective_prices(), {'camera': 50, 'big': Decimal('60.28'), 'lens': 95})
+        self.camera.refresh_from_db()
+        self.camera.price = 80
+        self.camera.save(update_fields=['price'])
+        self.assertEqual(self.effective_prices()['camera'], 40)
+
+    def test_scheduled_promotion(self):
+        start = timezone.now() + timedelta(days=1)
+        Promotion.objects.create(name="Lens week", category=self.lenses, discount_percentage=20,
+                                 starts_at=start, ends_at=start + timedelta(days=7))
+        self.assertEqual(self.effective_prices()['lens'], 95)  # not started yet
+
+        call_command('apply_promotions', at=(start + timedelta(hours=1)).isoformat(), stdout=StringIO())
+        self.assertEqual(self.effective_prices()['lens'], 76)
+        self.assertEqual(Category.objects.get(pk=self.lenses.pk).active_discount_percentage, 20)
+        self.assertContains(self.client.get(reverse('product-detail', args=[self.lens.slug])), "20.00% Off")
+
+        call_command('apply_promotions', at=(start + timedelta(days=8)).isoformat(), stdout=StringIO())
+        self.assertEqual(self.effective_prices()['lens'], 95)
+
+
+class LikeCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog(categories=1, products_per_category=3, users=3)
+        Product.likes.through.objects.all().delete()
+        Product.refresh_like_counts()
+
+    def like_counts(self):
+        return list(Product.objects.filter(pk__in=[p.pk for p in self.products]).order_by('pk')
+                    .values_list('like_count', flat=True))
+
+    def test_product_side(self):
+        first, second, _ = self.products
+        first.likes.add(*self.users)
+        second.likes.add(self.users[0])
+        self.assertEqual(self.like_counts(), [3, 1, 0])
+        first.likes.remove(self.users[1])
+        self.assertEqual(self.like_counts(), [2, 1, 0])
+        first.likes.clear()
+        self.assertEqual(self.like_counts(), [0, 1, 0])
+
+    def test_user_side(self):
+        user = self.users[0]
+        user.liked_products.add(*self.products)
+        self.users[1].liked_products.add(self.products[0])
+        self.assertEqual(self.like_counts(), [2, 1, 1])
+        user.liked_products.remove(self.products[1])
+        self.assertEqual(self.like_counts(), [2, 0, 1])
+        user.liked_products.clear()
+        self.assertEqual(self.like_counts(), [1, 0, 0])
+
+    def test_reconcile_repairs_drift(self):
+        self.products[0].likes.add(*self.users)
+        # bulk writes skip the signals
+        Product.objects.filter(pk=self.products[0].pk).update(like_count=7)
+        Product.likes.through.objects.create(product=self.products[1], user=self.users[0])
+        out = StringIO()
+        call_command('reconcile_like_counts', '--dry-run', stdout=out)
+        self.assertIn("Found 2 drifted", out.getvalue())
+        self.assertEqual(self.like_counts(), [7, 0, 0])
+        call_command('reconcile_like_counts', stdout=StringIO())
+        self.assertEqual(self.like_counts(), [3, 1, 0])
+
+
+class ReviewAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog(categories=1, products_per_category=2)
+
+    def assertAggregatesMatchReviews(self, product):
+        product.refresh_from_db()
+        stored = [getattr(product, field) for field in Product.RATING_FIELDS]
+        Product.refresh_rating_aggregates([product.pk])
+        product.refresh_from_db()
+        self.assertEqual(stored, [getattr(product, field) for field in Product.RATING_FIELDS])
+
+    def test_aggregates_follow_reviews(self):
+        first, second = self.products
+        review = Review.objects.create(product=first, user=self.users[0], rating=4)
+        Review.objects.create(product=first, user=self.users[1], rating=None, review_text="no stars")
+        first.refresh_from_db()
+        self.assertEqual((first.review_count, first.rating_count, first.rating_4_count), (3, 2, 1))
+
+        review.rating = 2
+        review.save()
+        self.assertAggregatesMatchReviews(first)
+        review.product = second
+        review.save()
+        self.assertAggregatesMatchReviews(first)
+        self.assertAggregatesMatchReviews(second)
+        review.delete()
+        self.assertAggregatesMatchReviews(second)
+        Review.objects.filter(product=first).delete()
+        first.refresh_from_db()
+        self.assertEqual((first.review_count, first.rating_count, first.rating_sum), (0, 0, 0))
+
+    def test_average_and_histogram(self):
+        product = self.products[0]
+        Review.objects.filter(product=product).delete()
+        for rating in (5, 5, 4, 1):
+            Review.objects.create(product=product, user=self.users[0], rating=rating)
+        product.refresh_from_db()
+        self.assertEqual(product.average_rating, 3.8)
+        self.assertEqual(product.rating_histogram()[0], (5, 2, 50))
+
+    def test_repair_command(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(review_count=99, rating_sum=0)
+        call_command('reconcile_review_aggregates', stdout=StringIO())
+        self.assertAggregatesMatchReviews(product)
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog(categories=2, products_per_category=4, users=3)
+        Product.objects.update(stock=100)
+
+    def order(self, *products):
+        return place_order(self.users[0], {product.pk: 1 for product in products})
+
+    def test_bought_together(self):
+        camera, lens, bag, tripod = self.products[:4]
+        other = self.products[4]
+        self.order(camera, lens)
+        self.order(camera, lens, bag)
+        self.order(camera, other)
+        recommendations.refresh(full=True, like_weight=0)
+
+        camera.refresh_from_db()
+        self.assertEqual(camera.neighbor_count, 3)
+        self.assertEqual([p.pk for p in camera.get_cross_sell_products()], [lens.pk, bag.pk, other.pk])
+        self.assertNotIn(camera.pk, ProductNeighbor.objects.filter(product=camera).values_list('neighbor_id', flat=True))
+        tripod.refresh_from_db()
+        self.assertEqual(tripod.neighbor_count, 0)
+        # cold start: best sellers of the category
+        fallback = tripod.get_cross_sell_products()
+        self.assertTrue(fallback)
+        self.assertEqual({p.category_id for p in fallback}, {tripod.category_id})
+
+    def test_upsell_tops_up_from_the_category(self):
+        camera, lens, bag, tripod = self.products[:4]  # priced 10, 11, 12 and 13
+        self.order(bag, camera)
+        self.order(bag, lens)
+        recommendations.refresh(full=True, like_weight=0)
+        bag.refresh_from_db()
+        self.assertEqual(bag.neighbor_count, 2)
+        self.assertEqual(bag.get_upsell_products(), [tripod])  # both neighbours are cheaper
+
+        Product.objects.filter(pk=camera.pk).update(price=50, effective_price=50)
+        self.assertEqual(bag.get_upsell_products(), [camera, tripod])  # neighbours first
+        with self.assertNumQueries(1):
+            self.assertEqual(tripod.get_upsell_products(), [camera])  # no neighbours
+
+    def test_incremental_refresh(self):
+        camera, lens, bag = self.products[:3]
+        self.order(camera, lens)
+        recommendations.refresh(full=True, like_weight=0)
+        camera_neighbors = list(ProductNeighbor.objects.filter(product=camera).values_list('neighbor_id', 'score'))
+
+        self.order(lens, bag)
+        run = recommendations.refresh(like_weight=0)
+        self.assertFalse(run.full)
+        self.assertEqual(run.products_updated, 2)
+        self.assertEqual(list(bag.neighbors.values_list('neighbor_id', flat=True)), [lens.pk])
+        self.assertEqual(list(lens.neighbors.values_list('neighbor_id', flat=True)), [camera.pk, bag.pk])
+        # products without new orders keep their rows until the next full refresh
+        self.assertEqual(list(ProductNeighbor.objects.filter(product=camera).values_list('neighbor_id', 'score')),
+                         camera_neighbors)
+        self.assertEqual(recommendations.refresh().products_updated, 0)
+
+
+class ReadOnlyRoutingTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(connections.settings, {db.READ_ALIAS: {**connections.settings['default']}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = db.ReadOnlyRequestRouter()
+
+    def route(self, method):
+        def view(request):
+            return self.router.db_for_read(Product), self.router.db_for_write(Product)
+        return db.ReadOnlyRequestMiddleware(view)(SimpleNamespace(method=method))
+
+    def test_safe_requests_read_from_the_read_alias(self):
+        self.assertEqual(self.route('GET'), (db.READ_ALIAS, 'default'))
+        self.assertEqual(self.route('POST'), (None, 'default'))
+        self.assertIsNone(self.router.db_for_read(Product))  # outside a request
+
+    def test_reads_inside_a_transaction_stay_on_default(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block', True):
+            self.assertEqual(self.route('GET'), (None, 'default'))
+
+    async def test_async_requests(self):
+        async def view(request):
+            return self.router.db_for_read(Product)
+        middleware = db.ReadOnlyRequestMiddleware(view)
+        self.assertEqual(await middleware(SimpleNamespace(method='HEAD')), db.READ_ALIAS)
+        self.assertIsNone(await middleware(SimpleNamespace(method='DELETE')))
+
+    def test_journal_mode_only_when_configured(self):
+        def executed(alias):
+            connection = mock.MagicMock(alias=alias)
+            db.apply_sqlite_pragmas(connection)
+            cursor = connection.cursor.return_value.__enter__.return_value
+            return [call.args[0] for call in cursor.execute.call_args_list]
+
+        with override_settings(SQLITE_PRAGMAS={'synchronous': 'NORMAL'}, SQLITE_JOURNAL_MODE=None):
+            self.assertEqual(executed('default'), ["PRAGMA synchronous = NORMAL"])
+        with override_settings(SQLITE_PRAGMAS={}, SQLITE_JOURNAL_MODE='WAL'):
+            self.assertEqual(executed('default'), ["PRAGMA journal_mode = WAL"])
+            self.assertEqual(executed(db.READ_ALIAS), ["PRAGMA query_only = ON"])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cameras = Category.objects.create(name="Cameras")
+        cls.lenses = Category.objects.create(name="Lenses")
+        cls.nikon = cls.create("Nikon Z6", cls.cameras, brand_name="Nikon", description="Full frame mirrorless")
+        cls.canon = cls.create("Canon R6", cls.cameras, brand_name="Canon", description="Pairs well with a nikon adapter")
+        cls.lens = cls.create("Prime 50mm", cls.lenses, brand_name="Sigma", description='The "nifty fifty"', tags="prime,portrait")
+
+    @classmethod
+    def create(cls, name, category, **fields):
+        return Product.objects.create(category=category, name=name, price=100, sku=name, stock=1,
+                                      image1="a.jpg", image2="b.jpg", **fields)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.nikon.name = "Nikon Zf"
+        self.nikon.save()
+        self.assertEqual(search.search_product_ids("zf"), [self.nikon.pk])
+        self.assertEqual(search.search_product_ids("z6"), [])
+        self.cameras.name = "Mirrorless"
+        self.cameras.save()
+        self.assertCountEqual(search.search_product_ids("mirrorless"), [self.nikon.pk, self.canon.pk])
+        self.nikon.delete()
+        self.assertEqual(search.search_product_ids("zf"), [])
+
+    def test_prefix_and_quoted_terms(self):
+        self.assertEqual(search.search_product_ids("portr"), [self.lens.pk])
+        self.assertEqual(search.search_product_ids('"nifty'), [self.lens.pk])
+        # FTS syntax in the input is searched for, never parsed
+        self.assertEqual(search.search_product_ids('prime AND NOT ("'), [self.lens.pk])
+        self.assertEqual(search.search_product_ids("  "), [])
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(search.search_product_ids("nikon"), [self.nikon.pk, self.canon.pk])
+        self.assertEqual(search.search_product_ids("nikon", limit=1), [self.nikon.pk])
+
+    def test_filters_narrow_the_ranked_results_in_sql(self):
+        with mock.patch('shopapp.search.MAX_RESULTS', 1):
+            self.assertEqual(search.cached_product_ids("nikon", {'brand': ['Canon']}), [self.canon.pk])
+            self.assertEqual(search.cached_product_ids("nikon"), [self.nikon.pk])
+
+    def test_rebuild_replaces_the_index_atomically(self):
+        with mock.patch('shopapp.search._index_batch', side_effect=DatabaseError("disk I/O error")):
+            with self.assertRaises(DatabaseError):
+                search.rebuild_index()
+        self.assertEqual(search.search_product_ids("sigma"), [self.lens.pk])  # the old index is kept
+        self.assertEqual(search.rebuild_index(batch_size=2), 3)
+        self.assertEqual(search.search_product_ids("nikon"), [self.nikon.pk, self.canon.pk])
+
+    def test_migration_indexes_in_batches(self):
+        if not search.is_available():
+            self.skipTest("SQLite FTS5 is not available")
+        from django.apps import apps
+        migration = import_module('shopapp.migrations.0004_product_search_index')
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.FTS_TABLE}")
+        schema_editor = SimpleNamespace(connection=connection, execute=lambda sql: connection.cursor().execute(sql))
+        with mock.patch.object(migration, 'BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            migration.create_search_index(apps, schema_editor)
+        inserts = [query['sql'].split(':')[0] for query in queries if 'INSERT INTO' in query['sql']]
+        self.assertEqual(inserts, ["2 times", "1 times"])  # executemany per batch
+        self.assertEqual(search.search_product_ids("portrait"), [self.lens.pk])
+
+    def test_fallback_without_fts(self):
+        with mock.patch('shopapp.search.is_available', return_value=False):
+            self.assertCountEqual(search.search_product_ids("nikon"), [self.nikon.pk, self.canon.pk])
+            within = Product.objects.filter(category=self.cameras, brand_name="Nikon")
+            self.assertEqual(search.search_product_ids("nikon", within=within), [self.nikon.pk])
+            self.assertEqual(list(Product.objects.filter(search.match_q("sigma"))), [self.lens])
+
+
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.products = create_catalog(categories=1, products_per_category=4, users=1)
+
+    def setUp(self):
+        viewcounter._drain()  # views left pending by other tests' page loads, which refresh_trending flushes
+        self.now = timezone.now()
+        self.hour = trending.hour_index(self.now)
+
+    def add_views(self, views_by_age):
+        """{(product index, hours ago): views}"""
+        trending.add_bucket_views({
+            (self.products[index].pk, self.hour - age): views for (index, age), views in views_by_age.items()
+        })
+
+    def test_buckets_are_upserted(self):
+        self.add_views({(0, 0): 2})
+        self.add_views({(0, 0): 3, (1, 0): 1})
+        self.assertEqual(
+            dict(ProductViewBucket.objects.values_list('product_id', 'views')),
+            {self.products[0].pk: 5, self.products[1].pk: 1},
+        )
+
+    def test_recent_views_outweigh_older_ones(self):
+        with mock.patch('shopapp.trending.HALF_LIFE_HOURS', 24):
+            self.add_views({
+                (0, 48): 8,  # two half-lives old: scores 2
+                (1, 0): 3,
+                (2, 1): 1, (2, 25): 2,  # 0.5 ** (1 / 24) + 1
+                (3, 7 * 24): 100,  # outside the 7 day window
+            })
+            scored = trending.score_window(7, 10, now=self.now)
+        self.assertEqual([pk for pk, _, _ in scored], [self.products[i].pk for i in (1, 0, 2)])
+        scores = {pk: (round(score, 3), views) for pk, score, views in scored}
+        self.assertEqual(scores[self.products[0].pk], (2.0, 8))
+        self.assertEqual(scores[self.products[2].pk], (round(0.5 ** (1 / 24) + 2 * 0.5 ** (25 / 24), 3), 3))
+        self.assertEqual(len(trending.score_window(7, 1, now=self.now)), 1)
+
+    def test_refresh_trending_rewrites_the_rankings(self):
+        TrendingProduct.objects.create(window_days=7, rank=1, product=self.products[3], score=9.0,
+                                       window_views=9, refreshed_at=self.now)
+        self.add_views({(0, 1): 1, (1, 1): 5, (3, 40 * 24): 50})
+        call_command('refresh_trending', '--days', '7', stdout=StringIO())
+        self.assertEqual(
+            list(TrendingProduct.objects.filter(window_days=7).values_list('rank', 'product_id', 'window_views')),
+            [(1, self.products[1].pk, 5), (2, self.products[0].pk, 1)],
+        )
+        self.assertEqual(Product.get_trending_products(days=7), [self.products[1], self.products[0]])
+        self.assertFalse(ProductViewBucket.objects.filter(product=self.products[3]).exists())  # pruned
+
+    def test_stale_rankings_are_scored_live(self):
+        self.add_views({(0, 1): 1, (1, 1): 5})
+        TrendingProduct.objects.create(window_days=7, rank=1, product=self.products[2], score=9.0,
+                                       window_views=9, refreshed_at=self.now - timedelta(minutes=30))
+        self.assertEqual(trending.get_trending(7, now=self.now), [self.products[2]])
+        with mock.patch('shopapp.trending.MAX_AGE', timedelta(minutes=10)):
+            self.assertEqual(trending.get_trending(7, now=self.now), [self.products[1], self.products[0]])
+
+    def test_buckets_of_longer_windows_are_kept(self):
+        self.add_views({(0, 40 * 24): 1, (1, 70 * 24): 1})
+        call_command('refresh_trending', '--days', '60', stdout=StringIO())
+        self.assertEqual(list(ProductViewBucket.objects.values_list('product_id', flat=True)), [self.products[0].pk])
+        self.assertEqual(trending.prune_buckets(), 0)  # a later default run keeps them too
+
+
+class ViewCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Cameras")
+        cls.camera, cls.lens = [
+            Product.objects.create(category=category, name=name, description="", price=10, brand_name="A",
+                                   sku=name, stock=1, image1="a.jpg", image2="b.jpg", views_count=5)
+            for name in ("camera", "lens")
+        ]
+
+    def setUp(self):
+        viewcounter._drain()
+        patcher = mock.patch('shopapp.viewcounter._ensure_flusher')  # flushed by the test, not the thread
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(viewcounter._drain)
+        self.now = timezone.now().replace(minute=30)  # the views a minute apart share an hour bucket
+
+    def record(self):
+        viewcounter.record_view(self.camera.pk, self.now - timedelta(minutes=1))
+        viewcounter.record_view(self.camera.pk, self.now)
+        viewcounter.record_view(self.lens.pk, self.now)
+
+    def test_views_are_aggregated_in_memory(self):
+        with self.assertNumQueries(0):
+            self.record()
+        self.assertEqual(viewcounter.pending_views(self.camera.pk), 2)
+        self.assertEqual(viewcounter.pending_views(), 3)
+
+    def test_flush_adds_the_pending_views(self):
+        self.record()
+        self.assertEqual(viewcounter.flush(), 3)
+        self.assertEqual(viewcounter.pending_views(), 0)
+        self.camera.refresh_from_db()
+        self.assertEqual((self.camera.views_count, self.camera.last_viewed), (7, self.now))
+        self.assertEqual(Product.objects.get(pk=self.lens.pk).views_count, 6)
+        self.assertEqual(
+            dict(ProductViewBucket.objects.values_list('product_id', 'views')), {self.camera.pk: 2, self.lens.pk: 1}
+        )
+        self.assertEqual(viewcounter.flush(), 0)
+
+    def test_failed_flush_keeps_the_views(self):
+        self.record()
+        with mock.patch('shopapp.viewcounter._write', side_effect=DatabaseError("locked")):
+            with self.assertRaises(DatabaseError):
+                viewcounter.flush()
+        self.assertEqual(viewcounter.pending_views(self.camera.pk), 2)
+        viewcounter.record_view(self.camera.pk, self.now)
+        self.assertEqual(viewcounter.flush(), 4)
+        self.assertEqual(Product.objects.get(pk=self.camera.pk).views_count, 8)
+        self.assertEqual(ProductViewBucket.objects.get(product=self.camera).views, 3)
+
+    def test_failed_flush_at_exit_is_logged(self):
+        self.record()
+        with mock.patch('shopapp.viewcounter._write', side_effect=DatabaseError("database is locked")):
+            with self.assertLogs('shopapp.viewcounter', 'ERROR') as logs:
+                viewcounter._flush_on_exit()
+        self.assertIn("3 views lost", logs.output[0])
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog(categories=1, products_per_category=3, users=1)
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+
+    def test_histogram(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0, 1, 3, 9):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [(1, 2), (5, 3), (float('inf'), 4)])
+        self.assertEqual((histogram.sum, histogram.count), (13, 4))
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('product-detail', args=[self.products[0].slug]))
+        self.client.get('/no-such-page/')
+        body = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('bikrante_requests_total{view="product-detail",method="GET",status="200"} 1', body)
+        self.assertIn('bikrante_requests_total{view="unresolved",method="GET",status="404"} 1', body)
+        self.assertIn('bikrante_db_queries_count{view="product-detail"} 1', body)
+        self.assertIn('bikrante_db_queries_bucket{view="product-detail",le="0.0"} 0', body)
+        self.assertIn('bikrante_template_render_seconds_count{view="product-detail"} 1', body)
+        self.assertIn('bikrante_cache_requests_total{family="page",result="miss"}', body)
+        histograms = metrics.registry.snapshot()[0]
+        self.assertGreater(histograms[('bikrante_template_render_seconds', 'product-detail')][1], 0)
+
+    def test_metrics_endpoint_is_not_public(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 404)
+
+
+class BenchmarkTests(TestCase):
+    def test_seed_and_run(self):
+        rows = benchmark.seed_catalog(products=40, categories=3, users=5, likes_per_user=3, reviews=30, orders=10)
+        self.assertEqual(Product.objects.count(), rows['products'])
+        product = Product.objects.filter(review_count__gt=0).first()
+        self.assertEqual(product.review_count, product.reviews.count())
+
+        report = benchmark.run_benchmark(requests=3, warmup=0, memory_requests=1)
+        self.assertEqual(set(report), set(benchmark.SCENARIOS))
+        for name, result in report.items():
+            self.assertEqual(result['statuses'], [200], name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(benchmark.compare(report, report), [])
+        slower = {name: dict(result, p95_ms=result['p95_ms'] * 2, max_queries=result['max_queries'] + 1)
+                  for name, result in report.items()}
+        self.assertEqual(len(benchmark.compare(slower, report)), 2 * len(report))
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Shirts")
+        cls.small, cls.large, cls.huge = [
+            Product.objects.create(category=category, name=name, description="", price=price, brand_name=brand,
+                                   sku=name, stock=stock, colors=colors, sizes=sizes, tags="cotton")
+            for name, price, brand, stock, colors, sizes in (
+                ("Small shirt", 20, "Acme", 5, "Red, blue", "s,m"),
+                ("Large shirt", 80, "Acme", 0, "red", "L"),
+                ("Huge shirt", 120, "Other", 3, "green", "xl,xxl"),
+            )
+        ]
+
+    def test_attributes_follow_the_comma_separated_fields(self):
+        self.assertEqual(
+            sorted(self.small.attributes.filter(kind=ProductAttribute.COLOR).values_list('value', flat=True)),
+            ['blue', 'red'],
+        )
+        self.huge.sizes = "XL, l"
+        self.huge.save()
+        self.assertEqual(sorted(self.huge.attributes.filter(kind='size').values_list('value', flat=True)), ['l', 'xl'])
+
+    def test_fixture_loads_keep_their_attribute_rows(self):
+        self.huge.colors = "purple"
+        self.huge.save_base(raw=True)  # what loaddata does
+        self.assertEqual(list(self.huge.attributes.filter(kind='color').values_list('value', flat=True)), ['green'])
+
+    def test_filters(self):
+        def matching(query):
+            filters = facets.parse_filters(QueryDict(query))
+            return set(facets.apply_filters(Product.objects.all(), filters))
+
+        self.assertEqual(matching('size=l'), {self.large})  # not "xl"
+        self.assertEqual(matching('color=RED&color=green'), {self.small, self.large, self.huge})
+        self.assertEqual(matching('color=red&availability=in-stock'), {self.small})
+        self.assertEqual(matching('brand=Acme&price=50-100'), {self.large})
+
+    def test_counts_in_one_query(self):
+        filters = facets.parse_filters(QueryDict('color=red&brand=Acme'))
+        with self.assertNumQueries(1):
+            counts = facets.facet_counts(Product.objects.all(), filters)
+        as_dict = {facet: {entry['value']: entry['count'] for entry in values} for facet, values in counts.items()}
+        # a facet is counted with the other facets' filters only
+        self.assertEqual(as_dict['color'], {'red': 2, 'blue': 1})
+        self.assertEqual(as_dict['brand'], {'Acme': 2})
+        self.assertEqual(as_dict['size'], {'s': 1, 'm': 1, 'l': 1})
+        self.assertEqual(as_dict['price'], {'0-50': 1, '50-100': 1})
+        self.assertTrue(counts['color'][0]['selected'])
+
+    def test_shop_and_search(self):
+        response = self.client.get(reverse('shop') + '?size=l')
+        self.assertEqual(list(response.context['products']), [self.large])
+        self.assertContains(response, 'name="size" value="l" checked')
+        response = self.client.get(reverse('search') + '?search_text=shirt&color=red', HTTP_HX_REQUEST='true')
+        self.assertEqual({p.pk for p in response.context['products']}, {self.small.pk, self.large.pk})
+
+    def test_search_results_are_cached_per_normalized_query(self):
+        cache.clear()
+        reset_cache_stats()
+        url = reverse('search')
+        self.client.get(url, {'search_text': 'shirt Small', 'color': ['red', 'blue']})
+        with self.assertNumQueries(1):  # only the products of the page
+            response = self.client.get(url, {'search_text': 'small  SHIRT small', 'color': ['blue', 'red']})
+        self.assertEqual([p.pk for p in response.context['products']], [self.small.pk, self.large.pk])
+        stats = cache_stats()['search']
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+        self.assertGreater(stats['bytes'], 0)
+
+        self.large.colors = "green"
+        self.large.save()  # a new catalog version
+        response = self.client.get(url, {'search_text': 'shirt small', 'color': 'red'})
+        self.assertEqual([p.pk for p in response.context['products']], [self.small.pk])
+
+
+class TypeaheadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Cameras")
+        cls.alpha, cls.zoom = [
+            Product.objects.create(category=category, name=name, description="", price=100, brand_name="Sony",
+                                   sku=name, stock=1, tags="photo", sales_count=sales)
+            for name, sales in (("Sony Alpha A7", 5), ("Zoom Lens", 1))
+        ]
+
+    def setUp(self):
+        cache.clear()
+        typeahead.reset()
+        patcher = mock.patch.object(typeahead, 'BACKGROUND_REBUILD', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(typeahead.reset)
+
+    def labels(self, query):
+        suggestions = typeahead.suggest(query)
+        return [s.label for s in suggestions['products']], [(s.kind, s.label) for s in suggestions['terms']]
+
+    def test_prefix_of_any_word(self):
+        self.assertEqual(self.labels("alp"), (["Sony Alpha A7"], []))
+        self.assertEqual(self.labels("  SONY  alpha a"), (["Sony Alpha A7"], []))
+        self.assertEqual(self.labels("so"), (["Sony Alpha A7"], [('brand', "Sony")]))
+        self.assertEqual(self.labels("cam"), ([], [('category', "Cameras")]))
+        self.assertEqual(self.labels("phot"), ([], [('tag', "photo")]))
+
+    def test_local_edits_show_without_a_rebuild(self):
+        self.labels("a")  # builds the index
+        with mock.patch.object(typeahead, 'rebuild') as rebuild:
+            self.zoom.name = "Alpine Lens"
+            self.zoom.save()
+            self.assertEqual(self.labels("alp")[0], ["Sony Alpha A7", "Alpine Lens"])
+            self.alpha.delete()
+            self.assertEqual(self.labels("alp")[0], ["Alpine Lens"])
+            self.assertEqual(self.labels("zoo")[0], [])
+        rebuild.assert_not_called()
+
+    def test_endpoint_does_not_touch_the_database(self):
+        url = reverse('search-suggest')
+        self.client.get(url, {'search_text': 'a'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'search_text': 'alpha'})
+        self.assertContains(response, reverse('product-detail', args=[self.alpha.slug]))
+
+
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog(categories=1, products_per_category=3, users=1)
+
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+
+    def assertCache(self, result, **headers):
+        self.assertEqual(self.client.get(reverse('shop'), **headers)['X-Cache'], result)
+
+    def test_a_version_bump_invalidates_cached_pages(self):
+        self.assertCache('MISS')
+        self.assertCache('HIT')
+        bump_catalog_version()
+        self.assertCache('MISS')
+        self.assertCache('HIT')
+        self.products[0].save()
+        self.assertCache('MISS')
+
+    def test_htmx_and_signed_in_requests_have_their_own_keys(self):
+        self.assertCache('MISS')
+        self.assertCache('MISS', HTTP_HX_REQUEST='true')
+        self.assertCache('HIT', HTTP_HX_REQUEST='true')
+        self.assertCache('HIT')
+
+        request = RequestFactory().get(reverse('shop'))
+        request.user = AnonymousUser()
+        anonymous = page_cache_key(request)
+        request.user = self.users[0]
+        self.assertNotEqual(page_cache_key(request), anonymous)
+        self.client.force_login(self.users[0])
+        self.assertNotIn('X-Cache', self.client.get(reverse('shop')))  # never cached
+
+    def test_hits_and_misses_are_counted(self):
+        self.assertCache('MISS')
+        self.assertCache('HIT')
+        self.assertCache('HIT')
+        page = cache_stats()['page']
+        self.assertEqual((page['hits'], page['misses'], page['hit_ratio']), (2, 1, 0.6667))
+        self.assertEqual(page['entries'], 1)
+        self.assertGreater(page['bytes'], 0)
+        reset_cache_stats()
+        self.assertEqual((cache_stats()['page']['hits'], cache_stats()['page']['misses']), (0, 0))
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog(categories=1, products_per_category=3, users=1)
+        cls.product = cls.products[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_product_page_revalidates_without_rendering(self):
+        url = reverse('product-detail', args=[self.product.slug])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        with mock.patch('shopapp.viewcounter.record_view') as record_view, self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        record_view.assert_called_once_with(self.product.pk)
+
+        # stock changes are a queryset UPDATE, without signals or a new catalog version
+        place_order(self.users[0], {self.product.pk: 1})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_orders_refresh_the_cached_product_page(self):
+        url = reverse('product-detail', args=[self.product.slug])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, "10 Items in Stock")
+
+        place_order(self.users[0], {self.product.pk: 1})
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, "9 Items in Stock")
+        etag = response['ETag']
+        response = self.client.get(url)
+        self.assertEqual((response['X-Cache'], response['ETag']), ('HIT', etag))
+        self.assertContains(response, "9 Items in Stock")
+
+    def test_listing_validators_follow_the_catalog(self):
+        url = self.product.category.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(url, HTTP_HX_REQUEST='true')['ETag'], etag)
+
+        before = Product.objects.get(pk=self.product.pk).updated_at
+        self.product.save(update_fields=['stock'])
+        self.assertGreater(Product.objects.get(pk=self.product.pk).updated_at, before)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertIn('max-age=0', self.client.get(reverse('shop'))['Cache-Control'])
+
+    def test_signed_in_pages_are_private(self):
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse('product-detail', args=[self.product.slug]))
+        self.assertNotIn('ETag', response)
+        self.assertIn('private', response['Cache-Control'])
+
+
+@override_settings(ROOT_URLCONF='Bikrante.asgi_urls')
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.products = create_catalog(categories=2, products_per_category=15, users=2)
+        cls.product = cls.products[0]
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+
+    async def test_catalog_pages_match_the_sync_views(self):
+        pages = [
+            reverse('home'),
+            reverse('search') + '?search_text=product 0-1',
+            reverse('search') + '?color=',
+            self.product.category.get_absolute_url() + '?sort=price_low',
+            reverse('product-detail', args=[self.product.slug]),
+        ]
+        for url in pages:
+            sync_response = await sync_to_async(self.client.get)(url)
+            await sync_to_async(cache.clear)()
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            for name in ('products', 'hot_products', 'cross_sell_products', 'upsell_products'):
+                if name in sync_response.context:
+                    self.assertEqual(
+                        [p.pk for p in response.context[name]], [p.pk for p in sync_response.context[name]], url
+                    )
+        response = await self.async_client.get(reverse('product-detail', args=['no-such-product']))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_caching_and_metrics_follow_async_views(self):
+        url = reverse('product-detail', args=[self.product.slug])
+        response = await self.async_client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with mock.patch('shopapp.viewcounter.record_view') as record_view:
+            self.assertEqual((await self.async_client.get(url))['X-Cache'], 'HIT')
+            response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(record_view.call_count, 2)
+
+        histograms = metrics.registry.snapshot()[0]
+        # queries of the sync_to_async threads are counted against the view
+        self.assertGreater(histograms[('bikrante_db_queries', 'product-detail')][1], 0)
@@ -0,0 +1,131 @@
+"""
+Trending products from hourly view buckets.
+
+The view counter flush adds every view to a `ProductViewBucket` row for its
+hour. A product's trending score over a window of `days` is the sum of its
+bucket views inside the window, each weighted by 0.5 ** (age / half-life),
+so a burst of recent views beats a trickle that is days old. Hours are stored
+as integers (hours since the epoch) so the decay is plain arithmetic in SQL.
+
+`manage.py refresh_trending` stores the top TRENDING_TOP_K products of every
+window in TRENDING_WINDOWS as `TrendingProduct` rows, which
+`Product.get_trending_products` reads with a single indexed query. The
+refresh only aggregates the buckets inside the window, so its cost follows
+recent traffic rather than the size of the catalog. Rankings older than
+TRENDING_MAX_AGE_MINUTES (the command stopped running) are ignored and the
+buckets are scored live instead.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Max, Sum, Value
+from django.db.models.functions import Power
+from django.utils import timezone
+
+WINDOWS = getattr(settings, 'TRENDING_WINDOWS', (7,))
+TOP_K = getattr(settings, 'TRENDING_TOP_K', 50)
+HALF_LIFE_HOURS = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24)
+RETENTION_DAYS = getattr(settings, 'TRENDING_BUCKET_RETENTION_DAYS', 30)
+MAX_AGE = timedelta(minutes=getattr(settings, 'TRENDING_MAX_AGE_MINUTES', 120))
+
+
+def hour_index(when):
+    """Hours since the Unix epoch for an aware datetime"""
+    return int(when.timestamp() // 3600)
+
+
+def add_bucket_views(hourly):
+    """
+    Add views to the hourly buckets. `hourly` maps (product_id, hour) to a view
+    count; existing buckets are incremented in place (INSERT ... ON CONFLICT).
+    """
+    from .models import ProductViewBucket
+
+    if not hourly:
+        return
+    table = connection.ops.quote_name(ProductViewBucket._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (product_id, hour, views) VALUES (%s, %s, %s) "
+            f"ON CONFLICT (product_id, hour) DO UPDATE SET views = {table}.views + excluded.views",
+            [(product_id, hour, views) for (product_id, hour), views in hourly.items()],
+        )
+
+
+def score_window(days, limit, now=None):
+    """
+    [(product_id, score, window_views)] of the best `limit` products over the
+    last `days` days, best first.
+    """
+    from .models import ProductViewBucket
+
+    now_hour = hour_index(now or timezone.now())
+    start_hour = now_hour - days * 24 + 1
+    decay = Power(
+        Value(0.5),
+        (Value(now_hour) - F('hour')) / Value(float(HALF_LIFE_HOURS)),
+        output_field=FloatField(),
+    )
+    rows = (
+        ProductViewBucket.objects.filter(hour__gte=start_hour)
+        .values('product')
+        .annotate(
+            window_views=Sum('views'),
+            score=Sum(F('views') * decay, output_field=FloatField()),
+        )
+        .order_by('-score', '-window_views', 'product')[:limit]
+    )
+    return [(row['product'], row['score'], row['window_views']) for row in rows]
+
+
+def refresh(windows=None, top_k=None, now=None):
+    """Recompute the stored top-K of every window. Returns {days: rows stored}"""
+    from .models import TrendingProduct
+
+    now = now or timezone.now()
+    top_k = top_k or TOP_K
+    stored = {}
+    for days in windows or WINDOWS:
+        scored = score_window(days, top_k, now=now)
+        with transaction.atomic():
+            TrendingProduct.objects.filter(window_days=days).delete()
+            TrendingProduct.objects.bulk_create([
+                TrendingProduct(
+                    window_days=days, rank=rank, product_id=product_id,
+                    score=score, window_views=window_views, refreshed_at=now,
+                )
+                for rank, (product_id, score, window_views) in enumerate(scored, start=1)
+            ])
+        stored[days] = len(scored)
+    return stored
+
+
+def prune_buckets(keep_days=None, now=None):
+    """Delete buckets older than every window needs, including the stored rankings' (`--days`)"""
+    from .models import ProductViewBucket, TrendingProduct
+
+    stored = TrendingProduct.objects.aggregate(days=Max('window_days'))['days'] or 0
+    keep_days = max(keep_days or RETENTION_DAYS, stored, *WINDOWS)
+    oldest = hour_index(now or timezone.now()) - keep_days * 24
+    deleted, _ = ProductViewBucket.objects.filter(hour__lt=oldest).delete()
+    return deleted
+
+
+def get_trending(days=7, limit=4, now=None):
+    """
+    Trending products for a window. Reads the precomputed ranking when the
+    command refreshed it within MAX_AGE, otherwise scores the buckets live.
+    """
+    from .models import Product
+
+    now = now or timezone.now()
+    ranked = list(Product.card_queryset().filter(
+        trending_ranks__window_days=days,
+        trending_ranks__refreshed_at__gte=now - MAX_AGE,
+    ).order_by('trending_ranks__rank')[:limit])
+    if ranked:
+        return ranked
+    product_ids = [product_id for product_id, _, _ in score_window(days, limit, now=now)]
+    by_id = Product.card_queryset().in_bulk(product_ids)
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
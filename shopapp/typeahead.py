@@ -0,0 +1,238 @@
+"""
+In-memory typeahead index for the navbar search box.
+
+Every process keeps a sorted array of the words of product names, brands,
+category names and tags (each word onward, so "alpha" finds "Sony Alpha
+A7"). A prefix lookup is two bisects in that array. The best suggestions of
+every prefix up to PREFIX_CACHE_LENGTH characters are precomputed, because
+those ranges hold most of the catalog. A keystroke never touches the
+database: `suggest` only reads the catalog version from the cache.
+
+Keeping it current:
+
+* products saved or deleted in this process go into a small overlay
+  (`product_changed` / `product_deleted`, called from the signals), so they
+  show up at once;
+* when the catalog version changes (an edit in another process, a category,
+  a bulk import) the index is rebuilt in a background thread, at most every
+  TYPEAHEAD_MIN_REBUILD_INTERVAL seconds, while the old one keeps answering.
+  The overlay is folded in the same way once it grows past OVERLAY_LIMIT.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from .cache import catalog_version
+
+LIMIT = getattr(settings, 'TYPEAHEAD_LIMIT', 8)
+MIN_REBUILD_INTERVAL = getattr(settings, 'TYPEAHEAD_MIN_REBUILD_INTERVAL', 30)
+BACKGROUND_REBUILD = getattr(settings, 'TYPEAHEAD_BACKGROUND_REBUILD', True)
+PREFIX_CACHE_LENGTH = 3
+# words of a name indexed as a starting point
+MAX_WORDS = 6
+# products changed in this process before the index is rebuilt
+OVERLAY_LIMIT = 500
+# suggestions per kind: terms are categories, brands and tags
+TERM_LIMIT = 3
+
+PRODUCT, CATEGORY, BRAND, TAG = 'product', 'category', 'brand', 'tag'
+
+
+def normalize(text):
+    return ' '.join(str(text).lower().split())
+
+
+def _phrases(text):
+    """'Sony Alpha A7' -> ['sony alpha a7', 'alpha a7', 'a7']"""
+    words = normalize(text).split()
+    return [' '.join(words[start:]) for start in range(min(len(words), MAX_WORDS))]
+
+
+class Suggestion:
+    __slots__ = ('kind', 'label', 'url', 'weight', 'key')
+
+    def __init__(self, kind, label, url, weight, key):
+        self.kind = kind
+        self.label = label
+        self.url = url
+        self.weight = weight
+        self.key = key  # (kind, id or value), identifies a product across rebuilds
+
+
+def product_suggestion(pk, name, slug, sales_count, like_count):
+    return Suggestion(
+        PRODUCT, name, reverse('product-detail', args=[slug]), sales_count * 2 + like_count + 1, (PRODUCT, pk)
+    )
+
+
+def _ranked(suggestions, limit):
+    return heapq.nlargest(limit, suggestions, key=lambda s: (s.weight, s.label))
+
+
+class Index:
+    """An immutable snapshot; replaced as a whole on rebuild"""
+
+    def __init__(self, suggestions, version):
+        self.version = version
+        self.suggestions = suggestions
+        pairs = sorted(
+            (phrase, position)
+            for position, suggestion in enumerate(suggestions)
+            for phrase in _phrases(suggestion.label)
+        )
+        self.keys = [phrase for phrase, _ in pairs]
+        self.positions = [position for _, position in pairs]
+
+        # best suggestions of the short prefixes, with room for overlay exclusions
+        buckets = {}
+        for phrase, position in pairs:
+            for length in range(1, min(PREFIX_CACHE_LENGTH, len(phrase)) + 1):
+                buckets.setdefault(phrase[:length], set()).add(position)
+        self.top = {
+            prefix: self._split(positions, LIMIT * 2)
+            for prefix, positions in buckets.items()
+        }
+
+    def _split(self, positions, limit):
+        products, terms = [], []
+        for position in positions:
+            suggestion = self.suggestions[position]
+            (products if suggestion.kind == PRODUCT else terms).append(suggestion)
+        return _ranked(products, limit), _ranked(terms, limit)
+
+    def lookup(self, prefix, limit):
+        """(products, terms) starting with `prefix`, best first"""
+        if len(prefix) <= PREFIX_CACHE_LENGTH:
+            return self.top.get(prefix, ([], []))
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\uffff', start)
+        return self._split(set(self.positions[start:end]), limit)
+
+
+_lock = threading.Lock()
+_index = None
+_overlay = {}  # product id -> Suggestion, or None once deleted
+_rebuilding = False
+_last_rebuild = 0.0
+
+
+def load_suggestions():
+    """Every suggestion of the catalog, from four queries"""
+    from .models import Category, Product, ProductAttribute
+
+    suggestions = [
+        product_suggestion(*row)
+        for row in Product.objects.values_list('pk', 'name', 'slug', 'sales_count', 'like_count').iterator()
+    ]
+    suggestions += [
+        Suggestion(CATEGORY, name, reverse('category-detail', args=[slug]), count, (CATEGORY, slug))
+        for name, slug, count in Category.objects.annotate(count=Count('products')).values_list('name', 'slug', 'count')
+    ]
+    suggestions += [
+        Suggestion(BRAND, brand, f"{reverse('search')}?{urlencode({'search_text': brand})}", count, (BRAND, brand))
+        for brand, count in Product.objects.order_by().values('brand_name').annotate(count=Count('pk'))
+        .values_list('brand_name', 'count') if brand
+    ]
+    suggestions += [
+        Suggestion(TAG, tag, f"{reverse('shop')}?{urlencode({'tag': tag})}", count, (TAG, tag))
+        for tag, count in ProductAttribute.objects.filter(kind=ProductAttribute.TAG).order_by()
+        .values('value').annotate(count=Count('product_id')).values_list('value', 'count')
+    ]
+    return suggestions
+
+
+def rebuild():
+    """Build a fresh index from the database and drop the overlay it includes"""
+    global _index, _overlay, _last_rebuild
+    version = catalog_version()
+    with _lock:
+        overlay_before = dict(_overlay)
+    index = Index(load_suggestions(), version)
+    with _lock:
+        _index = index
+        # keep only the changes made while the index was being built
+        _overlay = {pk: entry for pk, entry in _overlay.items() if overlay_before.get(pk, 0) is not entry}
+        _last_rebuild = time.monotonic()
+    return index
+
+
+def _rebuild_in_background():
+    global _rebuilding
+
+    def run():
+        global _rebuilding
+        try:
+            rebuild()
+        finally:
+            _rebuilding = False
+            connection.close()
+
+    with _lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    threading.Thread(target=run, name='typeahead-rebuild', daemon=True).start()
+
+
+def _current_index():
+    index = _index
+    if index is None:
+        return rebuild()
+    stale = index.version != catalog_version() or len(_overlay) > OVERLAY_LIMIT
+    if stale and time.monotonic() - _last_rebuild >= MIN_REBUILD_INTERVAL:
+        if BACKGROUND_REBUILD:
+            _rebuild_in_background()
+        else:
+            index = rebuild()
+    return index
+
+
+def suggest(query, limit=LIMIT):
+    """{'products': [...], 'terms': [...]} of Suggestions for what was typed so far"""
+    prefix = normalize(query)
+    if not prefix:
+        return {'products': [], 'terms': []}
+    index = _current_index()
+    products, terms = index.lookup(prefix, limit)
+    overlay = _overlay
+    if overlay:
+        products = [s for s in products if s.key[1] not in overlay]
+        products += [
+            s for s in overlay.values()
+            if s is not None and any(phrase.startswith(prefix) for phrase in _phrases(s.label))
+        ]
+        products = _ranked(products, limit)
+    return {'products': products[:limit], 'terms': terms[:TERM_LIMIT]}
+
+
+def product_changed(product):
+    """A product saved in this process, visible to suggest() right away"""
+    if _index is None:
+        return
+    with _lock:
+        _overlay[product.pk] = product_suggestion(
+            product.pk, product.name, product.slug, product.sales_count, product.like_count
+        )
+
+
+def product_deleted(product_id):
+    if _index is None:
+        return
+    with _lock:
+        _overlay[product_id] = None
+
+
+def reset():
+    """Forget the index (tests)"""
+    global _index, _overlay, _last_rebuild
+    with _lock:
+        _index = None
+        _overlay = {}
+        _last_rebuild = 0.0
@@ -3,15 +3,23 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('home/<slug:section>/', views.home_section, name='home-section'),
     path('login/', views.login, name='login'),
     path('logout/', views.user_logout, name='logout'),
     path('signup/', views.signup, name='signup'),
     path('shop/', views.shop, name='shop'),
     path('cart/',views.cart,name='cart'),
+    path('cart/add/<int:product_id>/', views.cart_add, name='cart-add'),
+    path('cart/update/<int:product_id>/', views.cart_update, name='cart-update'),
+    path('checkout/', views.checkout, name='checkout'),
     path('contact/', views.contact, name='contact'),
     path('wishlist/',views.wishlist,name="wishlist"),
     path('user-dashboard/',views.user_dashboard,name='user-dashboard'),
     path('category/<slug:slug>/', views.category_detail, name='category-detail'),
     path('product/<slug:slug>/', views.product_detail, name='product-detail'),
-    path('search/',views.search,name="search")
+    path('product/<slug:slug>/reviews/', views.product_reviews, name='product-reviews'),
+    path('search/',views.search,name="search"),
+    path('search/suggest/', views.search_suggestions, name='search-suggest'),
+    path('cache-stats/', views.cache_stats, name='cache-stats'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
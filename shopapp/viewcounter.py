@@ -0,0 +1,144 @@
+"""
+Write-behind product view counter.
+
+Product detail pages only record a view in process memory. A background
+thread flushes the pending counts to the database in batches, either every
+VIEW_COUNTER_FLUSH_INTERVAL seconds or as soon as VIEW_COUNTER_MAX_PENDING
+distinct products are waiting, using F() expression UPDATEs so concurrent
+processes never lose increments. Each flush also adds the views to the
+hourly buckets used by `shopapp.trending`. Anything still pending is flushed
+when the process exits.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .trending import add_bucket_views, hour_index
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 30)
+MAX_PENDING = getattr(settings, 'VIEW_COUNTER_MAX_PENDING', 500)
+# number of products updated by a single UPDATE statement
+BATCH_SIZE = 200
+
+_lock = threading.Lock()
+_pending = {}  # product_id -> [views, last_viewed]
+_hourly = {}  # (product_id, hour index) -> views
+_wakeup = threading.Event()
+_flusher = None
+
+
+def record_view(product_id, when=None):
+    """Count one view of `product_id` without touching the database"""
+    when = when or timezone.now()
+    hour_key = (product_id, hour_index(when))
+    with _lock:
+        _hourly[hour_key] = _hourly.get(hour_key, 0) + 1
+        entry = _pending.get(product_id)
+        if entry is None:
+            _pending[product_id] = [1, when]
+        else:
+            entry[0] += 1
+            entry[1] = when
+        size = len(_pending)
+    _ensure_flusher()
+    if size >= MAX_PENDING:
+        _wakeup.set()
+
+
+def pending_views(product_id=None):
+    """Views not yet written to the database (for one product or in total)"""
+    with _lock:
+        if product_id is not None:
+            entry = _pending.get(product_id)
+            return entry[0] if entry else 0
+        return sum(entry[0] for entry in _pending.values())
+
+
+def _drain():
+    global _pending, _hourly
+    with _lock:
+        drained, _pending = _pending, {}
+        hourly, _hourly = _hourly, {}
+    return drained, hourly
+
+
+def flush():
+    """
+    Write every pending view to the database. Returns the number of views
+    written. On failure the drained counts are put back so they are retried.
+    """
+    drained, hourly = _drain()
+    if not drained:
+        return 0
+    try:
+        _write(drained, hourly)
+    except Exception:
+        with _lock:
+            for product_id, (views, when) in drained.items():
+                entry = _pending.setdefault(product_id, [0, when])
+                entry[0] += views
+                entry[1] = max(entry[1], when)
+            for hour_key, views in hourly.items():
+                _hourly[hour_key] = _hourly.get(hour_key, 0) + views
+        raise
+    return sum(views for views, _ in drained.values())
+
+
+def _write(drained, hourly):
+    from .models import Product
+
+    items = list(drained.items())
+    with transaction.atomic():
+        for start in range(0, len(items), BATCH_SIZE):
+            batch = items[start:start + BATCH_SIZE]
+            ids = [product_id for product_id, _ in batch]
+            Product.objects.filter(pk__in=ids).update(
+                views_count=F('views_count') + Case(
+                    *[When(pk=product_id, then=Value(views)) for product_id, (views, _) in batch],
+                    output_field=IntegerField(),
+                ),
+                last_viewed=Case(
+                    *[When(pk=product_id, then=Value(when)) for product_id, (_, when) in batch],
+                    output_field=DateTimeField(),
+                ),
+            )
+        add_bucket_views(hourly)
+
+
+def _run():
+    while True:
+        _wakeup.wait(FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception:
+            # counts were restored by flush(), try again on the next tick
+            logger.exception("view counter flush failed, %d views pending", pending_views())
+        finally:
+            # the flusher thread owns its own connection, don't leak it
+            connection.close()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run, name='view-counter-flusher', daemon=True)
+            _flusher.start()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("view counter flush at exit failed, %d views lost", pending_views())
@@ -1,50 +1,112 @@
+from django.conf import settings
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.shortcuts import redirect
 from django.contrib.auth.models import User
 from django.contrib.auth import login as auth_login
 from django.contrib.auth import authenticate
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.admin.views.decorators import staff_member_required
+import logging
 import re, random
 from django.shortcuts import render, get_object_or_404
-from .models import Category, Product
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_http_methods, require_POST
+from django.utils.http import url_has_allowed_host_and_scheme
+from .models import Category, Product, Review
+from . import search as search_index
+from . import facets
+from . import typeahead
+from . import cart as shopping_cart
+from .checkout import CheckoutError, place_order
+from .cache import cache_catalog_page, conditional_catalog_page, cache_stats as get_cache_stats
+from . import metrics as request_metrics
 from django.urls import reverse
 ##! for create custom highend search querys
-from django.db.models import Q
-##! to seperate large data set to smaller managable pages
-from django.core.paginator import Paginator
+from django.db.models import Max, Q, Subquery
+##! cursor (keyset) pagination, page N costs the same as page 1
+from .pagination import (
+    CursorPage, DEFAULT_SORT, REVIEW_ORDERING, REVIEWS_PER_PAGE, get_ordering, id_list_page, keyset_page,
+)
 # All the function call returning the objects are at models
+HOME_SECTION_LIMIT = 8  # products per home page section
+HOT_PRODUCT_COLORS = ['light-pink','light-orange','light-green','light-blue','light-red', 'light-purple', 'light-yellow', 'light-cyan']
+
+logger = logging.getLogger(__name__)
+
+##! below-the-fold home tabs, loaded over HTMX by home_section
+HOME_SECTIONS = {
+    'popular': Product.get_popular_products,
+    'new-added': Product.get_new_arrivals,
+    'trending': Product.get_trending_products,
+    'top-selling': Product.get_top_selling,
+}
+
+@cache_catalog_page()
 def home(request):
-    colors=['light-pink','light-orange','light-green','light-blue','light-red', 'light-purple', 'light-yellow', 'light-cyan']
-    products=list(Product.objects.all())
-    for product in products:
-        if product.is_hot:
-            product.class_color=random.choice(colors)
-        else:
-            product.class_color=None
-    hot_products=[product for product in products if product.is_hot]
-    normal_products=[product for product in products if not product.is_hot]
-    categories = Category.objects.all()
+    # only the card columns of the first few products, not the whole catalog
+    products = Product.card_queryset().order_by('-created_at')
+    hot_products = list(products.filter(is_hot=True)[:HOME_SECTION_LIMIT])
+    for product in hot_products:
+        product.class_color=random.choice(HOT_PRODUCT_COLORS)
+    normal_products = products.filter(is_hot=False)[:HOME_SECTION_LIMIT]
+    categories = Category.objects.only('name', 'slug', 'image')
 
     context = {
         'is_home':True, ##! yadi home ma card xa vani filter button natra total item no dekhauxa
         'categories':categories,
         'normal_products':normal_products,
         'hot_products':hot_products ,
-        'trending_products': Product.get_trending_products(),
-        'new_arrivals': Product.get_new_arrivals(),
-        'top_selling': Product.get_top_selling(),
-        'popular_products': Product.get_popular_products(),
+        'lazy_sections': list(HOME_SECTIONS),
     }
     return render(request, 'shopapp/index.html', context)
 
+@cache_catalog_page()
+def home_section(request, section):
+    """One ranking tab of the home page as an HTMX fragment"""
+    get_products = HOME_SECTIONS.get(section)
+    if get_products is None:
+        raise Http404("Unknown home section")
+    return render(request, 'shopapp/includes/_home_section.html', {
+        'products': get_products(limit=HOME_SECTION_LIMIT),
+    })
+
+##! HTTP validators of the catalog pages: the newest updated_at a page shows, in one query
+def catalog_last_modified(request):
+    latest = Category.objects.order_by().aggregate(
+        category=Max('updated_at'),
+        product=Max(Subquery(Product.objects.order_by('-updated_at').values('updated_at')[:1])),
+    )
+    return max(filter(None, latest.values()), default=None)
+
+def category_last_modified(request, slug):
+    row = Category.objects.filter(slug=slug).annotate(
+        products_updated_at=Max('products__updated_at')
+    ).values_list('updated_at', 'products_updated_at').first()
+    return max(filter(None, row)) if row else None
+
+def product_last_modified(request, slug):
+    row = Product.objects.filter(slug=slug).values_list('pk', 'updated_at', 'category__updated_at').first()
+    if row is None:
+        return None
+    request.viewed_product_id = row[0]  # a 304 is still a view
+    return max(row[1:])
+
+@conditional_catalog_page(catalog_last_modified, max_age=0)  # listings always revalidate
+@cache_catalog_page()
 def shop(request):
-    products = Product.objects.all()
+    ordering = get_ordering(request.GET.get('sort', DEFAULT_SORT))
+    filters = facets.parse_filters(request.GET)
+    products = keyset_page(
+        facets.apply_filters(Product.card_queryset(), filters), ordering, request.GET.get('cursor')
+    )
     context = {
         'is_home': False,
-        'products': products,
     }
-    return render(request, 'shopapp/shop.html', context)
+    add_facets(request, context, Product.objects.all(), filters, 'all')
+    return render_product_listing(request, 'shopapp/shop.html', context, products)
 
 
 
@@ -134,68 +196,87 @@ def search(request):
     template (`shopapp/shop
     """
     search_text = request.GET.get("search_text", "").strip()
-    page_num = int(request.GET.get('page', 1))
+    cursor = request.GET.get('cursor')
+    filters = facets.parse_filters(request.GET)
 
     context = {
         'is_home': False,
         'search_text': search_text,
-        'current_page': page_num,
     }
 
     if search_text:
         try:
-            # Split the search text into individual terms
-            terms = search_text.lower().split()
-
-            # Initialize the query for the OR logic (search any term in any relevant field)
-            query = Q()
-
-            # Create a query that matches any term in the name, description, category, etc.
-            for term in terms:
-                term_query = (
-                    Q(name__icontains=term) |
-                    Q(description__icontains=term) |
-                    Q(category__name__icontains=term) |
-                    Q(brand_name__icontains=term) |
-                    Q(tags__icontains=term)
-                )
-                query |= term_query  # Use OR for combining terms (either term can match)
-
-            # Apply the query to filter products
-            products = Product.objects.filter(query)
-
-            # Pagination
-            paginator = Paginator(products, 12)
-            products = paginator.get_page(page_num)
+            # Ranked product ids from the full-text index (any term, prefix matched),
+            # narrowed by the facets and cached per normalized query
+            product_ids = search_index.cached_product_ids(search_text, filters)
+
+            # Page over the ranked ids, loading only the products of this page
+            products = id_list_page(product_ids, search_index.load_products, cursor, cap=search_index.MAX_RESULTS)
 
             context.update({
-                'products': products,
-                'total_results': paginator.count,
                 'has_results': True
             })
+            matches = Product.objects.filter(search_index.match_q(search_text))
+            add_facets(request, context, matches, filters, search_index.split_terms(search_text))
 
         except Exception as e:
-            print(f"Search error: {e}")
+            logger.exception("search failed for %r", search_text)
+            products = CursorPage([])
             context.update({
-                'products': [],
                 'has_results': False,
                 'error': str(e)
             })
     else:
         # Show all products when no search text is provided
-        products = Product.objects.all().order_by('-created_at')
-        paginator = Paginator(products, 12)
-        products = paginator.get_page(page_num)
+        ordering = get_ordering(request.GET.get('sort', DEFAULT_SORT))
+        products = keyset_page(facets.apply_filters(Product.card_queryset(), filters), ordering, cursor)
 
         context.update({
-            'products': products,
-            'total_results': paginator.count,
             'has_results': True
         })
+        add_facets(request, context, Product.objects.all(), filters, 'all')
 
     if request.htmx:
-        return render(request, 'shopapp/includes/_search_results.html', context)
-    return render(request, 'shopapp/shop.html', context)
+        return render_product_listing(request, 'shopapp/includes/_search_results.html', context, products)
+    return render_product_listing(request, 'shopapp/shop.html', context, products)
+
+
+def search_suggestions(request):
+    """
+    Typeahead fragment for the navbar search box, answered from the in-memory
+    index. Rendered without the request so no session or user is loaded.
+    """
+    suggestions = typeahead.suggest(request.GET.get('search_text', ''))
+    return HttpResponse(render_to_string('shopapp/includes/_search_suggestions.html', suggestions))
+
+
+def add_facets(request, context, products, filters, listing):
+    """Facet counts of a listing (cached, one query on a miss); skipped for infinite scroll pages, which only render cards"""
+    if request.htmx and request.GET.get('cursor'):
+        return
+    counts = facets.cached_facet_counts(products, filters, listing)
+    context['facet_groups'] = [
+        (facet, title, counts[facet]) for facet, title in facets.FACETS.items() if counts[facet]
+    ]
+    context['has_filters'] = bool(filters)
+
+
+def render_product_listing(request, template, context, products):
+    """
+    Render a cursor paginated listing. Infinite scroll requests (HTMX with a
+    cursor) only get the next cards, not the whole page.
+    """
+    context['products'] = products
+    if products.total is not None:
+        context['total_results'] = products.total
+        context['total_is_approximate'] = products.total_is_approximate
+    if products.has_next:
+        query = request.GET.copy()
+        query['cursor'] = products.next_cursor
+        context['next_url'] = f"{request.path}?{query.urlencode()}"
+    if request.htmx and request.GET.get('cursor'):
+        return render(request, 'shopapp/includes/_product_page.html', context)
+    return render(request, template, context)
 
 
 
@@ -226,6 +307,9 @@ def login(request):
             user = authenticate(username=user.username, password=password)
             if user is not None:
                 auth_login(request, user)
+                next_url = request.GET.get('next')
+                if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+                    return redirect(next_url)
                 return redirect('home')
             else:
                 context['message'].append("Invalid credentials")
@@ -319,47 +403,144 @@ def user_dashboard(request):
                     context['message'].append("New password and confirm password don't match.")
             else:
                 context['message'].append("Current password is incorrect.")
-    return render(request,'shopapp/user-dashboard.html')
+    context['orders'] = request.user.orders.order_by('-created_at')[:20]
+    return render(request,'shopapp/user-dashboard.html', context)
 
+@conditional_catalog_page(category_last_modified)
+@cache_catalog_page()
 def category_detail(request, slug):
     category = get_object_or_404(Category, slug=slug)
-    products = category.products.all()  # Get all products in this category
+    ordering = get_ordering(request.GET.get('sort', DEFAULT_SORT))
+    products = keyset_page(Product.card_queryset().filter(category=category), ordering, request.GET.get('cursor'))  # one page of this category
     context={
         'category':category,
-        'products':products
              }
-    return render(request, 'shopapp/shop.html',context)
+    return render_product_listing(request, 'shopapp/shop.html', context, products)
 
-def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug)
-    product.increment_views()  # Record the view
-    
-    # Generate breadcrumb data
-    breadcrumb_items = [
+def product_breadcrumb(product):
+    return [
         {'title': 'Home', 'url': reverse('home')},
         {'title': product.category.name, 'url': product.category.get_absolute_url()},
         {'title': product.name, 'url': None}  # Current page doesn't need URL
     ]
+
+@conditional_catalog_page(product_last_modified)
+@cache_catalog_page()
+def product_detail(request, slug):
+    product = get_object_or_404(Product.objects.select_related('category'), slug=slug)
+    product.increment_views()  # Record the view
     
     context = {
         'product': product,
         'cross_sell_products': product.get_cross_sell_products(),
-        'upsell_products': product.get_upsell_products(),
-        'breadcrumb_items': breadcrumb_items,
+        'upsell_products': product.get_upsell_products,  # a list; queried only if the template shows it
+        'breadcrumb_items': product_breadcrumb(product),
     }
-    return render(request, 'shopapp/details.html', context)
+    response = render(request, 'shopapp/details.html', context)
+    response.viewed_product_id = product.pk  # still counted when served from the page cache
+    return response
+
+@cache_catalog_page()
+def product_reviews(request, slug):
+    """One page of a product's reviews, newest first (HTMX, lazy loaded by details.html)"""
+    reviews = Review.objects.filter(product__slug=slug).select_related('user').only(
+        'rating', 'review_text', 'created_at', 'user__username'
+    )
+    page = keyset_page(reviews, REVIEW_ORDERING, request.GET.get('cursor'), per_page=REVIEWS_PER_PAGE, count=False)
+    next_url = None
+    if page.has_next:
+        next_url = f"{request.path}?cursor={page.next_cursor}"
+    return render(request, 'shopapp/includes/_review_page.html', {'reviews': page, 'next_url': next_url})
 
 @login_required
 def wishlist(request):
-    liked_products = request.user.liked_products.all()
+    liked_products = request.user.liked_products.select_related('category')
     return render(request, 'shopapp/wishlist.html', {
         'liked_products': liked_products
     })
 
 def cart(request):
-    return render(request,'shopapp/cart.html')
+    current_cart, lines = shopping_cart.load_cart(request)
+    breadcrumb_items = [
+        {'title': 'Shop', 'url': reverse('shop')},
+        {'title': 'Cart', 'url': None},
+    ]
+    return render(request, 'shopapp/cart.html', {
+        'cart': current_cart,
+        'lines': lines,
+        'breadcrumb_items': breadcrumb_items,
+    })
+
+def _cart_quantity(request, default=1):
+    try:
+        return int(request.POST.get('quantity', default))
+    except (TypeError, ValueError):
+        return default
+
+def _cart_product(product_id):
+    try:
+        return shopping_cart.line_product(product_id)
+    except Product.DoesNotExist:
+        raise Http404("No such product")
+
+##! HTMX cart endpoints, each answers with only the fragments it changed
+@require_http_methods(['GET', 'POST'])
+def cart_add(request, product_id):
+    """GET: the add to cart form (lazy loaded on cached product pages). POST: add to the cart"""
+    context = {'product_id': product_id, 'added': False}
+    if request.method == 'POST':
+        product = _cart_product(product_id)
+        if not product.availability:
+            context['error'] = "This product is not available"
+        else:
+            current_cart = shopping_cart.get_cart(request, create=True)
+            shopping_cart.add_item(current_cart, product, max(_cart_quantity(request), 1))
+            shopping_cart.remember_count(request, current_cart)
+            context.update(added=True, cart_count=current_cart.item_count)
+        if not request.htmx:
+            return redirect('cart')
+    return render(request, 'shopapp/includes/_add_to_cart.html', context)
+
+@require_POST
+def cart_update(request, product_id):
+    """Set a line's quantity (0 removes it); returns the cart contents and the navbar count"""
+    current_cart = shopping_cart.get_cart(request)
+    if current_cart is None:
+        raise Http404("No cart")
+    quantity = 0 if request.POST.get('remove') else _cart_quantity(request, default=0)
+    shopping_cart.set_quantity(current_cart, _cart_product(product_id), quantity)
+    shopping_cart.remember_count(request, current_cart)
+    if not request.htmx:
+        return redirect('cart')
+    current_cart, lines = shopping_cart.load_cart(request)
+    return render(request, 'shopapp/includes/_cart_contents.html', {
+        'cart': current_cart,
+        'lines': lines,
+        'cart_count': current_cart.item_count,
+        'oob': True,
+    })
 
 def checkout(request):
+    if not request.user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    current_cart, lines = shopping_cart.load_cart(request)
+    if not lines:
+        return redirect('cart')
+    message = []
+    if shopping_cart.reprice(current_cart, lines):
+        message.append("Some prices changed since you added them to your cart.")
+
+    if request.method == 'POST':
+        try:
+            place_order(request.user, [(line.product_id, line.quantity) for line in lines])
+        except CheckoutError as e:
+            names = {line.product_id: line.product.name for line in lines}
+            message.append("Not enough stock for: " + ", ".join(names[pk] for pk in e.rejected))
+        else:
+            shopping_cart.clear(current_cart)
+            shopping_cart.remember_count(request, current_cart)
+            return redirect(reverse('user-dashboard') + '#orders')
+
     # Generate breadcrumb data
     breadcrumb_items = [
         {'title': 'Shop', 'url': reverse('shop')},
@@ -368,6 +549,20 @@ def checkout(request):
     
     context = {
         'breadcrumb_items': breadcrumb_items,
-        # ... other context data ...
+        'cart': current_cart,
+        'lines': lines,
+        'message': message,
     }
-    return render(request, 'shopapp/checkout.html', context)
\ No newline at end of file
+    return render(request, 'shopapp/checkout.html', context)
+
+@staff_member_required
+def cache_stats(request):
+    """Cache hit/miss counters of this process, for sizing the cache"""
+    return JsonResponse(get_cache_stats())
+
+def metrics(request):
+    """Request, SQL, template and cache metrics of this process for Prometheus (METRICS_ALLOWED_IPS or staff only)"""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if request.META.get('REMOTE_ADDR') not in allowed and not request.user.is_staff:
+        raise Http404
+    return HttpResponse(request_metrics.render_metrics(), content_type=request_metrics.CONTENT_TYPE)